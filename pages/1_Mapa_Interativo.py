@@ -1,14 +1,20 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
-from folium.plugins import MarkerCluster, HeatMap
-from streamlit_folium import st_folium
-import json
+from folium.plugins import HeatMap
 
 # Supondo que suas funções de `src` estão funcionando como antes.
 # Se precisar, podemos adaptá-las também.
-from src.loader import carregar_dados
+from src.dataset import carregar_dataset
 from src.filtros import filtros_menu, aplicar_filtros
+from src.agregados import resumo_selecao
+from src.cache import em_cache
+from src.clusters import IndiceClusters, limites_na_grade
+from src.mapas_folium import MemoriaVista, camada_agrupada, exibir_mapa, mapa_em_cache
+from src.geometria import geojson_municipios, nivel_zoom, versao_malha
+from src.densidade import PESOS, densidade_em_cache, extensao_dataset
+from src.mapas_deck import MODOS, mostrar_mapa_deck
 
 # ----- CONFIGURAÇÕES DA PÁGINA E ESTILOS -----
 st.set_page_config(layout="wide", page_title="Análise da Agricultura Familiar em Sergipe")
@@ -39,15 +45,101 @@ st.markdown("""
 
 # ----- FUNÇÕES AUXILIARES PARA ESTA PÁGINA -----
 
-def carregar_geojson(path):
-    """Carrega o arquivo GeoJSON dos municípios."""
+LIMITE_LEAFLET = 20_000  # acima disso o mapa de produtores abre em WebGL
+ZOOM_COROPLETICO = 8  # zoom inicial do mapa coroplético; depois vale o zoom da vista do usuário
+CAMINHO_GEOJSON = "data/sergipe_municipios.json"
+
+def carregar_geojson(path, zoom=8):
+    """
+    GeoJSON (texto) dos municípios, simplificado para o zoom do mapa. O arquivo é lido
+    uma vez por processo e cada nível de detalhe é serializado uma única vez (src/geometria.py).
+    """
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return geojson_municipios(zoom, path)
     except FileNotFoundError:
         st.error(f"Arquivo GeoJSON não encontrado em '{path}'. O mapa coroplético não pode ser gerado. Faça o download e coloque na pasta 'data'.")
         return None
 
+
+def limites_da_vista(bounds):
+    """Converte os limites devolvidos pelo st_folium em (sul, oeste, norte, leste)."""
+    try:
+        sw, ne = bounds["_southWest"], bounds["_northEast"]
+        limites = (sw["lat"], sw["lng"], ne["lat"], ne["lng"])
+    except (TypeError, KeyError):
+        return None
+    return None if any(v is None for v in limites) else limites
+
+
+def mapa_coropletico(df_filtrado, geojson):
+    """Mapa coroplético com o número de famílias por município."""
+    # Agrega por código IBGE (CD_MUN, resolvido na carga do dataset): junção por inteiro com o
+    # GeoJSON, sem depender da grafia dos nomes; -1 = município sem código na malha
+    codigos = df_filtrado['CD_MUN'].to_numpy()
+    cd_mun, contagem = np.unique(codigos[codigos >= 0], return_counts=True)
+    dados_municipio = pd.DataFrame({'CD_MUN': cd_mun, 'contagem_familias': contagem})
+
+    m_coropleth = folium.Map(location=[-10.57, -37.38], zoom_start=ZOOM_COROPLETICO, tiles="CartoDB positron")
+
+    folium.Choropleth(
+        geo_data=geojson,
+        name='choropleth',
+        data=dados_municipio,
+        columns=['CD_MUN', 'contagem_familias'],
+        key_on='feature.properties.CD_MUN',
+        fill_color='YlGn', # Paleta de cores Verde-Amarelado
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name='Número de Famílias Agricultoras por Município',
+        highlight=True,
+    ).add_to(m_coropleth)
+    MemoriaVista("mapa_coropletico").add_to(m_coropleth)
+    return m_coropleth
+
+
+@st.fragment
+def mostrar_mapa_coropletico(df_filtrado):
+    """
+    Mapa coroplético num fragmento: o st_folium só devolve o zoom, e mudar o zoom roda de novo
+    só este trecho (os mapas das outras abas não são reenviados). O nível de detalhe do GeoJSON
+    acompanha esse zoom; o mapa só é trocado quando o zoom passa para outro nível.
+    """
+    vista = st.session_state.get("mapa_coropletico") or {}
+    zoom = vista.get("zoom") or ZOOM_COROPLETICO
+    geojson = carregar_geojson(CAMINHO_GEOJSON, zoom)
+    if not geojson:
+        st.warning("Não foi possível carregar o arquivo GeoJSON para gerar o mapa de densidade.")
+        return
+    st.info("Mapa de densidade por município. A cor representa o número de famílias agricultoras na seleção atual.")
+
+    # Mapa montado uma vez por (versão, filtros, nível de detalhe e versão da malha) e
+    # reaproveitado entre reruns/sessões. O centro fica no navegador (ver MemoriaVista), então
+    # arrastar o mapa não roda nada no servidor
+    m_coropleth = mapa_em_cache(
+        "coropletico", df_filtrado, lambda: mapa_coropletico(df_filtrado, geojson),
+        nivel_zoom(zoom), versao_malha(CAMINHO_GEOJSON),
+    )
+    exibir_mapa(
+        m_coropleth, height=500, use_container_width=True, key="mapa_coropletico",
+        returned_objects=["zoom"], zoom=vista.get("zoom"),
+    )
+
+    # Relatório de divergências: municípios da seleção sem código/polígono na malha
+    sem_codigo = df_filtrado.loc[df_filtrado['CD_MUN'].to_numpy() < 0, 'Município']
+    if not sem_codigo.empty:
+        nomes = sorted(sem_codigo.dropna().unique())
+        st.caption(
+            f"⚠️ {len(sem_codigo)} registro(s) fora do mapa: município sem correspondência no GeoJSON "
+            f"({', '.join(nomes)})."
+        )
+
+
+def mapa_calor(pontos, centro):
+    """Mapa de calor a partir das células da grade de densidade (ver src/densidade.py)."""
+    m_calor = folium.Map(location=centro, zoom_start=8, tiles="CartoDB positron")
+    HeatMap(pontos.tolist(), radius=12, blur=10, min_opacity=0.25, max_zoom=8).add_to(m_calor)
+    return m_calor
+
 # ----- TÍTULO E INTRODUÇÃO -----
 st.title("🗺️ Análise da Agricultura Familiar em Sergipe")
 st.write("""
@@ -56,8 +148,7 @@ st.write("""
 """)
 
 # ----- CARREGAMENTO E FILTROS -----
-df = carregar_dados("data/familias_agricultoras.csv")
-geojson_sergipe = carregar_geojson("data/sergipe_municipios.json")
+df = carregar_dataset()
 
 # Filtros na BARRA LATERAL
 busca, municipio, produto, certificacao, genero, comunidade = filtros_menu(df)
@@ -73,11 +164,12 @@ if df_filtrado.empty:
     st.warning("Nenhum resultado encontrado para os filtros aplicados. Tente uma busca mais ampla.")
     st.stop()
 
-# Calcula as métricas com base no dataframe filtrado
-total_familias = len(df_filtrado)
-total_area = df_filtrado['Área Cultivada (ha)'].sum()
-total_producao = df_filtrado['Volume Produção Anual (Kg)'].sum()
-municipios_unicos = df_filtrado['Município'].nunique()
+# Calcula as métricas com base no dataframe filtrado (reaproveitadas entre sessões pelo cache)
+resumo = resumo_selecao(df_filtrado)
+total_familias = resumo['familias']
+total_area = resumo['area']
+total_producao = resumo['producao']
+municipios_unicos = resumo['municipios']
 
 col1, col2, col3, col4 = st.columns(4)
 with col1:
@@ -95,64 +187,74 @@ st.markdown("---")
 # ----- VISUALIZAÇÕES EM ABAS -----
 st.subheader("Visualizações Geográficas e de Dados")
 
-tab_mapa, tab_coropletico, tab_dados = st.tabs(["📍 Mapa de Produtores", "📊 Mapa de Densidade", "📄 Tabela de Dados"])
+tab_mapa, tab_coropletico, tab_calor, tab_dados = st.tabs(
+    ["📍 Mapa de Produtores", "📊 Mapa de Densidade", "🔥 Mapa de Calor", "📄 Tabela de Dados"]
+)
 
 # Prepara dados para os mapas (sem NaNs em lat/lon)
-df_mapa = df_filtrado.dropna(subset=["Latitude", "Longitude"]).copy()
+df_mapa = df_filtrado.dropna(subset=["Latitude", "Longitude"])
 
 with tab_mapa:
+    # Leaflet desenha cada marcador no DOM (bom para explorar e clicar, com agrupamento no
+    # servidor); o pydeck desenha em WebGL e aguenta seleções com centenas de milhares de pontos
+    backend = st.radio(
+        "Visualização", ["Marcadores agrupados (Leaflet)", "WebGL (pydeck)"], horizontal=True,
+        index=1 if len(df_mapa) > LIMITE_LEAFLET else 0, key="backend_mapa",
+    )
     st.info(f"Mostrando {len(df_mapa)} famílias no mapa. Use o zoom para separar os marcadores agrupados e clique para ver detalhes.")
-    
-    if not df_mapa.empty:
-        # Centro do mapa calculado a partir da média dos pontos filtrados
-        map_center = [df_mapa['Latitude'].mean(), df_mapa['Longitude'].mean()]
-        
-        m_cluster = folium.Map(location=map_center, zoom_start=8, tiles="CartoDB positron")
-        
-        # Agrupamento de marcadores
-        marker_cluster = MarkerCluster().add_to(m_cluster)
-
-        # Adicionar marcadores ao cluster
-        for idx, row in df_mapa.iterrows():
-            popup_html = f"""
-            <b>Família:</b> {row.get('Nome da Família', 'N/I')}<br>
-            <b>Município:</b> {row.get('Município', 'N/I')}<br>
-            <b>Produção:</b> {row.get('Item de Produção Principal', 'N/I')}<br>
-            """
-            folium.Marker(
-                [row['Latitude'], row['Longitude']],
-                popup=folium.Popup(popup_html, max_width=300)
-            ).add_to(marker_cluster)
-
-        st_folium(m_cluster, height=500, width=1200, use_container_width=True)
-    else:
+
+    # Centro do mapa a partir de todos os pontos do dataset: o mapa base não muda com os
+    # filtros, então o componente não é recriado e o zoom/posição do usuário se mantêm
+    map_center = [df['Latitude'].mean(), df['Longitude'].mean()]
+    if df_mapa.empty:
         st.warning("Nenhuma família com dados de localização para os filtros selecionados.")
+    elif backend == "WebGL (pydeck)":
+        modo_deck = st.radio("Exibir como", MODOS, horizontal=True, key="modo_deck")
+        mostrar_mapa_deck(df_mapa, modo_deck, height=500, centro=map_center)
+    else:
+        m_cluster = folium.Map(location=map_center, zoom_start=8, tiles="CartoDB positron")
+
+        # Agrupamento no servidor: só os grupos e pontos do zoom/área visíveis vão para o navegador.
+        # O st_folium devolve o zoom e os limites da tela no session_state (chave do mapa); os
+        # limites são alargados até os tiles do zoom, então arrastos curtos caem na mesma chave
+        vista = st.session_state.get("mapa_produtores") or {}
+        zoom = int(round(vista.get("zoom") or 8))
+        limites = limites_na_grade(zoom, limites_da_vista(vista.get("bounds")))
+
+        def construir_camada():
+            indice_clusters = em_cache("clusters", df_filtrado, lambda: IndiceClusters(df_filtrado))
+            return camada_agrupada(df_filtrado, indice_clusters.consultar(zoom, limites), name="Produtores")
+
+        # A camada fica no cache por (versão, filtros, zoom, tiles visíveis): reruns sem mudança de
+        # tiles ou de filtros, de qualquer sessão, reaproveitam a camada já montada
+        camada = mapa_em_cache("produtores", df_filtrado, construir_camada, zoom, limites)
+        exibir_mapa(
+            m_cluster, camada, height=500, width=1200, use_container_width=True, key="mapa_produtores",
+            returned_objects=["zoom", "bounds"],
+        )
 
 with tab_coropletico:
-    if geojson_sergipe:
-        st.info("Mapa de densidade por município. A cor representa o número de famílias agricultoras na seleção atual.")
-        
-        # Agrega dados por município para o mapa coroplético
-        dados_municipio = df_filtrado.groupby('Município').size().reset_index(name='contagem_familias')
-        
-        m_coropleth = folium.Map(location=[-10.57, -37.38], zoom_start=8, tiles="CartoDB positron")
-
-        folium.Choropleth(
-            geo_data=geojson_sergipe,
-            name='choropleth',
-            data=dados_municipio,
-            columns=['Município', 'contagem_familias'],
-            key_on='feature.properties.NM_MUN', # Verifique essa chave no seu GeoJSON! Pode ser 'name', 'NM_MUN', etc.
-            fill_color='YlGn', # Paleta de cores Verde-Amarelado
-            fill_opacity=0.7,
-            line_opacity=0.2,
-            legend_name='Número de Famílias Agricultoras por Município',
-            highlight=True,
-        ).add_to(m_coropleth)
-        
-        st_folium(m_coropleth, height=500, use_container_width=True)
+    mostrar_mapa_coropletico(df_filtrado)
+
+with tab_calor:
+    rotulo_peso = st.radio("Intensidade por", list(PESOS), horizontal=True, key="peso_calor")
+    peso = PESOS[rotulo_peso]
+    # A grade cobre sempre a extensão do dataset completo: com qualquer filtro as células são
+    # as mesmas, e só a grade (não os pontos) vai para o navegador
+    pontos_calor, maximo = densidade_em_cache(df_filtrado, peso, extensao_dataset(df))
+    if len(pontos_calor) == 0:
+        st.warning("Sem dados de localização (ou de peso) para gerar o mapa de calor.")
     else:
-        st.warning("Não foi possível carregar o arquivo GeoJSON para gerar o mapa de densidade.")
+        pico = f"{maximo:,.0f}".replace(",", ".") if maximo >= 10 else f"{maximo:.2f}".replace(".", ",")
+        st.info(
+            f"Densidade estimada por núcleo gaussiano, com intensidade por {rotulo_peso.lower()}: "
+            f"pico de {pico} por km² ({len(pontos_calor)} células da grade enviadas ao mapa)."
+        )
+        m_calor = mapa_em_cache(
+            "calor", df_filtrado,
+            lambda: mapa_calor(pontos_calor, [df['Latitude'].mean(), df['Longitude'].mean()]), peso,
+        )
+        exibir_mapa(m_calor, height=500, use_container_width=True, key="mapa_calor", returned_objects=[])
 
 
 with tab_dados:
@@ -164,6 +266,11 @@ with tab_dados:
     ]
     st.dataframe(df_filtrado[colunas_para_exibir], use_container_width=True, height=500)
 
+    # Validação feita na carga: coordenada fora do polígono do município declarado
+    n_inconsistentes = int(df_filtrado['Coordenada Inconsistente'].sum())
+    if n_inconsistentes:
+        st.caption(f"⚠️ {n_inconsistentes} registro(s) com coordenadas fora do município informado.")
+
 
 # ----- SEÇÃO DE METODOLOGIA -----
 st.markdown("---")
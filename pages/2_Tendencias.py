@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
+
+from src.dataset import carregar_dataset
+from src.cubo import cubo_dataset, matriz_anual
+from src.rankings import maiores, rankings_dataset
+from src.previsao import MODELOS, projecoes
+from src.figuras import barras, barras_por_categoria, destaque, grafico, linha
 
 # ----- CONFIGURAÇÕES E ESTILOS -----
 st.set_page_config(layout="wide", page_title="Tendências e Rankings da Produção")
@@ -19,30 +23,10 @@ st.markdown("""
 
 
 # ---- CARREGAR E PREPARAR DADOS -----
-@st.cache_data
+# A coerção dos numéricos e a coluna 'Produtividade (Kg/ha)' vêm prontas do dataset canônico.
 def carregar_dados_completos():
     try:
-        df = pd.read_csv("data/familias_agricultoras.csv", sep=';', encoding='utf-8')
-        df.columns = df.columns.str.strip()
-        
-        # Garantir colunas de localização (para o caso de arquivos sem elas)
-        if "Estado" not in df.columns: df["Estado"] = "SE"
-        if "Região" not in df.columns: df["Região"] = "Nordeste"
-
-        # Limpeza e conversão de tipos
-        numeric_cols = ['Ano', 'Volume Produção Anual (Kg)', 'Área Cultivada (ha)']
-        for col in numeric_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-        
-        df['Ano'] = df['Ano'].astype(int)
-        
-        # Criar métrica de produtividade
-        # Usamos np.divide para evitar divisão por zero, resultando em 0
-        df['Produtividade (Kg/ha)'] = np.divide(df['Volume Produção Anual (Kg)'], df['Área Cultivada (ha)'], 
-                                             out=np.zeros_like(df['Volume Produção Anual (Kg)'], dtype=float), 
-                                             where=df['Área Cultivada (ha)']!=0)
-
-        return df.copy()
+        return carregar_dataset()
     except FileNotFoundError:
         st.error("Erro: O arquivo 'data/familias_agricultoras.csv' não foi encontrado.")
         return None
@@ -81,8 +65,20 @@ col_map = {
 col_filtro = col_map[filtro_tipo]
 sub_titulo_grafico = filtro_tipo + "s"
 
+# Rankings, séries e composições saem do cubo de agregados (montado uma vez por versão do dataset)
+cubo = cubo_dataset(df)
+totais = cubo.fatiar([col_filtro])
+# Posições e top 10 pré-calculados para cada métrica (consulta direta pelo código do valor)
+rankings = rankings_dataset(df)
+
+
+def texto_posicao(ranking):
+    posicao = ranking.posicao(filtro_valor)
+    return f"{posicao}º" if posicao else "—"
+
+
 with col_select:
-    filtro_opcoes = sorted(df[col_filtro].dropna().unique())
+    filtro_opcoes = sorted(totais.index)
     filtro_valor = st.selectbox(f"Escolha o {filtro_tipo.lower()} para analisar em detalhe", filtro_opcoes)
 
 
@@ -95,62 +91,45 @@ col_rank1, col_rank2, col_rank3 = st.columns(3, gap="large")
 # Ranking 1: Por Volume Total (o principal)
 with col_rank1:
     st.subheader("Ranking por Volume (Kg)")
-    rk_volume = df.groupby(col_filtro)["Volume Produção Anual (Kg)"].sum().sort_values(ascending=False).reset_index()
-    pos_volume = rk_volume[rk_volume[col_filtro] == filtro_valor].index[0] + 1
-    
-    st.metric(f"Posição de {filtro_valor}", f"{pos_volume}º", f"de {len(rk_volume)} {sub_titulo_grafico}")
-
-    rk_volume["Destaque"] = rk_volume[col_filtro] == filtro_valor
-    fig_vol = px.bar(
-        rk_volume.head(10), x=col_filtro, y="Volume Produção Anual (Kg)",
-        color="Destaque", color_discrete_map={True: "#E76F51", False: "#264653"},
-        text_auto=True, title="Top 10 por Volume Total"
+    ranking_volume = rankings.ranking(col_filtro, "volume")
+    st.metric(f"Posição de {filtro_valor}", texto_posicao(ranking_volume), f"de {ranking_volume.total} {sub_titulo_grafico}")
+
+    rk_volume = ranking_volume.top(10)
+    grafico("ranking_volume", title="Top 10 por Volume Total", showlegend=False, xaxis_title="", yaxis_title="Volume (kg)", height=400).exibir_em_cache(
+        df, lambda: [destaque(rk_volume.index, rk_volume, filtro_valor, "#E76F51", "#264653")], col_filtro, filtro_valor
     )
-    fig_vol.update_layout(showlegend=False, xaxis_title="", yaxis_title="Volume (kg)", height=400)
-    st.plotly_chart(fig_vol, use_container_width=True)
 
 # Ranking 2: Por Produtividade Média (Eficiência)
 with col_rank2:
     st.subheader("Ranking por Produtividade (Kg/ha)")
-    rk_produtividade = df.groupby(col_filtro)['Produtividade (Kg/ha)'].mean().sort_values(ascending=False).reset_index()
-    pos_produtividade = rk_produtividade[rk_produtividade[col_filtro] == filtro_valor].index[0] + 1
+    ranking_produtividade = rankings.ranking(col_filtro, "produtividade")
+    st.metric(f"Posição de {filtro_valor}", texto_posicao(ranking_produtividade), f"de {ranking_produtividade.total} {sub_titulo_grafico}")
 
-    st.metric(f"Posição de {filtro_valor}", f"{pos_produtividade}º", f"de {len(rk_produtividade)} {sub_titulo_grafico}")
-
-    rk_produtividade["Destaque"] = rk_produtividade[col_filtro] == filtro_valor
-    fig_prod = px.bar(
-        rk_produtividade.head(10), x=col_filtro, y="Produtividade (Kg/ha)",
-        color="Destaque", color_discrete_map={True: "#E76F51", False: "#2a9d8f"},
-        text_auto='.2f', title="Top 10 por Eficiência Média"
+    rk_produtividade = ranking_produtividade.top(10)
+    grafico("ranking_produtividade", title="Top 10 por Eficiência Média", showlegend=False, xaxis_title="", yaxis_title="Kg por Hectare", height=400).exibir_em_cache(
+        df, lambda: [destaque(rk_produtividade.index, rk_produtividade, filtro_valor, "#E76F51", "#2a9d8f", formato_texto=":.2f")], col_filtro, filtro_valor
     )
-    fig_prod.update_layout(showlegend=False, xaxis_title="", yaxis_title="Kg por Hectare", height=400)
-    st.plotly_chart(fig_prod, use_container_width=True)
 
 # Ranking 3: Por Número de Famílias (Capilaridade)
 with col_rank3:
     st.subheader("Ranking por Nº de Famílias")
-    rk_familias = df.groupby(col_filtro)['Nome da Família'].nunique().sort_values(ascending=False).reset_index()
-    pos_familias = rk_familias[rk_familias[col_filtro] == filtro_valor].index[0] + 1
-
-    st.metric(f"Posição de {filtro_valor}", f"{pos_familias}º", f"de {len(rk_familias)} {sub_titulo_grafico}")
+    ranking_familias = rankings.ranking(col_filtro, "familias")
+    st.metric(f"Posição de {filtro_valor}", texto_posicao(ranking_familias), f"de {ranking_familias.total} {sub_titulo_grafico}")
 
-    rk_familias["Destaque"] = rk_familias[col_filtro] == filtro_valor
-    fig_fam = px.bar(
-        rk_familias.head(10), x=col_filtro, y="Nome da Família",
-        color="Destaque", color_discrete_map={True: "#E76F51", False: "#457b9d"},
-        text_auto=True, title="Top 10 por Base de Produtores"
+    rk_familias = ranking_familias.top(10)
+    grafico("ranking_familias", title="Top 10 por Base de Produtores", showlegend=False, xaxis_title="", yaxis_title="Nº de Famílias", height=400).exibir_em_cache(
+        df, lambda: [destaque(rk_familias.index, rk_familias, filtro_valor, "#E76F51", "#457b9d")], col_filtro, filtro_valor
     )
-    fig_fam.update_layout(showlegend=False, xaxis_title="", yaxis_title="Nº de Famílias", height=400)
-    st.plotly_chart(fig_fam, use_container_width=True)
 
 # --- NOVA ANÁLISE TEMPORAL COM ABAS ---
 st.markdown("---")
 st.markdown(f"<p class='medium-font' style='margin-top: 35px;'>📈 Análise de Desempenho ao Longo do Tempo para <i>{filtro_valor}</i></p>", unsafe_allow_html=True)
 
-df_item_selecionado = df[df[col_filtro] == filtro_valor]
+# Série, média dos pares, variação e participação saem da matriz ano × valor (uma por dimensão)
+evolucao = matriz_anual(df, col_filtro).evolucao(filtro_valor)
 
 # Verifica se há dados suficientes
-if df_item_selecionado.empty or df_item_selecionado['Ano'].nunique() < 2:
+if evolucao['valor'].notna().sum() < 2:
     st.warning(f"Não há dados históricos suficientes para analisar tendências de '{filtro_valor}'.")
 else:
     tab1, tab2, tab3 = st.tabs(["Evolução Comparativa", "Crescimento Ano a Ano (YoY)", "Composição da Produção"])
@@ -159,33 +138,76 @@ else:
         # Gráfico Comparativo
         st.markdown("##### Como a produção de '{filtro_valor}' se compara com a média de seus pares?")
         
-        # 1. Agrega dados para o item selecionado
-        trend_selecionado = df_item_selecionado.groupby('Ano')['Volume Produção Anual (Kg)'].sum().reset_index()
-        
-        # 2. Calcula a média de produção por item/ano para todos os outros
-        df_outros = df[df[col_filtro] != filtro_valor]
-        trend_media_outros = df_outros.groupby(['Ano', col_filtro])['Volume Produção Anual (Kg)'].sum().reset_index()
-        trend_media_geral = trend_media_outros.groupby('Ano')['Volume Produção Anual (Kg)'].mean().reset_index().rename(columns={'Volume Produção Anual (Kg)': 'Média dos Pares'})
-
-        # 3. Plota os dois
-        fig_comp = go.Figure()
-        fig_comp.add_trace(go.Scatter(x=trend_selecionado['Ano'], y=trend_selecionado['Volume Produção Anual (Kg)'], mode='lines+markers', name=filtro_valor, line=dict(color='#E76F51', width=4)))
-        fig_comp.add_trace(go.Scatter(x=trend_media_geral['Ano'], y=trend_media_geral['Média dos Pares'], mode='lines', name='Média dos Pares', line=dict(color='#264653', dash='dash')))
-        fig_comp.update_layout(title_text=f"Produção de '{filtro_valor}' vs. Média da Categoria", yaxis_title="Volume (Kg)", xaxis_title="Ano", legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
-        st.plotly_chart(fig_comp, use_container_width=True)
+        # 1. Série do item selecionado e 2. média de produção por ano dos demais (sem o próprio)
+        trend_selecionado = evolucao['valor'].dropna().rename('Volume Produção Anual (Kg)').reset_index()
+        trend_media_geral = evolucao['media_pares'].dropna().rename('Média dos Pares').reset_index()
+
+        # Projeção da próxima safra (ajustada para todos os valores da dimensão de uma vez)
+        col_grafico, col_projecao = st.columns([3, 1])
+        with col_projecao:
+            nome_modelo = st.radio("Modelo de projeção", list(MODELOS), key="modelo_projecao")
+            tabela_projecoes = projecoes(df, col_filtro, MODELOS[nome_modelo])
+            projecao = tabela_projecoes.loc[filtro_valor]
+            ano_projecao = int(projecao['ano'])
+            if pd.notna(projecao['previsao']):
+                st.metric(f"Projeção {ano_projecao} (Kg)", f"{projecao['previsao']:,.0f}".replace(",", "."))
+                if pd.notna(projecao['inferior']):
+                    st.caption(
+                        f"Intervalo de 95%: {projecao['inferior']:,.0f} a {projecao['superior']:,.0f} kg".replace(",", ".")
+                    )
+                else:
+                    st.caption("Poucos anos de dados para estimar o intervalo.")
+            else:
+                st.info("Dados insuficientes para projetar a próxima safra.")
+
+        # 3. Plota os dois (e a projeção, quando houver)
+        tracos = [
+            linha(trend_selecionado['Ano'], trend_selecionado['Volume Produção Anual (Kg)'], filtro_valor, 'lines+markers', line=dict(color='#E76F51', width=4)),
+            linha(trend_media_geral['Ano'], trend_media_geral['Média dos Pares'], 'Média dos Pares', line=dict(color='#264653', dash='dash')),
+        ]
+        if pd.notna(projecao['previsao']):
+            ultimo = trend_selecionado.iloc[-1]
+            intervalo = dict(
+                type='data', symmetric=False,
+                array=[0, projecao['superior'] - projecao['previsao']], arrayminus=[0, projecao['previsao'] - projecao['inferior']],
+            ) if pd.notna(projecao['inferior']) else None
+            tracos.append(linha([ultimo['Ano'], ano_projecao], [ultimo['Volume Produção Anual (Kg)'], projecao['previsao']], f'Projeção {ano_projecao}', 'lines+markers', line=dict(color='#E76F51', dash='dot'), error_y=intervalo))
+        with col_grafico:
+            grafico(
+                "comparacao_pares", yaxis_title="Volume (Kg)", xaxis_title="Ano",
+                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+            ).exibir_em_cache(
+                df, lambda: tracos, col_filtro, filtro_valor, nome_modelo,
+                layout={"title_text": f"Produção de '{filtro_valor}' vs. Média da Categoria"},
+            )
+
+        participacao = evolucao['participacao'].dropna()
+        st.caption(
+            "Participação no volume total do ano: "
+            + ", ".join(f"{ano}: {p:.1f}%".replace(".", ",") for ano, p in participacao.items())
+        )
+
+        with st.expander(f"Projeções {ano_projecao} para todos os {sub_titulo_grafico.lower()} ({nome_modelo.lower()})"):
+            tabela_exibicao = tabela_projecoes.dropna(subset=['previsao']).sort_values('previsao', ascending=False)
+            st.dataframe(
+                tabela_exibicao[['previsao', 'inferior', 'superior', 'anos_com_dados']].rename(columns={
+                    'previsao': 'Projeção (Kg)', 'inferior': 'Mínimo (95%)', 'superior': 'Máximo (95%)',
+                    'anos_com_dados': 'Anos com dados',
+                }).round(0),
+                use_container_width=True,
+            )
 
     with tab2:
         # Crescimento Ano a Ano (YoY)
         st.markdown(f"##### Qual foi a variação da produção de '{filtro_valor}' a cada ano?")
         
-        yoy_data = trend_selecionado.set_index('Ano').sort_index()
-        yoy_data['YoY (%)'] = yoy_data['Volume Produção Anual (Kg)'].pct_change() * 100
-        yoy_data = yoy_data.dropna()
+        yoy_data = evolucao['variacao'].dropna().rename('YoY (%)').to_frame()
 
-        fig_yoy = px.bar(yoy_data, x=yoy_data.index, y='YoY (%)', text_auto='.1f', title=f"Crescimento Ano a Ano (YoY) para '{filtro_valor}'")
-        fig_yoy.update_traces(marker_color=['#2a9d8f' if v > 0 else '#e76f51' for v in yoy_data['YoY (%)']])
-        fig_yoy.update_layout(yaxis_title="Variação Percentual (%)", xaxis_title="Ano")
-        st.plotly_chart(fig_yoy, use_container_width=True)
+        cores_yoy = np.where(yoy_data['YoY (%)'] > 0, '#2a9d8f', '#e76f51')
+        grafico("crescimento_anual", yaxis_title="Variação Percentual (%)", xaxis_title="Ano").exibir_em_cache(
+            df, lambda: [barras(yoy_data.index, yoy_data['YoY (%)'], cores=cores_yoy, formato_texto=":.1f")],
+            col_filtro, filtro_valor, layout={"title_text": f"Crescimento Ano a Ano (YoY) para '{filtro_valor}'"},
+        )
 
     with tab3:
         # Composição da Produção
@@ -198,10 +220,12 @@ else:
             
         st.markdown(f"##### {titulo_comp}")
         
-        comp_data = df_item_selecionado.groupby(['Ano', col_composicao])['Volume Produção Anual (Kg)'].sum().reset_index()
-        top_items = comp_data.groupby(col_composicao)['Volume Produção Anual (Kg)'].sum().nlargest(5).index
+        comp_data = cubo.fatiar(['Ano', col_composicao], {col_filtro: filtro_valor})['volume'].rename('Volume Produção Anual (Kg)').reset_index()
+        top_items = maiores(cubo.fatiar([col_composicao], {col_filtro: filtro_valor})['volume'], 5).index
         comp_data_top = comp_data[comp_data[col_composicao].isin(top_items)]
 
-        fig_comp = px.bar(comp_data_top, x="Ano", y="Volume Produção Anual (Kg)", color=col_composicao, title=f"Composição da Produção de '{filtro_valor}' (Top 5)")
-        fig_comp.update_layout(yaxis_title="Volume (Kg)", xaxis_title="Ano")
-        st.plotly_chart(fig_comp, use_container_width=True)
+        grafico("composicao", barmode="relative", yaxis_title="Volume (Kg)", xaxis_title="Ano").exibir_em_cache(
+            df, lambda: barras_por_categoria(comp_data_top, "Ano", "Volume Produção Anual (Kg)", col_composicao),
+            col_filtro, filtro_valor, col_composicao,
+            layout={"title_text": f"Composição da Produção de '{filtro_valor}' (Top 5)", "legend_title_text": col_composicao},
+        )
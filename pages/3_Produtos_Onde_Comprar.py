@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from urllib.parse import quote_plus
-from src.loader import carregar_dados
+from src.dataset import carregar_dataset
+from src.filtros import motor_filtros
+from src.vizinhos import centros_municipios, produtores_proximos
 
 # ----- CONFIGURAÇÕES INICIAIS DA PÁGINA -----
 st.set_page_config(
@@ -63,20 +66,15 @@ st.markdown("""
 st.title("🛒 Catálogo de Produtores")
 st.markdown("<p class='main-intro'>Encontre produtos frescos e orgânicos diretamente de quem produz! Use os filtros para refinar sua busca e clique em uma linha da tabela para ver mais detalhes.</p>", unsafe_allow_html=True)
 
-df = carregar_dados("data/familias_agricultoras.csv")
-
-# Garante que as colunas Latitude e Longitude são numéricas, se existirem
-if 'Latitude' in df.columns:
-    df['Latitude'] = pd.to_numeric(df['Latitude'], errors='coerce')
-if 'Longitude' in df.columns:
-    df['Longitude'] = pd.to_numeric(df['Longitude'], errors='coerce')
+# Dataset canônico: Latitude/Longitude já validadas. O DataFrame é compartilhado, não o altere no lugar.
+df = carregar_dataset()
 
 
 with st.container(border=True):
     st.subheader("🔍 Encontre o que você busca")
     col1, col2, col3 = st.columns(3)
     
-    df_filtro = df.copy()
+    df_filtro = df
     produto_selecionado = col1.selectbox("Filtrar por Produto", ["Todos"] + sorted(df["Item de Produção Principal"].dropna().unique()))
     municipio_selecionado = col2.selectbox("Filtrar por Município", ["Todos"] + sorted(df["Município"].dropna().unique()))
     certificacao_selecionada = col3.selectbox("Filtrar por Certificação", ["Todos"] + sorted(df["Tipo de Certificação"].dropna().unique()))
@@ -85,6 +83,47 @@ with st.container(border=True):
     if municipio_selecionado != "Todos": df_filtro = df_filtro[df_filtro["Município"] == municipio_selecionado]
     if certificacao_selecionada != "Todos": df_filtro = df_filtro[df_filtro["Tipo de Certificação"] == certificacao_selecionada]
 
+# ----- PRODUTORES MAIS PRÓXIMOS -----
+# Usa o produto e a certificação escolhidos acima; o município não entra, já que a ideia é
+# achar quem está perto mesmo que seja na cidade vizinha.
+with st.container(border=True):
+    st.subheader("📍 Quem vende perto de mim")
+    centros = centros_municipios(df)
+    OUTRA_LOCALIZACAO = "Informar coordenadas"
+    col_ref, col_k, col_raio = st.columns([2, 1, 1])
+    referencia = col_ref.selectbox("Estou perto de", list(centros.index) + [OUTRA_LOCALIZACAO])
+    quantidade = col_k.number_input("Quantos produtores", min_value=1, max_value=50, value=5)
+    raio_km = col_raio.number_input("Raio máximo (km, 0 = sem limite)", min_value=0.0, value=0.0, step=5.0)
+
+    if referencia == OUTRA_LOCALIZACAO:
+        col_lat, col_lon = st.columns(2)
+        minha_lat = col_lat.number_input("Latitude", min_value=-90.0, max_value=90.0, value=float(df["Latitude"].mean()), format="%.5f")
+        minha_lon = col_lon.number_input("Longitude", min_value=-180.0, max_value=180.0, value=float(df["Longitude"].mean()), format="%.5f")
+    else:
+        minha_lat, minha_lon = centros.loc[referencia]
+
+    selecao = {}
+    if produto_selecionado != "Todos": selecao["Item de Produção Principal"] = produto_selecionado
+    if certificacao_selecionada != "Todos": selecao["Tipo de Certificação"] = certificacao_selecionada
+    linhas_filtro = motor_filtros(df).selecionar(selecao)
+    mascara = None
+    if linhas_filtro is not None:
+        mascara = np.zeros(len(df), dtype=bool)
+        mascara[linhas_filtro] = True
+
+    linhas_proximas, distancias = produtores_proximos(df).consultar(
+        minha_lat, minha_lon, k=int(quantidade), raio_km=raio_km or None, mascara=mascara
+    )
+    if len(linhas_proximas) == 0:
+        st.warning("Nenhum produtor encontrado perto dessa localização com os filtros escolhidos.")
+    else:
+        proximos = df.take(linhas_proximas)[["Nome da Família", "Município", "Comunidade", "Item de Produção Principal"]]
+        proximos = proximos.rename(columns={
+            "Nome da Família": "Produtor(a)",
+            "Item de Produção Principal": "Produto Principal",
+        }).assign(**{"Distância (km)": np.round(distancias, 1)})
+        st.dataframe(proximos, hide_index=True, use_container_width=True)
+
 # ----- PREPARAÇÃO E EXIBIÇÃO DA TABELA USANDO ST.DATAFRAME -----
 if df_filtro.empty:
     st.warning("Nenhum produtor encontrado com os filtros selecionados. Por favor, ajuste suas opções.")
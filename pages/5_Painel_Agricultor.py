@@ -2,13 +2,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np # Importar numpy caso 'sum' retorne NaN
 
-# Supondo que src/loader.py existe e tem carregar_dados
-# Se não existir, você pode colocar a lógica de carregamento aqui diretamente
-# Ex: df = pd.read_csv("data/familias_agricultoras.csv", sep=";")
-# df.columns = df.columns.str.strip()
-# if "Estado" not in df.columns: df["Estado"] = "SE"
-# if "Região" not in df.columns: df["Região"] = "Nordeste"
-from src.loader import carregar_dados
+# Dataset canônico compartilhado por todas as páginas (ver src/dataset.py)
+from src.dataset import carregar_dataset
 
 # ----- CONFIGURAÇÕES E ESTILOS (MELHORIA DE UX) -----
 st.set_page_config(layout="centered", page_title="Painel do Agricultor", page_icon="👨🏾‍🌾") # Adiciona ícone e centraliza
@@ -58,7 +53,7 @@ st.write("""
 Entenda quantos produtores estão ativos, qual o volume total de produção e os principais produtos cultivados, além de como manter seu contato atualizado.
 """)
 
-df = carregar_dados("data/familias_agricultoras.csv")
+df = carregar_dataset()
 
 # --- Seleção de Município e Comunidade ---
 st.subheader("📍 Encontre Sua Comunidade")
@@ -80,7 +75,7 @@ with col_comun:
     )
 
 # --- Filtrar dados para a comunidade selecionada ---
-df_comun = df[(df["Município"] == mun) & (df["Comunidade"] == comun)].copy() # Use .copy() para evitar SettingWithCopyWarning
+df_comun = df[(df["Município"] == mun) & (df["Comunidade"] == comun)] # Somente leitura: não precisa de .copy()
 
 if df_comun.empty:
     st.warning(f"Nenhum dado encontrado para a comunidade **{comun}** em **{mun}**. Por favor, verifique a seleção ou entre em contato para cadastrar.")
@@ -100,7 +95,7 @@ with col_metric2:
 
 # --- Principais Produtos ---
 st.subheader("Harvest: Principais produtos")
-top_produtos = df_comun.groupby("Item de Produção Principal")["Volume Produção Anual (Kg)"].sum().nlargest(3).reset_index()
+top_produtos = df_comun.groupby("Item de Produção Principal", observed=True)["Volume Produção Anual (Kg)"].sum().nlargest(3).reset_index()
 if not top_produtos.empty:
     st.write("Os principais itens cultivados na sua comunidade são:")
     for idx, row in top_produtos.iterrows():
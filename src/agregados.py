@@ -0,0 +1,70 @@
+# Agregados por dimensão mantidos de forma incremental (bloco a bloco)
+
+import pandas as pd
+
+from src.cache import em_cache
+
+DIMENSOES = [
+    "Município", "Item de Produção Principal", "Comunidade",
+    "Tipo de Certificação", "Gênero Responsável", "Ano",
+]
+METRICAS = {
+    "Volume Produção Anual (Kg)": "volume",
+    "Área Cultivada (ha)": "area",
+}
+
+
+class AgregadosIncrementais:
+    """
+    Contagem de registros, volume e área por dimensão, atualizados a cada bloco.
+
+    O estado guardado é proporcional ao número de valores distintos de cada dimensão,
+    não ao número de linhas lidas, então a memória fica limitada mesmo em arquivos enormes.
+    """
+
+    def __init__(self, dimensoes=DIMENSOES):
+        self.dimensoes = list(dimensoes)
+        self.linhas = 0
+        self._tabelas = {dim: None for dim in self.dimensoes}
+
+    @property
+    def colunas(self):
+        """Colunas do CSV necessárias para atualizar os agregados."""
+        return [*self.dimensoes, *METRICAS]
+
+    def atualizar(self, bloco: pd.DataFrame):
+        """Soma um bloco de linhas (já tipado) aos agregados."""
+        if bloco.empty:
+            return
+        self.linhas += len(bloco)
+        presentes = [dim for dim in self.dimensoes if dim in bloco.columns]
+        tabela = bloco[presentes + list(METRICAS)].rename(columns=METRICAS)
+        tabela["registros"] = 1
+        medidas = [*METRICAS.values(), "registros"]
+        for dim in presentes:
+            parcial = tabela.groupby(dim, observed=True)[medidas].sum()
+            atual = self._tabelas[dim]
+            self._tabelas[dim] = parcial if atual is None else atual.add(parcial, fill_value=0)
+
+    def tabela(self, dimensao) -> pd.DataFrame:
+        """Agregados de uma dimensão, ordenados por volume (maior primeiro)."""
+        atual = self._tabelas.get(dimensao)
+        if atual is None:
+            return pd.DataFrame(columns=["volume", "area", "registros"])
+        return atual.astype({"registros": "int64"}).sort_values("volume", ascending=False)
+
+    def ranking(self, dimensao, metrica="volume") -> pd.Series:
+        """Posição (1 = maior) de cada valor da dimensão na métrica escolhida."""
+        return self.tabela(dimensao)[metrica].rank(method="min", ascending=False).astype(int)
+
+
+def resumo_selecao(df: pd.DataFrame) -> dict:
+    """Métricas-resumo de um recorte filtrado, reaproveitadas entre sessões (ver src/cache.py)."""
+    def calcular():
+        return {
+            "familias": len(df),
+            "municipios": int(df["Município"].nunique()),
+            "area": float(df["Área Cultivada (ha)"].sum()),
+            "producao": float(df["Volume Produção Anual (Kg)"].sum()),
+        }
+    return em_cache("resumo_selecao", df, calcular)
@@ -0,0 +1,235 @@
+# Índice invertido para a busca livre ("Busca") da barra lateral
+
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from src.dataset import estrutura_derivada
+from src.texto import normalizar
+
+CAMPOS_BUSCA = [
+    "Nome da Família", "Município", "Comunidade",
+    "Item de Produção Principal", "Item de Produção Secundário", "Associação/Cooperativa",
+]
+
+# Busca aproximada (tolerante a erros de digitação)
+LIMIAR_SIMILARIDADE = 0.45  # similaridade mínima (Dice sobre trigramas) para aceitar uma palavra
+MIN_CARACTERES_APROXIMADA = 4  # termos mais curtos só casam por prefixo exato
+# Máximo de postagens (palavra, trigrama) somadas por termo na busca aproximada. Um limite
+# fixo, e não de tempo, faz a mesma consulta dar sempre o mesmo resultado (que pode ir para o cache)
+MAX_POSTAGENS = 500_000
+
+
+def tokenizar(texto) -> list:
+    return normalizar(texto).split()
+
+
+def trigramas(palavra) -> set:
+    """Trigramas de uma palavra normalizada, com bordas marcadas por espaços."""
+    palavra = f"  {palavra} "
+    return {palavra[i:i + 3] for i in range(len(palavra) - 2)}
+
+
+class IndiceBusca:
+    """
+    Índice token -> valores de cada campo pesquisável, com trigramas para busca aproximada.
+
+    Os campos são categóricos, então o índice aponta para códigos de categoria (poucos),
+    e não para linhas: uma consulta vira, por campo, uma tabela de códigos aceitos que é
+    aplicada de uma só vez à coluna de códigos (O(linhas) vetorizado, sem Python por linha).
+    Os trigramas indexam o vocabulário (palavras distintas), não as linhas.
+    """
+
+    def __init__(self, df: pd.DataFrame, campos=CAMPOS_BUSCA):
+        self.n_linhas = len(df)
+        self.campos = [c for c in campos if c in df.columns]
+        self.codigos = {}
+        self.n_categorias = {}
+        # Os códigos de todos os campos num só espaço: o campo i ocupa as posições
+        # deslocamentos[i] .. deslocamentos[i] + n_categorias (a última é o código -1, ausente)
+        self.deslocamentos = np.zeros(len(self.campos) + 1, dtype=np.int64)
+        tokens, codigos = [], []
+        for i, campo in enumerate(self.campos):
+            serie = df[campo]
+            categorias = serie.array if isinstance(serie.dtype, pd.CategoricalDtype) else pd.Categorical(serie)
+            self.codigos[campo] = np.asarray(categorias.codes)
+            self.n_categorias[campo] = len(categorias.categories)
+            self.deslocamentos[i + 1] = self.deslocamentos[i] + len(categorias.categories) + 1
+            palavras = [set(normalizar(valor).split()) for valor in categorias.categories]
+            tokens.append(np.array(list(chain.from_iterable(palavras)), dtype=object))
+            quantidades = np.fromiter(map(len, palavras), dtype=np.int64, count=len(palavras))
+            codigos.append(np.repeat(np.arange(len(palavras)), quantidades) + self.deslocamentos[i])
+
+        # Vocabulário ordenado e, para cada palavra, os códigos (de qualquer campo) em que ela
+        # aparece, em sequência: a palavra t ocupa ocorrencias[inicios[t]:inicios[t + 1]]
+        ids, vocabulario = pd.factorize(np.concatenate(tokens) if tokens else np.array([], dtype=object), sort=True)
+        self.tokens = list(vocabulario)
+        n_codigos = max(int(self.deslocamentos[-1]), 1)
+        chaves = np.unique(ids.astype(np.int64) * n_codigos + (np.concatenate(codigos) if codigos else 0))
+        ids = chaves // n_codigos
+        self.ocorrencias = chaves - ids * n_codigos
+        self.inicios = np.searchsorted(ids, np.arange(len(self.tokens) + 1))
+
+        # trigrama -> posições (em self.tokens) das palavras que o contêm. Cada trigrama vira um
+        # inteiro (três pontos de código de 21 bits); as palavras são tratadas por comprimento,
+        # como matrizes de pontos de código, sem laço por palavra
+        bordas = [f"  {token} " for token in self.tokens]
+        comprimentos = np.fromiter(map(len, bordas), dtype=np.int64, count=len(bordas))
+        gramas, donos = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for comprimento in np.unique(comprimentos):
+            posicoes = np.flatnonzero(comprimentos == comprimento)
+            letras = np.array([bordas[i] for i in posicoes], dtype=f"<U{comprimento}")
+            letras = letras.view(np.uint32).reshape(len(posicoes), comprimento).astype(np.int64)
+            gramas.append(((letras[:, :-2] << 42) | (letras[:, 1:-1] << 21) | letras[:, 2:]).ravel())
+            donos.append(np.repeat(posicoes, comprimento - 2))
+        gramas, donos = np.concatenate(gramas), np.concatenate(donos)
+        ordem = np.lexsort((donos, gramas))
+        gramas, donos = gramas[ordem], donos[ordem]
+        # Pares (trigrama, palavra) repetidos (o mesmo trigrama duas vezes na palavra) contam uma vez
+        novos = np.ones(len(gramas), dtype=bool)
+        novos[1:] = (gramas[1:] != gramas[:-1]) | (donos[1:] != donos[:-1])
+        gramas, donos = gramas[novos], donos[novos]
+        self.n_trigramas = np.bincount(donos, minlength=len(self.tokens)).astype(np.int16)
+        inicios = np.flatnonzero(np.diff(gramas, prepend=-1))
+        mascara = (1 << 21) - 1
+        self.postagens = {
+            chr(chave >> 42) + chr((chave >> 21) & mascara) + chr(chave & mascara): ids.astype(np.int32)
+            for chave, ids in zip(gramas[inicios].tolist(), np.split(donos, inicios[1:]))
+        }
+
+    def _similaridade_tokens(self, termo, limiar, max_postagens):
+        """Nota (0-1) de cada palavra do vocabulário para o termo: 1 se começa com ele, senão Dice."""
+        notas = np.zeros(len(self.tokens), dtype=np.float32)
+        notas[bisect_left(self.tokens, termo):bisect_left(self.tokens, termo + "\uffff")] = 1.0
+        if len(termo) < MIN_CARACTERES_APROXIMADA:
+            return notas
+        grams = trigramas(termo)
+        comuns = np.zeros(len(self.tokens), dtype=np.int16)
+        # Trigramas mais raros primeiro: se o limite de postagens estourar, o que já foi contado é
+        # o mais seletivo, e o corte depende só do termo e do índice
+        lidas = 0
+        for grama in sorted(grams, key=lambda g: len(self.postagens.get(g, ()))):
+            ids = self.postagens.get(grama)
+            if ids is None:
+                continue
+            lidas += len(ids)
+            if lidas > max_postagens:
+                break
+            comuns[ids] += 1
+        dice = 2.0 * comuns / (len(grams) + self.n_trigramas)
+        return np.maximum(notas, np.where(dice >= limiar, dice, 0).astype(np.float32))
+
+    def tabelas_termo(self, termo, limiar=LIMIAR_SIMILARIDADE, max_postagens=MAX_POSTAGENS) -> dict:
+        """Para cada campo, nota (0-1) de cada código para o termo; só campos com alguma nota."""
+        notas_tokens = self._similaridade_tokens(termo, limiar, max_postagens)
+        aceitos = np.flatnonzero(notas_tokens)
+        # Ocorrências de todas as palavras aceitas de uma vez, cada uma com a nota da sua palavra
+        tamanhos = np.diff(self.inicios)[aceitos]
+        posicoes = np.arange(tamanhos.sum()) + np.repeat(self.inicios[aceitos] - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+        notas = np.zeros(self.deslocamentos[-1], dtype=np.float32)
+        np.maximum.at(notas, self.ocorrencias[posicoes], np.repeat(notas_tokens[aceitos], tamanhos))
+        tabelas = {}
+        for i, campo in enumerate(self.campos):
+            tabela = notas[self.deslocamentos[i]:self.deslocamentos[i + 1]]
+            if tabela.any():
+                tabelas[campo] = tabela
+        return tabelas
+
+    def nota_termo(self, tabelas: dict, linhas=None) -> np.ndarray:
+        """Melhor nota de um termo (ver `tabelas_termo`) em cada linha, ou só nas posições `linhas`."""
+        nota = np.zeros(self.n_linhas if linhas is None else len(linhas), dtype=np.float32)
+        for campo, tabela in tabelas.items():
+            codigos = self.codigos[campo] if linhas is None else self.codigos[campo][linhas]
+            np.maximum(nota, tabela[codigos], out=nota)
+        return nota
+
+    def pontuar(self, consulta, limiar=LIMIAR_SIMILARIDADE, max_postagens=MAX_POSTAGENS) -> np.ndarray:
+        """
+        Relevância (0-1) de cada linha para a consulta; 0 significa que a linha não atende.
+
+        Cada termo recebe, por linha, a melhor nota entre as palavras dos campos pesquisáveis
+        (prefixo exato vale 1; senão, similaridade de trigramas acima de `limiar`). A linha
+        precisa atender a todos os termos e sua relevância é a média das notas.
+        """
+        termos = tokenizar(consulta)
+        if not termos:
+            return np.ones(self.n_linhas, dtype=np.float32)
+        total = np.zeros(self.n_linhas, dtype=np.float32)
+        atende = np.ones(self.n_linhas, dtype=bool)
+        for termo in termos:
+            nota = self.nota_termo(self.tabelas_termo(termo, limiar, max_postagens))
+            atende &= nota > 0
+            total += nota
+        return np.where(atende, total / len(termos), 0).astype(np.float32)
+
+
+def _contido(novas: dict, antigas: dict) -> bool:
+    """Indica se todo código aceito pelas tabelas `novas` também era aceito pelas `antigas`."""
+    return all(
+        campo in antigas and not np.any((tabela > 0) & (antigas[campo] <= 0))
+        for campo, tabela in novas.items()
+    )
+
+
+class BuscaIncremental:
+    """
+    Busca de uma sessão que reaproveita os candidatos da consulta anterior.
+
+    Enquanto o usuário digita, a consulta costuma só crescer ("ita" -> "itab" -> "itab mand"):
+    os termos já completos não mudam e o último fica mais restritivo. Nesses casos o novo termo
+    é avaliado só nas linhas que atendiam à consulta anterior, e não no dataset todo. Se a
+    consulta encurta ou muda, o cálculo recomeça pelo índice completo.
+    """
+
+    def __init__(self, indice: IndiceBusca):
+        self.indice = indice
+        self.termos = ()
+        self.linhas = None
+        self._base = (None, None)  # linhas e soma das notas dos termos anteriores ao último
+        self._tabelas = None  # notas por código do último termo
+        self._soma_base = None  # soma das notas dos termos anteriores, alinhada a self.linhas
+        self._nota = None  # nota do último termo, alinhada a self.linhas
+
+    def _refinar(self, linhas, soma, tabelas):
+        """Restringe (linhas, soma) às linhas que atendem ao termo; devolve também a nota dele."""
+        nota = self.indice.nota_termo(tabelas, linhas)
+        atendem = np.flatnonzero(nota > 0)
+        if linhas is None:
+            return atendem, np.zeros(len(atendem), dtype=np.float32), nota[atendem]
+        return linhas[atendem], soma[atendem], nota[atendem]
+
+    def consultar(self, consulta):
+        """(posições, relevância) das linhas que atendem à consulta; None se ela não tem termos."""
+        termos = tuple(tokenizar(consulta))
+        if not termos:
+            self.__init__(self.indice)
+            return None
+        if termos == self.termos:
+            return self.linhas, (self._soma_base + self._nota) / len(termos)
+
+        tabelas = self.indice.tabelas_termo(termos[-1])
+        base, candidatos = (None, None), None
+        if self.termos and termos[:-1] == self.termos[:-1]:
+            # Só o último termo mudou; se ficou mais restritivo, parte do resultado anterior
+            base = self._base
+            if _contido(tabelas, self._tabelas):
+                candidatos = (self.linhas, self._soma_base)
+        elif self.termos and termos[:-1] == self.termos:
+            # Termo novo ao fim: o resultado anterior inteiro é a base
+            base = (self.linhas, self._soma_base + self._nota)
+        else:
+            for termo in termos[:-1]:
+                linhas, soma, nota = self._refinar(*base, self.indice.tabelas_termo(termo))
+                base = (linhas, soma + nota)
+
+        linhas, soma, nota = self._refinar(*(candidatos or base), tabelas)
+        self.termos, self._base, self._tabelas = termos, base, tabelas
+        self.linhas, self._soma_base, self._nota = linhas, soma, nota
+        return linhas, (soma + nota) / len(termos)
+
+
+def indice_busca(df: pd.DataFrame) -> IndiceBusca:
+    """Índice de busca do dataset, construído uma vez por versão."""
+    return estrutura_derivada(df, "indice_busca", IndiceBusca)
@@ -0,0 +1,122 @@
+# Cache LRU compartilhado entre sessões (por processo), limitado por memória
+
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+LIMITE_PADRAO_BYTES = 128 << 20
+
+
+def estimar_tamanho(valor) -> int:
+    """Estimativa (rasa) de memória ocupada por um valor guardado no cache."""
+    if valor is None:
+        return 0
+    if isinstance(valor, np.ndarray) or hasattr(valor, "nbytes"):
+        # Arrays e estruturas que informam o próprio tamanho (ex.: IndiceClusters)
+        return int(valor.nbytes)
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return int(np.sum(valor.memory_usage(index=True, deep=False)))
+    if isinstance(valor, (str, bytes)):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(estimar_tamanho(k) + estimar_tamanho(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(estimar_tamanho(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+class CacheLRU:
+    """
+    Cache LRU thread-safe com limite em bytes (estimados).
+
+    Compartilhado entre todas as sessões do processo: visitantes que chegam à mesma
+    combinação de filtros reaproveitam o resultado calculado para o primeiro.
+    """
+
+    def __init__(self, limite_bytes=LIMITE_PADRAO_BYTES):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()  # chave -> (valor, tamanho)
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave, construtor, tamanho=None):
+        """
+        Devolve o valor de `chave`, construindo com `construtor()` se não estiver no cache.
+        `tamanho` (bytes, ou função do valor construído) substitui a estimativa padrão.
+        """
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._itens[chave][0]
+            self.falhas += 1
+
+        # Construção fora do lock: outras sessões não esperam por este cálculo
+        valor = construtor()
+        if tamanho is None:
+            n_bytes = estimar_tamanho(valor)
+        else:
+            n_bytes = tamanho(valor) if callable(tamanho) else tamanho
+        if n_bytes > self.limite_bytes:
+            return valor
+
+        with self._lock:
+            if chave in self._itens:
+                self.bytes_usados -= self._itens.pop(chave)[1]
+            self._itens[chave] = (valor, n_bytes)
+            self.bytes_usados += n_bytes
+            while self.bytes_usados > self.limite_bytes:
+                _, (_, removido) = self._itens.popitem(last=False)
+                self.bytes_usados -= removido
+                self.remocoes += 1
+        return valor
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                "itens": len(self._itens),
+                "bytes_usados": self.bytes_usados,
+                "limite_bytes": self.limite_bytes,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "taxa_acerto": self.acertos / consultas if consultas else 0.0,
+                "remocoes": self.remocoes,
+            }
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.bytes_usados = 0
+
+
+# Instância única do processo para resultados de filtros e agregados derivados
+cache_resultados = CacheLRU()
+
+
+def assinatura(df: pd.DataFrame):
+    """
+    Chave do recorte `df` quando ele saiu intacto de `aplicar_filtros`
+    (versão do dataset + resumo das linhas selecionadas); None caso contrário.
+    """
+    filtro = df.attrs.get("filtro")
+    if filtro is None or df.attrs.get("linhas") != len(df):
+        return None
+    return filtro
+
+
+def em_cache(nome, df: pd.DataFrame, construtor, *parametros, tamanho=None):
+    """
+    Resultado de `construtor()` para o recorte `df`, reaproveitado entre reruns e sessões.
+    `nome` e `parametros` distinguem cálculos diferentes sobre o mesmo recorte.
+    """
+    chave = assinatura(df)
+    if chave is None:
+        return construtor()
+    return cache_resultados.obter((nome, chave, *parametros), construtor, tamanho)
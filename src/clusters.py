@@ -0,0 +1,172 @@
+# Agrupamento de pontos por nível de zoom, calculado no servidor
+
+import numpy as np
+import pandas as pd
+
+TAMANHO_TILE = 256  # pixels de um tile no zoom 0
+LADO_CELULA = 60  # lado da célula de agrupamento, em pixels de tela
+ZOOM_MAXIMO = 18  # último zoom dos tiles; aqui uma célula cobre poucas dezenas de metros
+LATITUDE_MAXIMA = 85.0511287798  # limite da projeção Web Mercator
+RAIO_ESPALHAR = 20  # raio, em pixels, do círculo em que os pontos de um grupo são espalhados no zoom máximo
+
+
+def projetar(lat, lon):
+    """Latitude/longitude -> coordenadas Web Mercator normalizadas em [0, 1] (y cresce para o sul)."""
+    lat = np.clip(np.asarray(lat, dtype="float64"), -LATITUDE_MAXIMA, LATITUDE_MAXIMA)
+    seno = np.sin(np.radians(lat))
+    x = (np.asarray(lon, dtype="float64") + 180.0) / 360.0
+    y = 0.5 - np.log((1 + seno) / (1 - seno)) / (4 * np.pi)
+    return x, y
+
+
+def desprojetar(x, y):
+    """Inverso de `projetar`: devolve (lat, lon)."""
+    lon = np.asarray(x) * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+    return lat, lon
+
+
+def limites_na_grade(zoom, limites):
+    """
+    `limites` = (sul, oeste, norte, leste) alargados até as bordas dos tiles do `zoom` (inteiro,
+    como em `IndiceClusters.consultar`). Pequenos arrastos do mapa dão os mesmos limites, então
+    servem de chave de cache; a área só cresce, e nenhum grupo visível fica de fora.
+    """
+    if limites is None:
+        return None
+    n = 2 ** int(np.clip(round(zoom), 0, ZOOM_MAXIMO))
+    sul, oeste, norte, leste = limites
+    (x0, x1), (y1, y0) = projetar([sul, norte], [oeste, leste])
+    x = [np.floor(x0 * n) / n, np.ceil(x1 * n) / n]
+    y = [np.floor(y0 * n) / n, np.ceil(y1 * n) / n]
+    (norte, sul), (oeste, leste) = desprojetar(x, y)
+    return tuple(round(float(v), 6) for v in (sul, oeste, norte, leste))
+
+
+class _Nivel:
+    """Células ocupadas de um nível: índices da grade, contagem, soma das coordenadas e um representante."""
+
+    def __init__(self, ix, iy, contagem, soma_x, soma_y, representante):
+        self.ix, self.iy = ix, iy
+        self.contagem = contagem
+        self.x = soma_x / contagem
+        self.y = soma_y / contagem
+        self.soma_x, self.soma_y = soma_x, soma_y
+        self.representante = representante
+
+    def agrupar(self):
+        """Nível do zoom anterior: cada célula junta as 2x2 células deste nível que ela cobre."""
+        ix, iy = self.ix >> 1, self.iy >> 1
+        chaves, inverso = np.unique((ix << 32) | iy, return_inverse=True)
+        representante = np.full(len(chaves), np.iinfo(np.int64).max)
+        np.minimum.at(representante, inverso, self.representante)
+        return _Nivel(
+            chaves >> 32, chaves & 0xFFFFFFFF,
+            np.bincount(inverso, weights=self.contagem).astype(np.int64),
+            np.bincount(inverso, weights=self.soma_x),
+            np.bincount(inverso, weights=self.soma_y),
+            representante,
+        )
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ix, self.iy, self.contagem, self.x, self.y,
+                                      self.soma_x, self.soma_y, self.representante))
+
+
+class IndiceClusters:
+    """
+    Hierarquia de agrupamentos em grade, um nível por zoom (no estilo do supercluster).
+
+    No zoom z o mundo tem TAMANHO_TILE·2^z pixels de largura, então células de LADO_CELULA
+    pixels têm lado LADO_CELULA / (TAMANHO_TILE·2^z) no plano Mercator normalizado. Como o
+    lado dobra a cada nível, só o nível mais fino é calculado a partir dos pontos; os demais
+    saem do nível seguinte juntando células 2x2. Uma consulta devolve só as células visíveis
+    no zoom pedido, então o que vai para o navegador depende da tela, não do total de pontos.
+    """
+
+    def __init__(self, df: pd.DataFrame, zoom_maximo=ZOOM_MAXIMO, lado_celula=LADO_CELULA):
+        self.zoom_maximo = zoom_maximo
+        lat = df["Latitude"].to_numpy(dtype="float64")
+        lon = df["Longitude"].to_numpy(dtype="float64")
+        self.linhas = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))  # posições em df
+        self.x, self.y = projetar(lat[self.linhas], lon[self.linhas])
+
+        lado = lado_celula / (TAMANHO_TILE * 2 ** zoom_maximo)
+        ix = np.floor(self.x / lado).astype(np.int64)
+        iy = np.floor(self.y / lado).astype(np.int64)
+        chaves, primeiro, inverso = np.unique((ix << 32) | iy, return_index=True, return_inverse=True)
+        contagem = np.bincount(inverso).astype(np.int64)
+        # Pontos de cada célula do nível mais fino, em sequência: a célula i vai de inicios[i]
+        # a inicios[i] + contagem[i] em `membros`
+        self.membros = np.argsort(inverso, kind="stable")
+        self.inicios = np.cumsum(contagem) - contagem
+        nivel = _Nivel(
+            chaves >> 32, chaves & 0xFFFFFFFF,
+            contagem,
+            np.bincount(inverso, weights=self.x),
+            np.bincount(inverso, weights=self.y),
+            primeiro.astype(np.int64),
+        )
+        self.niveis = [None] * (zoom_maximo + 1)
+        self.niveis[zoom_maximo] = nivel
+        for zoom in range(zoom_maximo - 1, -1, -1):
+            nivel = nivel.agrupar()
+            self.niveis[zoom] = nivel
+
+    @property
+    def nbytes(self):
+        return (self.linhas.nbytes + self.x.nbytes + self.y.nbytes + self.membros.nbytes
+                + self.inicios.nbytes + sum(n.nbytes for n in self.niveis))
+
+    def _espalhar(self, celulas, zoom):
+        """
+        Pontos das `celulas` do nível mais fino, um a um: os de células com mais de um ponto
+        ficam num círculo em volta do centro da célula (como o "spiderfy" do Leaflet.markercluster),
+        com raio em pixels de tela no `zoom`, para que cada um tenha o seu marcador e popup.
+        """
+        nivel = self.niveis[self.zoom_maximo]
+        n = nivel.contagem[celulas]
+        grupo = np.repeat(np.arange(len(celulas)), n)
+        k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)  # posição do ponto na sua célula
+        membros = self.membros[np.repeat(self.inicios[celulas], n) + k]
+
+        n_grupo = n[grupo]
+        # O círculo cresce com o grupo para os marcadores não se sobreporem
+        raio = RAIO_ESPALHAR * np.maximum(1.0, n_grupo / 9) / (TAMANHO_TILE * 2.0 ** zoom)
+        raio = np.where(n_grupo > 1, raio, 0.0)
+        angulo = 2 * np.pi * k / n_grupo
+        x = nivel.x[celulas][grupo] + raio * np.cos(angulo)
+        y = nivel.y[celulas][grupo] + raio * np.sin(angulo)
+        return x, y, np.ones(len(membros), dtype=np.int64), membros
+
+    def consultar(self, zoom, limites=None) -> pd.DataFrame:
+        """
+        Grupos e pontos visíveis no `zoom`, dentro de `limites` = (sul, oeste, norte, leste).
+
+        Colunas: lat, lon (centro do grupo), contagem e linha (posição em df de um ponto do
+        grupo; é o próprio ponto quando contagem == 1).
+
+        Do zoom máximo em diante não há mais grupos: os pontos que ainda dividem uma célula (a
+        mesma família em anos diferentes, no mesmo lugar) saem espalhados em volta dela.
+        """
+        nivel = self.niveis[int(np.clip(round(zoom), 0, self.zoom_maximo))]
+        x, y, contagem, representante = nivel.x, nivel.y, nivel.contagem, nivel.representante
+        celulas = np.arange(len(contagem))
+
+        if limites is not None:
+            sul, oeste, norte, leste = limites
+            (x0, x1), (y1, y0) = projetar([sul, norte], [oeste, leste])
+            # Margem de meia tela de cada lado, para não haver buracos ao arrastar o mapa
+            mx, my = (x1 - x0) / 2, (y1 - y0) / 2
+            visiveis = (x >= x0 - mx) & (x <= x1 + mx) & (y >= y0 - my) & (y <= y1 + my)
+            x, y, contagem, representante = x[visiveis], y[visiveis], contagem[visiveis], representante[visiveis]
+            celulas = celulas[visiveis]
+
+        if round(zoom) >= self.zoom_maximo:
+            x, y, contagem, representante = self._espalhar(celulas, zoom)
+
+        lat, lon = desprojetar(x, y)
+        return pd.DataFrame({
+            "lat": lat, "lon": lon, "contagem": contagem, "linha": self.linhas[representante],
+        })
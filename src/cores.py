@@ -0,0 +1,50 @@
+# Paleta de cores compartilhada pelos mapas (mesma cor para o mesmo município em todas as páginas)
+
+import colorsys
+import html
+
+import pandas as pd
+
+PALETA = [
+    "#d62728", "#1f77b4", "#2ca02c", "#9467bd", "#ff7f0e", "#8c564b",
+    "#7f7f7f", "#bcbd22", "#17becf", "#e377c2", "#393b79",
+]
+
+
+def cor_indice(i: int) -> str:
+    """Cor do i-ésimo valor: a paleta fixa e, depois dela, tons espaçados pela razão áurea."""
+    if i < len(PALETA):
+        return PALETA[i]
+    r, g, b = colorsys.hls_to_rgb((i * 0.618033988749895) % 1.0, 0.45, 0.65)
+    return "#{:02x}{:02x}{:02x}".format(int(r * 255), int(g * 255), int(b * 255))
+
+
+def cores_categorias(serie: pd.Series) -> dict:
+    """
+    {valor: cor} determinístico para uma coluna.
+
+    Em colunas categóricas usa todas as categorias (não só as presentes no recorte), então
+    um município mantém a mesma cor com qualquer combinação de filtros.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        valores = serie.cat.categories
+    else:
+        valores = serie.dropna().unique()
+    return {valor: cor_indice(i) for i, valor in enumerate(sorted(valores))}
+
+
+def cores_municipios(df: pd.DataFrame) -> dict:
+    return cores_categorias(df["Município"])
+
+
+def cor_rgb(cor: str) -> list:
+    """"#rrggbb" -> [r, g, b], o formato de cor do pydeck."""
+    return [int(cor[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+def itens_legenda(cores: dict, valores) -> str:
+    """HTML dos itens da legenda (bolinha colorida + nome), igual nos mapas folium e pydeck."""
+    return "".join(
+        f'<span style="color:{cores[v]}; font-size:1.2em;">&#9679;</span> {html.escape(str(v))}<br>'
+        for v in valores
+    )
@@ -0,0 +1,282 @@
+# Cubo de agregados (Ano × Município × Comunidade × Produto), construído uma vez por versão
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from src.dataset import estrutura_derivada
+
+DIMENSOES_CUBO = ["Ano", "Município", "Comunidade", "Item de Produção Principal"]
+MEDIDAS = ["volume", "area", "produtividade", "registros", "familias"]
+
+
+def _codigos(serie: pd.Series):
+    """(códigos, valores) em ordem de valor; código -1 = vazio."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return np.asarray(serie.array.codes, dtype=np.int64), serie.cat.categories
+    codigos, valores = pd.factorize(serie, sort=True)
+    return codigos.astype(np.int64), valores
+
+
+def _estender(anteriores: pd.Index, serie: pd.Series, inicio: int):
+    """
+    Valores de `serie` (completa) e códigos das linhas a partir de `inicio`, com os mesmos valores
+    e ordem de `_codigos(serie)`, mais o mapa código antigo -> código novo dos `anteriores`.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        valores = serie.cat.categories
+        codigos = np.asarray(serie.array.codes[inicio:], dtype=np.int64)
+    else:
+        cauda = serie.iloc[inicio:]
+        valores = anteriores.union(pd.Index(cauda.dropna().unique()))
+        codigos = valores.get_indexer(cauda).astype(np.int64)
+    return valores, codigos, valores.get_indexer(anteriores).astype(np.int64)
+
+
+def _recodificar(codigos: np.ndarray, mapa: np.ndarray) -> np.ndarray:
+    return np.where(codigos >= 0, mapa[np.maximum(codigos, 0)], -1)
+
+
+def _medidas_linhas(df: pd.DataFrame) -> dict:
+    """Medidas de cada linha, na forma somável guardada pelas células."""
+    volume = pd.to_numeric(df["Volume Produção Anual (Kg)"], errors="coerce").to_numpy(dtype="float64")
+    area = pd.to_numeric(df["Área Cultivada (ha)"], errors="coerce").to_numpy(dtype="float64")
+    produtividade = df["Produtividade (Kg/ha)"].to_numpy(dtype="float64")
+    com_produtividade = ~np.isnan(produtividade)
+    return {
+        "volume": np.nan_to_num(volume),
+        "area": np.nan_to_num(area),
+        "soma_produtividade": np.where(com_produtividade, produtividade, 0),
+        "n_produtividade": com_produtividade.astype("float64"),
+        "registros": np.ones(len(df)),
+    }
+
+
+class CuboAgregado:
+    """
+    Totais por célula (combinação de Ano, Município, Comunidade e Produto).
+
+    Cada célula guarda volume, área, soma e contagem da produtividade e nº de registros;
+    uma fatia (`fatiar`) soma as células com `bincount`, então rankings e séries temporais
+    percorrem as células ocupadas, e não as linhas. Famílias distintas não se somam entre
+    células (a mesma família aparece em vários anos), por isso o cubo guarda também os pares
+    (célula, família) distintos e conta famílias únicas por grupo a partir deles.
+
+    Quando o CSV só ganha linhas no fim, `anexar` monta o cubo da nova versão a partir das
+    células deste e das linhas novas, sem reagregar o arquivo inteiro.
+    """
+
+    def __init__(self, df: pd.DataFrame, dimensoes=DIMENSOES_CUBO):
+        self.dimensoes = list(dimensoes)
+        self.valores, codigos = {}, {}
+        for dim in self.dimensoes:
+            codigos[dim], self.valores[dim] = _codigos(df[dim])
+        familia, self.valores_familia = _codigos(df["Nome da Família"])
+        # Volume inteiro no CSV continua inteiro nas fatias (rótulos dos gráficos sem casas decimais)
+        self.volume_inteiro = pd.api.types.is_integer_dtype(df["Volume Produção Anual (Kg)"].dtype)
+        self._agregar(codigos, _medidas_linhas(df), np.arange(len(df)), familia)
+
+    def _agregar(self, codigos: dict, medidas: dict, par_unidade, par_familia):
+        """
+        Agrupa em células as unidades (linhas, ou células de um cubo anterior) descritas pelos
+        códigos de cada dimensão, somando as `medidas`; os pares (unidade, família) viram
+        pares (célula, família) distintos.
+        """
+        n_unidades = len(codigos[self.dimensoes[0]])
+        chave = np.zeros(n_unidades, dtype=np.int64)
+        for dim in self.dimensoes:
+            chave = chave * (len(self.valores[dim]) + 1) + (codigos[dim] + 1)
+
+        self.chaves, inverso = np.unique(chave, return_inverse=True)
+        primeira = np.zeros(len(self.chaves), dtype=np.int64)
+        primeira[inverso[::-1]] = np.arange(n_unidades - 1, -1, -1)
+        self.codigos = {dim: codigos[dim][primeira] for dim in self.dimensoes}
+
+        n = len(self.chaves)
+        self.volume = np.bincount(inverso, weights=medidas["volume"], minlength=n)
+        self.area = np.bincount(inverso, weights=medidas["area"], minlength=n)
+        self.soma_produtividade = np.bincount(inverso, weights=medidas["soma_produtividade"], minlength=n)
+        self.n_produtividade = np.bincount(inverso, weights=medidas["n_produtividade"], minlength=n)
+        self.registros = np.bincount(inverso, weights=medidas["registros"], minlength=n).astype(np.int64)
+
+        # Pares (célula, família) distintos, para contar famílias únicas em qualquer fatia
+        com_familia = par_familia >= 0
+        pares = np.unique(inverso[par_unidade[com_familia]].astype(np.int64) << 32 | par_familia[com_familia])
+        self.par_celula = pares >> 32
+        self.par_familia = pares & 0xFFFFFFFF
+
+        self._fatias = {}
+        self._lock = threading.Lock()
+
+    def anexar(self, df: pd.DataFrame, inicio: int) -> "CuboAgregado":
+        """
+        Cubo de `df` sabendo que este cubo já cobre `df.iloc[:inicio]`: as células atuais entram
+        como unidades já somadas e só as linhas novas são lidas. Este cubo não é alterado.
+        """
+        novo = CuboAgregado.__new__(CuboAgregado)
+        novo.dimensoes = self.dimensoes
+        novo.volume_inteiro = self.volume_inteiro and pd.api.types.is_integer_dtype(df["Volume Produção Anual (Kg)"].dtype)
+        novo.valores, codigos = {}, {}
+        for dim in self.dimensoes:
+            novo.valores[dim], cauda, mapa = _estender(self.valores[dim], df[dim], inicio)
+            codigos[dim] = np.concatenate([_recodificar(self.codigos[dim], mapa), cauda])
+        novo.valores_familia, familia_cauda, mapa_familia = _estender(self.valores_familia, df["Nome da Família"], inicio)
+
+        n_celulas = len(self.chaves)
+        medidas_cauda = _medidas_linhas(df.iloc[inicio:])
+        medidas = {
+            "volume": self.volume, "area": self.area, "soma_produtividade": self.soma_produtividade,
+            "n_produtividade": self.n_produtividade, "registros": self.registros.astype("float64"),
+        }
+        medidas = {nome: np.concatenate([valores, medidas_cauda[nome]]) for nome, valores in medidas.items()}
+        par_unidade = np.concatenate([self.par_celula, n_celulas + np.arange(len(df) - inicio)])
+        par_familia = np.concatenate([_recodificar(self.par_familia, mapa_familia), familia_cauda])
+        novo._agregar(codigos, medidas, par_unidade, par_familia)
+        return novo
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (
+            self.chaves, self.volume, self.area, self.soma_produtividade, self.n_produtividade,
+            self.registros, self.par_celula, self.par_familia, *self.codigos.values(),
+        ))
+
+    def codigo(self, dimensao, valor) -> int:
+        """Código de `valor` na dimensão (-1 se não existir)."""
+        posicao = self.valores[dimensao].get_indexer([valor])[0]
+        return int(posicao)
+
+    def _celulas(self, onde: dict) -> np.ndarray:
+        """Máscara das células que atendem a `onde` ({dimensão: valor})."""
+        mascara = np.ones(len(self.chaves), dtype=bool)
+        for dim, valor in onde.items():
+            mascara &= self.codigos[dim] == self.codigo(dim, valor)
+        return mascara
+
+    def fatiar(self, por, onde=None) -> pd.DataFrame:
+        """
+        Medidas agrupadas pelas dimensões `por`, só nas células que atendem a `onde`.
+
+        Colunas: volume, area (somas), produtividade (média por registro), registros e
+        familias (distintas). Índice: os valores das dimensões, em ordem; valores vazios
+        ficam de fora, como num `groupby(observed=True)`. O resultado é memorizado.
+        """
+        por = [por] if isinstance(por, str) else list(por)
+        onde = dict(onde or {})
+        chave_fatia = (tuple(por), tuple(sorted(onde.items())))
+        with self._lock:
+            if chave_fatia in self._fatias:
+                return self._fatias[chave_fatia]
+
+        celulas = self._celulas(onde)
+        for dim in por:
+            celulas &= self.codigos[dim] >= 0
+        grupo = np.zeros(len(self.chaves), dtype=np.int64)
+        for dim in por:
+            grupo = grupo * len(self.valores[dim]) + self.codigos[dim]
+        grupos, inverso = np.unique(grupo[celulas], return_inverse=True)
+        n = len(grupos)
+
+        soma = lambda medida: np.bincount(inverso, weights=medida[celulas], minlength=n)
+        n_produtividade = soma(self.n_produtividade)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            produtividade = soma(self.soma_produtividade) / n_produtividade
+
+        # Famílias distintas: pares (grupo, família) únicos entre as células selecionadas
+        grupo_da_celula = np.full(len(self.chaves), -1, dtype=np.int64)
+        grupo_da_celula[celulas] = inverso
+        par_grupo = grupo_da_celula[self.par_celula]
+        selecionados = par_grupo >= 0
+        pares = np.unique(par_grupo[selecionados] << 32 | self.par_familia[selecionados])
+        familias = np.bincount(pares >> 32, minlength=n)
+
+        # Decompõe o código do grupo de volta nos códigos de cada dimensão
+        niveis, resto = [], grupos
+        for dim in reversed(por):
+            base = len(self.valores[dim])
+            niveis.append(self.valores[dim][resto % base])
+            resto = resto // base
+        niveis.reverse()
+        indice = (pd.MultiIndex.from_arrays(niveis, names=por) if len(por) > 1
+                  else pd.Index(niveis[0], name=por[0]) if por else pd.RangeIndex(n))
+
+        fatia = pd.DataFrame({
+            "volume": soma(self.volume).astype(np.int64) if self.volume_inteiro else soma(self.volume),
+            "area": soma(self.area),
+            "produtividade": produtividade,
+            "registros": soma(self.registros).astype(np.int64),
+            "familias": familias.astype(np.int64),
+        }, index=indice)
+        with self._lock:
+            self._fatias[chave_fatia] = fatia
+        return fatia
+
+
+def cubo_dataset(df: pd.DataFrame) -> CuboAgregado:
+    """Cubo de agregados do dataset, construído uma vez por versão (e estendido nos acréscimos ao CSV)."""
+    return estrutura_derivada(df, "cubo_agregado", CuboAgregado, anexar=CuboAgregado.anexar)
+
+
+class MatrizAnual:
+    """
+    Matriz ano × valor de uma dimensão (ex.: volume por ano e município), tirada do cubo.
+
+    Com os totais e o nº de valores presentes em cada ano guardados, a série de qualquer valor,
+    a média dos demais (deixando o próprio de fora), a variação ano a ano e a participação no
+    total saem de poucas operações sobre uma coluna, sem refiltrar ou reagrupar linhas.
+    """
+
+    def __init__(self, cubo: CuboAgregado, dimensao, medida="volume"):
+        fatia = cubo.fatiar(["Ano", dimensao])[medida]
+        anos = fatia.index.get_level_values("Ano")
+        self.anos = pd.Index(np.unique(anos), name="Ano")
+        self.valores = cubo.valores[dimensao]
+        linha = self.anos.get_indexer(anos)
+        coluna = self.valores.get_indexer(fatia.index.get_level_values(dimensao))
+
+        self.matriz = np.zeros((len(self.anos), len(self.valores)))
+        self.presente = np.zeros(self.matriz.shape, dtype=bool)
+        self.matriz[linha, coluna] = fatia.to_numpy(dtype="float64")
+        self.presente[linha, coluna] = True
+        self.total_ano = self.matriz.sum(axis=1)
+        self.presentes_ano = self.presente.sum(axis=1)
+
+    @property
+    def nbytes(self):
+        return self.matriz.nbytes + self.presente.nbytes + self.total_ano.nbytes + self.presentes_ano.nbytes
+
+    def evolucao(self, valor) -> pd.DataFrame:
+        """
+        Por ano: o valor da medida (NaN nos anos sem registro), a média dos pares presentes
+        no ano, a variação (%) em relação ao ano anterior com registro e a participação (%)
+        no total do ano.
+        """
+        codigo = self.valores.get_indexer([valor])[0]
+        if codigo < 0:
+            serie, presente = np.zeros(len(self.anos)), np.zeros(len(self.anos), dtype=bool)
+        else:
+            serie, presente = self.matriz[:, codigo], self.presente[:, codigo]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pares = self.presentes_ano - presente
+            media_pares = np.where(pares > 0, (self.total_ano - serie) / pares, np.nan)
+            participacao = np.where(presente, 100 * serie / self.total_ano, np.nan)
+            variacao = np.full(len(self.anos), np.nan)
+            anos_com_dados = np.flatnonzero(presente)
+            anteriores = serie[anos_com_dados[:-1]]
+            variacao[anos_com_dados[1:]] = 100 * (serie[anos_com_dados[1:]] / anteriores - 1)
+
+        return pd.DataFrame({
+            "valor": np.where(presente, serie, np.nan),
+            "media_pares": media_pares,
+            "variacao": variacao,
+            "participacao": participacao,
+        }, index=self.anos)
+
+
+def matriz_anual(df: pd.DataFrame, dimensao, medida="volume") -> MatrizAnual:
+    """`MatrizAnual` do dataset para a dimensão e a medida, construída uma vez por versão."""
+    return estrutura_derivada(
+        df, f"matriz_anual:{dimensao}:{medida}", lambda d: MatrizAnual(cubo_dataset(d), dimensao, medida)
+    )
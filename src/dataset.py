@@ -0,0 +1,234 @@
+# Modelo de dados canônico compartilhado por todas as páginas
+
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from src.geometria import malha_municipios
+from src.loader import carregar_dados
+from src.texto import normalizar_nome
+
+CAMINHO_DADOS = "data/familias_agricultoras.csv"
+
+COLUNAS_NUMERICAS = ["Ano", "Volume Produção Anual (Kg)", "Área Cultivada (ha)"]
+
+INTERVALO_OBSERVACAO = 5.0  # segundos entre verificações do CSV
+
+# Cache por processo: caminho -> (bruto, DataFrame enriquecido).
+# Uma única cópia residente por caminho.
+_datasets = {}
+_lock = threading.Lock()
+_observadores = {}
+_lock_observadores = threading.Lock()
+
+# Estruturas derivadas (índices, máscaras, cubos...): nome -> (versão, ref. ao DataFrame, nº de linhas, estrutura)
+_estruturas = {}
+_lock_estruturas = threading.RLock()
+
+
+def _tabela_municipios() -> dict:
+    """{nome normalizado: CD_MUN} da malha de municípios; vazia se o GeoJSON não puder ser lido."""
+    try:
+        return malha_municipios().codigos_por_nome()
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _codigos_municipio(municipios: pd.Series) -> pd.Series:
+    """
+    Código IBGE (CD_MUN) de cada linha, resolvido por nome sem acentos/maiúsculas; -1 se não há.
+    A busca na tabela é feita uma vez por município distinto, não por linha.
+    """
+    categorias = municipios.array if isinstance(municipios.dtype, pd.CategoricalDtype) else pd.Categorical(municipios)
+    tabela = _tabela_municipios()
+    # Posição extra no fim: código de categoria -1 (município ausente)
+    por_categoria = np.array(
+        [tabela.get(normalizar_nome(nome), -1) for nome in categorias.categories] + [-1], dtype=np.int32
+    )
+    return pd.Series(por_categoria[np.asarray(categorias.codes)], index=municipios.index)
+
+
+def _validar_coordenadas(bruto: pd.DataFrame, cd_mun: pd.Series) -> dict:
+    """
+    Município em que cada coordenada realmente cai (CD_MUN_GEO, -1 fora da malha) e a marca de
+    coordenada inconsistente: o município declarado tem polígono, mas o ponto não está nele.
+    """
+    lat = pd.to_numeric(bruto["Latitude"], errors="coerce").to_numpy(dtype="float64")
+    lon = pd.to_numeric(bruto["Longitude"], errors="coerce").to_numpy(dtype="float64")
+    try:
+        cd_geo = malha_municipios().codigos_em(lat, lon)
+    except (OSError, ValueError, KeyError):
+        cd_geo = np.full(len(bruto), -1, dtype=np.int32)
+    declarado = cd_mun.to_numpy()
+    return {
+        "CD_MUN_GEO": pd.Series(cd_geo, index=bruto.index),
+        "Coordenada Inconsistente": pd.Series((declarado >= 0) & (cd_geo != declarado), index=bruto.index),
+    }
+
+
+def _derivados(bruto: pd.DataFrame) -> dict:
+    """Colunas validadas/derivadas de um trecho do DataFrame bruto."""
+    derivados = {}
+
+    # Garantir colunas de localização (para o caso de arquivos sem elas)
+    for col, padrao in (("Estado", "SE"), ("Região", "Nordeste")):
+        serie = bruto[col] if col in bruto.columns else pd.Series(padrao, index=bruto.index)
+        derivados[col] = serie.astype("category")
+
+    for col in COLUNAS_NUMERICAS:
+        serie = bruto[col]
+        if serie.isna().any() or not pd.api.types.is_numeric_dtype(serie):
+            serie = pd.to_numeric(serie, errors="coerce").fillna(0)
+        derivados[col] = serie
+    derivados["Ano"] = derivados["Ano"].astype("int16")
+
+    # Produtividade: divisão protegida, área zero resulta em 0
+    volume = derivados["Volume Produção Anual (Kg)"].to_numpy(dtype="float64")
+    area = derivados["Área Cultivada (ha)"].to_numpy(dtype="float64")
+    derivados["Produtividade (Kg/ha)"] = pd.Series(
+        np.divide(volume, area, out=np.zeros_like(volume), where=area != 0), index=bruto.index
+    )
+
+    derivados["CD_MUN"] = _codigos_municipio(bruto["Município"])
+    derivados.update(_validar_coordenadas(bruto, derivados["CD_MUN"]))
+
+    if "Data Última Certificação" in bruto.columns:
+        derivados["Data Última Certificação"] = pd.to_datetime(
+            bruto["Data Última Certificação"], format="%d/%m/%Y", errors="coerce"
+        )
+    return derivados
+
+
+def _concatenar(anterior: pd.Series, novo: pd.Series) -> pd.Series:
+    if isinstance(anterior.dtype, pd.CategoricalDtype):
+        return pd.Series(union_categoricals([anterior, novo], ignore_order=True))
+    return pd.concat([anterior, novo], ignore_index=True)
+
+
+def _enriquecer(bruto: pd.DataFrame, anterior: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Valida os numéricos e acrescenta as colunas derivadas usadas pelas páginas.
+
+    Com `anterior` (versão enriquecida das primeiras linhas de `bruto`), só as linhas
+    novas são processadas e as colunas derivadas antigas são reaproveitadas.
+    """
+    inicio = 0 if anterior is None else len(anterior)
+    # Cópia rasa: as colunas originais são compartilhadas com o cache do loader,
+    # só as colunas reatribuídas abaixo ocupam memória nova.
+    df = bruto.copy(deep=False)
+    for col, serie in _derivados(bruto.iloc[inicio:]).items():
+        if anterior is not None:
+            serie = _concatenar(anterior[col], serie)
+        df[col] = serie.to_numpy() if not isinstance(serie.dtype, pd.CategoricalDtype) else serie.array
+
+    df.attrs = {
+        "versao": bruto.attrs.get("versao"),
+        # Versão e tamanho da qual esta é um acréscimo (ver `estrutura_derivada`)
+        "versao_anterior": None if anterior is None else anterior.attrs.get("versao"),
+        "linhas_anteriores": inicio,
+        "municipios_sem_codigo": _sem_codigo(df),
+        "coordenadas_inconsistentes": int(df["Coordenada Inconsistente"].sum()),
+    }
+    return df
+
+
+def _sem_codigo(df: pd.DataFrame) -> dict:
+    """Relatório de divergências: {município: nº de linhas} dos nomes sem CD_MUN na malha."""
+    sem_codigo = df.loc[df["CD_MUN"].to_numpy() < 0, "Município"]
+    contagens = sem_codigo.value_counts()
+    return {str(nome): int(n) for nome, n in contagens[contagens > 0].items()}
+
+
+def carregar_dataset(caminho_csv: str = CAMINHO_DADOS, observar: bool = True) -> pd.DataFrame:
+    """
+    Devolve o DataFrame canônico, enriquecido uma única vez por processo.
+
+    Todas as páginas recebem o mesmo objeto, que deve ser tratado como somente leitura:
+    filtre/selecione à vontade, mas não atribua colunas nele. Quando o CSV muda, o loader
+    entrega um novo DataFrame bruto; se as linhas só foram acrescentadas ao fim do arquivo,
+    apenas elas são enriquecidas (e as estruturas que sabem se estender, como o cubo, só
+    somam as novas). Com `observar=True`, uma thread
+    verifica o arquivo periodicamente e já deixa a nova versão pronta para o próximo rerun.
+    """
+    if observar:
+        observar_arquivo(caminho_csv)
+    bruto = carregar_dados(caminho_csv)
+    with _lock:
+        em_cache = _datasets.get(caminho_csv)
+        if em_cache is not None and em_cache[0] is bruto:
+            return em_cache[1]
+
+        anexado = (
+            em_cache is not None
+            and bruto.attrs.get("versao_anterior") == em_cache[1].attrs.get("versao")
+            and bruto.attrs.get("linhas_anteriores") == len(em_cache[1])
+        )
+        df = _enriquecer(bruto, anterior=em_cache[1] if anexado else None)
+        _datasets[caminho_csv] = (bruto, df)
+        return df
+
+
+def versao_dataset(df: pd.DataFrame):
+    """Identificador do conteúdo que originou o DataFrame (preservado em filtros e seleções)."""
+    return df.attrs.get("versao")
+
+
+def e_canonico(df: pd.DataFrame) -> bool:
+    """Indica se `df` é o DataFrame canônico (e não um recorte dele)."""
+    with _lock:
+        return any(canonico is df for _, canonico in _datasets.values())
+
+
+def estrutura_derivada(df: pd.DataFrame, nome: str, construtor, anexar=None):
+    """
+    Devolve `construtor(df)`, construído uma única vez por versão do dataset.
+
+    Só o DataFrame canônico (o mesmo objeto devolvido por `carregar_dataset`) é cacheado:
+    as estruturas guardam posições de linha, que não valem para recortes filtrados.
+    Quando chega uma nova versão, a estrutura da versão anterior é descartada. Se a nova
+    versão só acrescentou linhas à guardada e há `anexar(estrutura, df, inicio)`, ela é
+    estendida com as linhas a partir de `inicio` em vez de reconstruída.
+    """
+    versao = versao_dataset(df)
+    with _lock_estruturas:
+        entrada = _estruturas.get(nome)
+        if entrada is not None and entrada[0] == versao and entrada[1]() is df:
+            return entrada[3]
+        canonico = e_canonico(df)
+        if (
+            canonico and anexar is not None and entrada is not None
+            and df.attrs.get("versao_anterior") == entrada[0]
+            and df.attrs.get("linhas_anteriores") == entrada[2]
+        ):
+            estrutura = anexar(entrada[3], df, entrada[2])
+        else:
+            estrutura = construtor(df)
+        if canonico:
+            _estruturas[nome] = (versao, weakref.ref(df), len(df), estrutura)
+        return estrutura
+
+
+def _observar(caminho_csv, intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            carregar_dataset(caminho_csv, observar=False)
+        except Exception:
+            # Arquivo sendo regravado ou temporariamente inválido: tenta de novo no próximo ciclo
+            continue
+
+
+def observar_arquivo(caminho_csv: str = CAMINHO_DADOS, intervalo: float = INTERVALO_OBSERVACAO):
+    """Inicia, uma vez por processo, a thread que recarrega o dataset quando o CSV muda."""
+    with _lock_observadores:
+        if caminho_csv in _observadores:
+            return
+        thread = threading.Thread(
+            target=_observar, args=(caminho_csv, intervalo), name=f"observador:{caminho_csv}", daemon=True
+        )
+        _observadores[caminho_csv] = thread
+        thread.start()
@@ -0,0 +1,103 @@
+# Densidade de produtores em grade, calculada no servidor (só a grade vai para o navegador)
+
+import numpy as np
+import pandas as pd
+
+from src.cache import em_cache
+from src.dataset import estrutura_derivada
+
+RESOLUCAO = 200  # células no lado maior da grade
+LARGURA_BANDA_KM = 4.0  # desvio padrão do núcleo gaussiano
+KM_POR_GRAU = 111.32
+LIMIAR_RELATIVO = 0.02  # células abaixo desta fração do máximo não são enviadas
+
+# Pesos disponíveis: rótulo -> coluna (None = cada família conta 1)
+PESOS = {
+    "Nº de famílias": None,
+    "Volume de produção (Kg)": "Volume Produção Anual (Kg)",
+    "Área cultivada (ha)": "Área Cultivada (ha)",
+}
+
+
+def extensao(df: pd.DataFrame, margem_km=3 * LARGURA_BANDA_KM):
+    """(sul, oeste, norte, leste) das coordenadas de `df`, com uma margem para o núcleo não ser cortado."""
+    lat, lon = df["Latitude"], df["Longitude"]
+    sul, norte = lat.min(), lat.max()
+    margem_lat = margem_km / KM_POR_GRAU
+    margem_lon = margem_km / (KM_POR_GRAU * np.cos(np.radians((sul + norte) / 2)))
+    return (float(sul - margem_lat), float(lon.min() - margem_lon),
+            float(norte + margem_lat), float(lon.max() + margem_lon))
+
+
+def extensao_dataset(df: pd.DataFrame):
+    """`extensao` do DataFrame canônico, calculada uma vez por versão (min/max já ignoram NaN)."""
+    return estrutura_derivada(df, "extensao", extensao)
+
+
+def _nucleo(n, sigma):
+    """Matriz n×n da convolução gaussiana 1D (desvio `sigma` em células), aplicada como produto."""
+    distancia = np.arange(n)[:, None] - np.arange(n)[None, :]
+    nucleo = np.exp(-0.5 * (distancia / sigma) ** 2)
+    return nucleo / (sigma * np.sqrt(2 * np.pi))
+
+
+def grade_densidade(lat, lon, pesos, limites, resolucao=RESOLUCAO, largura_banda_km=LARGURA_BANDA_KM):
+    """
+    Estimativa de densidade por núcleo gaussiano numa grade regular sobre `limites`.
+
+    Os pontos são somados nas células com um único `bincount` (com pesos) e a grade é
+    suavizada pelo núcleo separável: uma convolução por eixo, K_lat · G · K_lonᵀ. O custo
+    depende do número de pontos (uma passada) e do tamanho da grade, nunca de pares de pontos.
+    Devolve (densidade em peso/km², latitudes e longitudes dos centros das células).
+    """
+    sul, oeste, norte, leste = limites
+    km_lat = KM_POR_GRAU
+    km_lon = KM_POR_GRAU * np.cos(np.radians((sul + norte) / 2))
+    # Células quadradas (em km), com `resolucao` células no lado maior
+    lado_km = max((norte - sul) * km_lat, (leste - oeste) * km_lon) / resolucao
+    n_lat = max(1, int(np.ceil((norte - sul) * km_lat / lado_km)))
+    n_lon = max(1, int(np.ceil((leste - oeste) * km_lon / lado_km)))
+    passo_lat, passo_lon = lado_km / km_lat, lado_km / km_lon
+
+    i = np.floor((np.asarray(lat) - sul) / passo_lat).astype(np.int64)
+    j = np.floor((np.asarray(lon) - oeste) / passo_lon).astype(np.int64)
+    dentro = (i >= 0) & (i < n_lat) & (j >= 0) & (j < n_lon)
+    pesos = None if pesos is None else np.asarray(pesos, dtype="float64")[dentro]
+    grade = np.bincount(i[dentro] * n_lon + j[dentro], weights=pesos, minlength=n_lat * n_lon)
+    grade = grade.reshape(n_lat, n_lon)
+
+    sigma = largura_banda_km / lado_km
+    densidade = _nucleo(n_lat, sigma) @ grade @ _nucleo(n_lon, sigma).T / lado_km ** 2
+    centros_lat = sul + (np.arange(n_lat) + 0.5) * passo_lat
+    centros_lon = oeste + (np.arange(n_lon) + 0.5) * passo_lon
+    return densidade, centros_lat, centros_lon
+
+
+def pontos_densidade(df: pd.DataFrame, peso=None, limites=None, limiar=LIMIAR_RELATIVO):
+    """
+    (pontos, máximo): as células relevantes da grade como vetor (n, 3) de [lat, lon,
+    intensidade em 0..1], pronto para o `HeatMap`, e a densidade máxima absoluta (peso/km²).
+    """
+    vazio = (np.empty((0, 3)), 0.0)
+    com_coordenadas = df.dropna(subset=["Latitude", "Longitude"])
+    if com_coordenadas.empty:
+        return vazio
+    pesos = None
+    if peso is not None:
+        pesos = pd.to_numeric(com_coordenadas[peso], errors="coerce").fillna(0).clip(lower=0).to_numpy()
+    densidade, centros_lat, centros_lon = grade_densidade(
+        com_coordenadas["Latitude"].to_numpy(dtype="float64"),
+        com_coordenadas["Longitude"].to_numpy(dtype="float64"),
+        pesos,
+        limites or extensao(com_coordenadas),
+    )
+    maximo = float(densidade.max())
+    if maximo <= 0:
+        return vazio
+    i, j = np.nonzero(densidade >= limiar * maximo)
+    return np.column_stack([centros_lat[i], centros_lon[j], densidade[i, j] / maximo]), maximo
+
+
+def densidade_em_cache(df: pd.DataFrame, peso=None, limites=None):
+    """`pontos_densidade` reaproveitado por versão do dataset, filtros, peso e extensão da grade."""
+    return em_cache("densidade", df, lambda: pontos_densidade(df, peso, limites), peso, limites)
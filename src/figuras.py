@@ -0,0 +1,176 @@
+# Camada de gráficos: figuras plotly com layout validado uma vez e figuras prontas guardadas no cache
+
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from plotly.colors import qualitative
+
+from src.cache import cache_resultados, em_cache
+from src.dataset import e_canonico, versao_dataset
+from src.reducao import reduzir
+
+LIMITE_WEBGL = 5_000  # pontos por traço acima dos quais linhas e dispersões usam Scattergl
+LIMITE_PONTOS = 2_000  # pontos por linha enviados ao navegador; acima disso a série é reduzida
+PALETA_CATEGORIAS = qualitative.Plotly
+
+
+def _array(valores) -> np.ndarray:
+    """Valores como array NumPy (categorias viram objetos, para o plotly não tentar convertê-las)."""
+    if isinstance(valores, (pd.Series, pd.Index)):
+        if isinstance(valores.dtype, pd.CategoricalDtype):
+            return valores.astype(object).to_numpy()
+        return valores.to_numpy()
+    return np.asarray(valores)
+
+
+def _sem_vazios(traco: dict) -> dict:
+    return {chave: valor for chave, valor in traco.items() if valor is not None}
+
+
+# ----- TRAÇOS -----
+# Cada função devolve o traço já no formato do plotly.js ({"type": ..., propriedades}, sem
+# valores None nem atalhos como `title_text`): ele entra na figura sem passar por validação.
+
+def barras(categorias, valores, cores=None, horizontal=False, formato_texto=None, nome=None):
+    """Barras (uma por categoria), com uma cor por barra opcional e o valor escrito na barra."""
+    eixo_valor = "x" if horizontal else "y"
+    return _sem_vazios({
+        "type": "bar",
+        "x": _array(valores if horizontal else categorias),
+        "y": _array(categorias if horizontal else valores),
+        "orientation": "h" if horizontal else "v",
+        "marker": None if cores is None else {"color": _array(cores)},
+        "name": nome,
+        "texttemplate": None if formato_texto is None else f"%{{{eixo_valor}{formato_texto}}}",
+    })
+
+
+def destaque(categorias, valores, selecionado, cor_destaque, cor_base, formato_texto=""):
+    """Barras de um ranking com o valor `selecionado` em outra cor."""
+    categorias = _array(categorias)
+    cores = np.where(categorias == selecionado, cor_destaque, cor_base)
+    return barras(categorias, valores, cores=cores, formato_texto=formato_texto)
+
+
+def linha(x, y, nome=None, modo="lines", limite_pontos=LIMITE_PONTOS, reducao="lttb", **estilo):
+    """
+    Linha ou dispersão. Séries com mais de `limite_pontos` pontos são reduzidas antes de sair do
+    servidor (`src.reducao`: LTTB ou mín-máx, que mantêm picos e vales); arrays por ponto em
+    `estilo` (ex.: `text`, `customdata`) acompanham. Com `limite_pontos=None` a série vai
+    inteira e, acima de LIMITE_WEBGL pontos, vira `Scattergl` (desenho em WebGL).
+    """
+    x, y = _array(x), _array(y)
+    if limite_pontos is not None and len(x) > limite_pontos:
+        indices = reduzir(x, y, limite_pontos, reducao)
+        por_ponto = lambda valor: isinstance(valor, (list, np.ndarray, pd.Series)) and len(valor) == len(x)
+        estilo = {chave: _array(valor)[indices] if por_ponto(valor) else valor for chave, valor in estilo.items()}
+        x, y = x[indices], y[indices]
+    return _sem_vazios({
+        "type": "scattergl" if len(x) > LIMITE_WEBGL else "scatter",
+        "x": x, "y": y, "name": nome, "mode": modo, **estilo,
+    })
+
+
+def pizza(rotulos, valores, buraco=0.0, info="percent+label"):
+    return {"type": "pie", "labels": _array(rotulos), "values": _array(valores), "hole": buraco, "textinfo": info}
+
+
+def barras_por_categoria(df: pd.DataFrame, x, y, categoria, cores=None):
+    """Um traço de barras por valor de `categoria` (barras empilhadas, como `px.bar(color=...)`)."""
+    tracos = []
+    for i, (valor, grupo) in enumerate(df.groupby(categoria, observed=True, sort=False)):
+        cor = (cores or {}).get(valor, PALETA_CATEGORIAS[i % len(PALETA_CATEGORIAS)])
+        tracos.append({**barras(grupo[x], grupo[y], nome=str(valor)), "marker": {"color": cor}})
+    return tracos
+
+
+# ----- FIGURAS -----
+
+def _mesclar(base: dict, extra: dict) -> dict:
+    """`base` com as chaves de `extra` por cima (dicionários aninhados mesclados); não altera `base`."""
+    resultado = dict(base)
+    for chave, valor in extra.items():
+        if isinstance(valor, dict) and isinstance(resultado.get(chave), dict):
+            valor = _mesclar(resultado[chave], valor)
+        resultado[chave] = valor
+    return resultado
+
+
+class FiguraPronta(go.Figure):
+    """
+    Figura já montada (dicionário no formato do plotly.js) para o `st.plotly_chart`.
+
+    Um dicionário passado ao `st.plotly_chart` é validado de novo pelo plotly; de uma
+    `go.Figure` ele só pede `to_dict()`, que aqui devolve o dicionário guardado, sem validação
+    nem cópia. O dicionário pode estar no cache, compartilhado entre sessões: não o altere.
+    """
+
+    def __init__(self, dicionario: dict):
+        super().__init__()
+        self._dicionario = dicionario
+
+    def to_dict(self):
+        return self._dicionario
+
+
+class Grafico:
+    """
+    Modelo de um gráfico: o layout fixo é validado pelo plotly uma única vez e guardado
+    como dicionário.
+
+    Cada figura é um dicionário novo (modelo + traços + layout variável, ex.: título), montado
+    sem os validadores do plotly nem o processamento do plotly express. Com `exibir_em_cache`
+    a figura pronta fica no cache por (gráfico, assinatura do recorte, parâmetros, layout) e
+    é reaproveitada por reruns e sessões. Nada mutável é compartilhado, então as exibições de
+    sessões diferentes não esperam umas pelas outras.
+    """
+
+    def __init__(self, nome, **layout):
+        self.nome = nome
+        self.layout = go.Figure(layout=layout).to_dict()["layout"]
+
+    def montar(self, tracos, layout=None) -> dict:
+        """Dicionário da figura com `tracos` e o `layout` variável (validado, é pequeno)."""
+        variavel = go.Layout(layout).to_plotly_json() if layout else {}
+        return {"data": list(tracos), "layout": _mesclar(self.layout, variavel)}
+
+    def exibir(self, tracos, layout=None, **kwargs):
+        """Monta a figura com `tracos` (e o `layout` variável) e exibe."""
+        return self._mostrar(self.montar(tracos, layout), **kwargs)
+
+    def exibir_em_cache(self, df: pd.DataFrame, construtor, *parametros, layout=None, **kwargs):
+        """
+        Como `exibir`, com a figura montada a partir de `construtor()` (os traços) guardada por
+        (gráfico, assinatura de `df`, parâmetros, layout): reruns com os mesmos filtros não
+        recalculam os dados nem remontam a figura.
+        """
+        nome = f"grafico_{self.nome}"
+        chave_layout = json.dumps(layout or {}, sort_keys=True, default=str)
+        montar = lambda: self.montar(construtor(), layout)
+        if e_canonico(df):
+            # Dataset completo (sem filtros): a versão basta para identificar o conteúdo
+            figura = cache_resultados.obter((nome, ("canonico", versao_dataset(df)), *parametros, chave_layout), montar)
+        else:
+            figura = em_cache(nome, df, montar, *parametros, chave_layout)
+        return self._mostrar(figura, **kwargs)
+
+    @staticmethod
+    def _mostrar(figura: dict, **kwargs):
+        kwargs.setdefault("use_container_width", True)
+        return st.plotly_chart(FiguraPronta(figura), **kwargs)
+
+
+_graficos = {}
+_lock_graficos = threading.Lock()
+
+
+def grafico(nome, **layout) -> Grafico:
+    """O `Grafico` chamado `nome`; o layout fixo só é usado na primeira chamada."""
+    with _lock_graficos:
+        if nome not in _graficos:
+            _graficos[nome] = Grafico(nome, **layout)
+        return _graficos[nome]
@@ -1,7 +1,143 @@
 # Em src/filtros.py
 
+import hashlib
+
 import streamlit as st
 import pandas as pd
+import numpy as np
+
+from src.busca import BuscaIncremental, indice_busca, tokenizar
+from src.cache import cache_resultados
+from src.dataset import e_canonico, estrutura_derivada, versao_dataset
+
+# Colunas dos filtros categóricos, na ordem dos argumentos de `aplicar_filtros`
+COLUNAS_FILTRO = [
+    "Município", "Item de Produção Principal", "Tipo de Certificação",
+    "Gênero Responsável", "Comunidade",
+]
+# Chave de cada filtro no session_state
+CHAVES_FILTRO = {
+    "Município": "filtro_municipio",
+    "Item de Produção Principal": "filtro_produto",
+    "Tipo de Certificação": "filtro_certificacao",
+    "Gênero Responsável": "filtro_genero",
+    "Comunidade": "filtro_comunidade",
+}
+
+
+class MotorFiltros:
+    """
+    Posições de linha pré-calculadas para cada valor das colunas filtráveis.
+
+    Para cada coluna guardamos os códigos de categoria e as posições das linhas ordenadas
+    por código; as linhas de um valor são uma fatia (sem cópia) desse vetor. Combinar
+    filtros parte da menor fatia e confere os códigos das demais colunas só nessas linhas,
+    e o DataFrame final é materializado uma única vez com `take`.
+    """
+
+    def __init__(self, df: pd.DataFrame, colunas=COLUNAS_FILTRO):
+        self.n_linhas = len(df)
+        self.codigos = {}
+        self.codigo_por_valor = {}
+        self.ordem = {}
+        self.limites = {}
+        self.valores_ordenados = {}
+        for col in colunas:
+            serie = df[col]
+            categorias = serie.array if isinstance(serie.dtype, pd.CategoricalDtype) else pd.Categorical(serie)
+            codigos = np.asarray(categorias.codes)
+            ordem = np.argsort(codigos, kind="stable").astype(np.int32)
+            self.codigos[col] = codigos
+            self.codigo_por_valor[col] = {valor: i for i, valor in enumerate(categorias.categories)}
+            # (código, valor) em ordem alfabética, para montar as opções dos filtros
+            self.valores_ordenados[col] = sorted(enumerate(categorias.categories), key=lambda item: item[1])
+            self.ordem[col] = ordem
+            # limites[k]:limites[k + 1] delimita, em `ordem`, as linhas com código k (-1 = vazio)
+            self.limites[col] = np.searchsorted(codigos[ordem], np.arange(len(categorias.categories) + 1))
+
+    def linhas_do_valor(self, coluna, valor) -> np.ndarray:
+        """Posições (ordenadas) das linhas em que `coluna == valor`."""
+        codigo = self.codigo_por_valor[coluna].get(valor)
+        if codigo is None:
+            return np.empty(0, dtype=np.int32)
+        limites = self.limites[coluna]
+        return self.ordem[coluna][limites[codigo]:limites[codigo + 1]]
+
+    def selecionar(self, selecao: dict, mascara=None):
+        """
+        Posições das linhas que atendem a todos os filtros de `selecao` ({coluna: valor})
+        e, opcionalmente, a uma máscara booleana extra (ex.: resultado da busca).
+        Devolve None quando nada restringe a seleção (todas as linhas).
+        """
+        if not selecao:
+            return None if mascara is None else np.flatnonzero(mascara)
+        fatias = sorted(
+            ((col, self.linhas_do_valor(col, valor)) for col, valor in selecao.items()),
+            key=lambda item: len(item[1]),
+        )
+        coluna_base, linhas = fatias[0]
+        for col, _ in fatias[1:]:
+            if len(linhas) == 0:
+                break
+            linhas = linhas[self.codigos[col][linhas] == self.codigo_por_valor[col][selecao[col]]]
+        if mascara is not None:
+            linhas = linhas[mascara[linhas]]
+        return linhas
+
+    def contagens(self, coluna, selecao: dict, mascara=None) -> np.ndarray:
+        """
+        Nº de linhas por código de `coluna` sob os demais filtros (o filtro da própria
+        coluna é ignorado, como numa busca facetada). Sem outros filtros, vem direto dos limites.
+        """
+        outras = {col: valor for col, valor in selecao.items() if col != coluna}
+        linhas = self.selecionar(outras, mascara)
+        if linhas is None:
+            return np.diff(self.limites[coluna])
+        codigos = self.codigos[coluna][linhas]
+        return np.bincount(codigos[codigos >= 0], minlength=len(self.limites[coluna]) - 1)
+
+    def opcoes(self, coluna, selecao: dict, mascara=None) -> dict:
+        """{valor: contagem} em ordem alfabética, só com valores que trazem resultado (e o atual)."""
+        contagens = self.contagens(coluna, selecao, mascara)
+        atual = selecao.get(coluna)
+        return {
+            valor: int(contagens[codigo])
+            for codigo, valor in self.valores_ordenados[coluna]
+            if contagens[codigo] > 0 or valor == atual
+        }
+
+
+def motor_filtros(df: pd.DataFrame) -> MotorFiltros:
+    """Motor de filtros do dataset, construído uma vez por versão."""
+    return estrutura_derivada(df, "motor_filtros", MotorFiltros)
+
+
+def resultado_busca(df: pd.DataFrame, busca):
+    """
+    (posições, relevância) das linhas que atendem à busca, ou None se ela está vazia.
+
+    No dataset canônico a busca é incremental por sessão (ver `BuscaIncremental`): uma
+    consulta que estende a anterior só é avaliada nas linhas que já atendiam a ela.
+    """
+    indice = indice_busca(df)
+    if not e_canonico(df):
+        if not tokenizar(busca):
+            return None
+        notas = indice.pontuar(busca)
+        linhas = np.flatnonzero(notas)
+        return linhas, notas[linhas]
+    estado = st.session_state.get("_busca_incremental")
+    if estado is None or estado.indice is not indice:
+        estado = BuscaIncremental(indice)
+        st.session_state["_busca_incremental"] = estado
+    return estado.consultar(busca)
+
+
+def _mascara(n_linhas, linhas) -> np.ndarray:
+    mascara = np.zeros(n_linhas, dtype=bool)
+    mascara[linhas] = True
+    return mascara
+
 
 def filtros_menu(df: pd.DataFrame):
     """
@@ -35,35 +171,32 @@ def filtros_menu(df: pd.DataFrame):
         key='filtro_busca' # Chave para o session_state
     )
 
-    municipio = st.sidebar.selectbox(
-        "Município",
-        options=["Todos"] + sorted(df["Município"].unique().tolist()),
-        key='filtro_municipio'
-    )
+    # --- FILTROS FACETADOS ---
+    # Cada lista mostra só os valores que ainda trazem resultado sob os demais filtros ativos,
+    # com a contagem de registros, ex.: "Lagarto (12)". As contagens saem do motor de filtros.
+    motor = motor_filtros(df)
+    encontradas = resultado_busca(df, busca)
+    mascara_busca = None if encontradas is None else _mascara(len(df), encontradas[0])
+    selecao = {
+        col: st.session_state.get(chave, "Todos")
+        for col, chave in CHAVES_FILTRO.items()
+        if st.session_state.get(chave, "Todos") != "Todos"
+    }
 
-    produto = st.sidebar.selectbox(
-        "Produção Principal",
-        options=["Todos"] + sorted(df["Item de Produção Principal"].unique().tolist()),
-        key='filtro_produto'
-    )
+    def selectbox_facetado(rotulo, coluna):
+        opcoes = motor.opcoes(coluna, selecao, mascara_busca)
+        return st.sidebar.selectbox(
+            rotulo,
+            options=["Todos"] + list(opcoes),
+            format_func=lambda valor: valor if valor == "Todos" else f"{valor} ({opcoes[valor]})",
+            key=CHAVES_FILTRO[coluna]
+        )
 
-    certificacao = st.sidebar.selectbox(
-        "Certificação",
-        options=["Todos"] + sorted(df["Tipo de Certificação"].unique().tolist()),
-        key='filtro_certificacao'
-    )
-
-    genero = st.sidebar.selectbox(
-        "Gênero Responsável",
-        options=["Todos"] + sorted(df["Gênero Responsável"].unique().tolist()),
-        key='filtro_genero'
-    )
-
-    comunidade = st.sidebar.selectbox(
-        "Comunidade",
-        options=["Todos"] + sorted(df["Comunidade"].unique().tolist()),
-        key='filtro_comunidade'
-    )
+    municipio = selectbox_facetado("Município", "Município")
+    produto = selectbox_facetado("Produção Principal", "Item de Produção Principal")
+    certificacao = selectbox_facetado("Certificação", "Tipo de Certificação")
+    genero = selectbox_facetado("Gênero Responsável", "Gênero Responsável")
+    comunidade = selectbox_facetado("Comunidade", "Comunidade")
 
     # --- ALTERADO: Botão com Callback ---
     # Removemos o `if` e adicionamos o argumento `on_click`.
@@ -77,28 +210,50 @@ def filtros_menu(df: pd.DataFrame):
 
 
 def aplicar_filtros(df: pd.DataFrame, busca, municipio, produto, certificacao, genero, comunidade):
-    """Aplica os filtros selecionados ao DataFrame."""
-    df_filtrado = df.copy()
-
-    if busca:
-        # Busca em múltiplas colunas de forma insensível a maiúsculas/minúsculas
-        df_filtrado = df_filtrado[
-            df_filtrado.apply(lambda row: busca.lower() in str(row).lower(), axis=1)
-        ]
-
-    if municipio != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Município"] == municipio]
+    """
+    Aplica os filtros selecionados ao DataFrame.
 
-    if produto != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Item de Produção Principal"] == produto]
+    As posições resultantes ficam no cache LRU do processo, com chave (versão do dataset,
+    busca, município, produto, certificação, gênero, comunidade), e são reaproveitadas por
+    qualquer sessão com a mesma combinação. O recorte devolvido carrega em `attrs` a
+    assinatura do resultado (versão + resumo das posições), usada pelos caches de agregados,
+    gráficos e mapas (ver `src.cache.assinatura`): consultas diferentes com o mesmo resultado,
+    como "itab" e "itaba" enquanto se digita, não reconstroem mapas nem gráficos.
+    Com busca, as linhas vêm ordenadas por relevância (melhores correspondências primeiro).
+    """
+    valores = (municipio, produto, certificacao, genero, comunidade)
+    selecao = {col: valor for col, valor in zip(COLUNAS_FILTRO, valores) if valor != "Todos"}
+    termos = " ".join(tokenizar(busca)) if busca else ""
 
-    if certificacao != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Tipo de Certificação"] == certificacao]
+    def calcular_linhas():
+        encontradas = resultado_busca(df, termos) if termos else None
+        if encontradas is None:
+            return motor_filtros(df).selecionar(selecao)
+        # Índice invertido: ignora maiúsculas/acentos e casa cada termo como prefixo ou,
+        # com erros de digitação, por trigramas com alguma palavra de família, município,
+        # comunidade, produtos ou cooperativa
+        notas = np.zeros(len(df), dtype=np.float32)
+        notas[encontradas[0]] = encontradas[1]
+        linhas = motor_filtros(df).selecionar(selecao, notas > 0)
+        return linhas[np.argsort(-notas[linhas], kind="stable")]
 
-    if genero != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Gênero Responsável"] == genero]
+    def calcular():
+        linhas = calcular_linhas()
+        resumo = None if linhas is None else hashlib.blake2b(linhas.tobytes(), digest_size=16).hexdigest()
+        return linhas, resumo
 
-    if comunidade != "Todos":
-        df_filtrado = df_filtrado[df_filtrado["Comunidade"] == comunidade]
+    if not e_canonico(df):
+        # Recorte arbitrário: posições não são comparáveis entre chamadas, nada de cache
+        linhas = calcular_linhas()
+        if linhas is None:
+            return df
+        resultado = df.take(linhas)
+        resultado.attrs.pop("filtro", None)
+        return resultado
 
-    return df_filtrado
+    versao = versao_dataset(df)
+    linhas, resumo = cache_resultados.obter(("linhas", versao, termos, *valores), calcular)
+    # Sem filtros ativos: cópia rasa (sem copiar dados), só para carregar a assinatura em attrs
+    resultado = df.copy(deep=False) if linhas is None else df.take(linhas)
+    resultado.attrs = {**df.attrs, "filtro": (versao, resumo), "linhas": len(resultado)}
+    return resultado
@@ -0,0 +1,348 @@
+# Geometria dos municípios: carga única, simplificação por zoom e GeoJSON já serializado
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.texto import normalizar_nome
+
+CAMINHO_MUNICIPIOS = "data/sergipe_municipios.json"
+ZOOMS_SIMPLIFICACAO = (6, 8, 10, 12)  # um nível de detalhe por faixa de zoom
+PRECISAO = 6  # casas decimais usadas para reconhecer vértices compartilhados entre polígonos
+RESOLUCAO_GRADE = 256  # células por lado da grade do índice espacial
+PARES_POR_LOTE = 1_000_000  # pares ponto x aresta avaliados de uma vez no teste de paridade
+
+# Cache por processo: caminho -> (mtime, MalhaMunicipios)
+_malhas = {}
+_lock = threading.Lock()
+
+
+def tolerancia_zoom(zoom) -> float:
+    """Tolerância de simplificação (em graus) equivalente a cerca de 1 pixel no `zoom`."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def nivel_zoom(zoom) -> int:
+    """Nível de detalhe pré-calculado usado para o `zoom` (o maior que não passa dele)."""
+    return max([z for z in ZOOMS_SIMPLIFICACAO if z <= zoom], default=ZOOMS_SIMPLIFICACAO[0])
+
+
+def douglas_peucker(pontos: np.ndarray, tolerancia: float) -> np.ndarray:
+    """
+    Simplifica uma linha mantendo as extremidades.
+
+    O ponto mais distante da corda é sempre mantido, então um arco nunca vira uma reta e um
+    anel formado por arcos simplificados continua sendo um polígono válido.
+    """
+    n = len(pontos)
+    if n <= 2:
+        return pontos
+    manter = np.zeros(n, dtype=bool)
+    manter[[0, -1]] = True
+    pilha = [(0, n - 1, True)]
+    while pilha:
+        i, j, forcar = pilha.pop()
+        if j <= i + 1:
+            continue
+        a, b = pontos[i], pontos[j]
+        trecho = pontos[i + 1:j]
+        dx, dy = b - a
+        comprimento = np.hypot(dx, dy)
+        if comprimento == 0:
+            # Arco fechado (começa e termina no mesmo vértice): distância ao ponto inicial
+            distancias = np.hypot(trecho[:, 0] - a[0], trecho[:, 1] - a[1])
+        else:
+            distancias = np.abs(dx * (trecho[:, 1] - a[1]) - dy * (trecho[:, 0] - a[0])) / comprimento
+        k = int(np.argmax(distancias))
+        if forcar or distancias[k] > tolerancia:
+            meio = i + 1 + k
+            manter[meio] = True
+            pilha.extend(((i, meio, False), (meio, j, False)))
+    return pontos[manter]
+
+
+def _aneis(geometria):
+    """Polígonos da geometria como listas de anéis (Polygon ou MultiPolygon)."""
+    if geometria["type"] == "Polygon":
+        return [geometria["coordinates"]]
+    if geometria["type"] == "MultiPolygon":
+        return geometria["coordinates"]
+    raise ValueError(f"Geometria não suportada: {geometria['type']}")
+
+
+class MalhaMunicipios:
+    """
+    Polígonos dos municípios decompostos em arcos compartilhados (como no TopoJSON).
+
+    Cada anel é cortado nos vértices de junção (onde três ou mais municípios se encontram ou
+    onde uma divisa compartilhada começa/termina). Uma divisa entre dois municípios vira um
+    único arco, simplificado uma única vez por tolerância e usado pelos dois lados, então as
+    versões simplificadas não abrem frestas nem sobreposições entre vizinhos.
+    """
+
+    def __init__(self, geojson: dict):
+        # CD_MUN (código IBGE) como inteiro: é a chave de junção com o dataset (coluna CD_MUN)
+        self.propriedades = [
+            {**f["properties"], "CD_MUN": int(f["properties"]["CD_MUN"])} if "CD_MUN" in f["properties"]
+            else dict(f["properties"])
+            for f in geojson["features"]
+        ]
+
+        # Anéis abertos (sem repetir o primeiro vértice), em coordenadas e ids de vértice
+        aneis = []
+        for feicao in geojson["features"]:
+            for poligono in _aneis(feicao["geometry"]):
+                for anel in poligono:
+                    coords = np.asarray(anel, dtype="float64")[:, :2]
+                    if len(coords) > 1 and np.array_equal(coords[0], coords[-1]):
+                        coords = coords[:-1]
+                    aneis.append(coords)
+        todos = np.concatenate(aneis)
+        chaves = np.round(todos * 10 ** PRECISAO).astype(np.int64)
+        _, primeiro, ids = np.unique(chaves, axis=0, return_index=True, return_inverse=True)
+        ids = ids.ravel()
+        self._vertices = todos[primeiro]
+        limites = np.cumsum([0] + [len(a) for a in aneis])
+        aneis_ids = [ids[limites[k]:limites[k + 1]] for k in range(len(aneis))]
+
+        # Junção: vértice com mais de dois vizinhos distintos somando todos os anéis
+        vizinhos = np.concatenate([
+            np.column_stack([np.concatenate([a, a]), np.concatenate([np.roll(a, 1), np.roll(a, -1)])])
+            for a in aneis_ids
+        ])
+        vizinhos = np.unique(vizinhos, axis=0)
+        juncao = np.bincount(vizinhos[:, 0], minlength=len(self._vertices)) != 2
+
+        self.arcos = []  # ids de vértice de cada arco, na orientação canônica
+        indice_arco = {}
+        self._aneis = []  # cada anel: lista de (arco, invertido)
+        for a in aneis_ids:
+            posicoes = np.flatnonzero(juncao[a])
+            if len(posicoes) == 0:
+                # Anel sem junções: um único arco fechado, começando no menor id (forma canônica)
+                inicio = int(np.argmin(a))
+                pedacos = [np.concatenate([np.roll(a, -inicio), a[inicio:inicio + 1]])]
+            else:
+                a = np.roll(a, -posicoes[0])
+                cortes = list(posicoes - posicoes[0]) + [len(a)]
+                fechado = np.concatenate([a, a[:1]])
+                pedacos = [fechado[i:j + 1] for i, j in zip(cortes[:-1], cortes[1:])]
+            anel = []
+            for pedaco in pedacos:
+                direto, inverso = tuple(pedaco.tolist()), tuple(pedaco[::-1].tolist())
+                canonico = min(direto, inverso)
+                if canonico not in indice_arco:
+                    indice_arco[canonico] = len(self.arcos)
+                    self.arcos.append(np.array(canonico, dtype=np.int64))
+                anel.append((indice_arco[canonico], canonico != direto))
+            self._aneis.append(anel)
+
+        # Estrutura das feições: feição -> polígonos -> posições em self._aneis
+        self._feicoes = []
+        k = 0
+        for feicao in geojson["features"]:
+            poligonos = []
+            for poligono in _aneis(feicao["geometry"]):
+                poligonos.append(list(range(k, k + len(poligono))))
+                k += len(poligono)
+            self._feicoes.append((feicao["geometry"]["type"], poligonos))
+
+        self._coordenadas_aneis = aneis
+        self._feicao_do_anel = np.array(
+            [f for f, (_, poligonos) in enumerate(self._feicoes) for poligono in poligonos for _ in poligono],
+            dtype=np.int32,
+        )
+        self._localizador = None
+
+        self._simplificados = {}  # tolerância -> lista de arcos simplificados (coordenadas)
+        self._serializados = {}  # nível de zoom -> GeoJSON em texto
+        self._lock = threading.Lock()
+
+    @property
+    def localizador(self) -> "LocalizadorMunicipios":
+        """Índice espacial dos polígonos em resolução original (construído na primeira consulta)."""
+        with self._lock:
+            if self._localizador is None:
+                self._localizador = LocalizadorMunicipios(self._coordenadas_aneis, self._feicao_do_anel)
+            return self._localizador
+
+    def codigos_em(self, lat, lon) -> np.ndarray:
+        """CD_MUN do município que contém cada ponto; -1 fora de todos os polígonos."""
+        feicoes = self.localizador.localizar(lat, lon)
+        codigos = np.array([p.get("CD_MUN", -1) for p in self.propriedades] + [-1], dtype=np.int32)
+        return codigos[feicoes]
+
+    def codigos_por_nome(self) -> dict:
+        """{nome normalizado do município: CD_MUN}."""
+        return {
+            normalizar_nome(p["NM_MUN"]): p["CD_MUN"]
+            for p in self.propriedades
+            if "NM_MUN" in p and "CD_MUN" in p
+        }
+
+    @property
+    def n_vertices(self) -> int:
+        return sum(len(arco) - 1 for arco in self.arcos)
+
+    def _arcos_simplificados(self, tolerancia):
+        """Arcos simplificados com a tolerância, calculados uma vez (memorizados)."""
+        with self._lock:
+            if tolerancia not in self._simplificados:
+                self._simplificados[tolerancia] = [
+                    douglas_peucker(self._vertices[arco], tolerancia) for arco in self.arcos
+                ]
+            return self._simplificados[tolerancia]
+
+    def geojson(self, tolerancia=0.0) -> dict:
+        """FeatureCollection com os anéis remontados a partir dos arcos simplificados."""
+        arcos = self._arcos_simplificados(tolerancia) if tolerancia > 0 else [self._vertices[a] for a in self.arcos]
+
+        def remontar(anel):
+            partes = []
+            for i, (arco, invertido) in enumerate(anel):
+                coords = arcos[arco][::-1] if invertido else arcos[arco]
+                partes.append(coords if i == 0 else coords[1:])
+            return np.round(np.concatenate(partes), PRECISAO).tolist()
+
+        feicoes = []
+        for propriedades, (tipo, poligonos) in zip(self.propriedades, self._feicoes):
+            coordenadas = [[remontar(self._aneis[k]) for k in poligono] for poligono in poligonos]
+            feicoes.append({
+                "type": "Feature",
+                "properties": propriedades,
+                "geometry": {"type": tipo, "coordinates": coordenadas[0] if tipo == "Polygon" else coordenadas},
+            })
+        return {"type": "FeatureCollection", "features": feicoes}
+
+    def serializado(self, zoom) -> str:
+        """GeoJSON em texto com o nível de detalhe adequado ao `zoom` (cacheado por nível)."""
+        nivel = nivel_zoom(zoom)
+        texto = self._serializados.get(nivel)
+        if texto is None:
+            texto = json.dumps(self.geojson(tolerancia_zoom(nivel)), ensure_ascii=False, separators=(",", ":"))
+            # setdefault (atômico) com o texto já pronto: se duas sessões montarem o mesmo nível
+            # ao mesmo tempo, ambas devolvem o primeiro guardado
+            texto = self._serializados.setdefault(nivel, texto)
+        return texto
+
+
+class LocalizadorMunicipios:
+    """
+    Índice espacial em grade uniforme para achar o polígono que contém cada ponto.
+
+    Uma célula que nenhuma aresta toca está inteira dentro de um único polígono (ou fora de
+    todos): ela é classificada uma vez, pelo centro, e os pontos nela se resolvem por consulta
+    a uma tabela. Só os pontos em células de divisa passam pelo teste de paridade (raio
+    horizontal para +x), e cada um é comparado apenas com as arestas da sua faixa da grade.
+    """
+
+    def __init__(self, aneis, feicao_do_anel, resolucao=RESOLUCAO_GRADE):
+        self.n = resolucao
+        self.n_feicoes = int(feicao_do_anel.max()) + 1 if len(feicao_do_anel) else 0
+        x1 = np.concatenate([a[:, 0] for a in aneis])
+        y1 = np.concatenate([a[:, 1] for a in aneis])
+        x2 = np.concatenate([np.roll(a[:, 0], -1) for a in aneis])
+        y2 = np.concatenate([np.roll(a[:, 1], -1) for a in aneis])
+        feicao = np.repeat(feicao_do_anel, [len(a) for a in aneis])
+
+        self.x0, self.y0 = x1.min(), y1.min()
+        self.x1, self.y1 = x1.max(), y1.max()
+        self.lx = (self.x1 - self.x0) / resolucao or 1.0
+        self.ly = (self.y1 - self.y0) / resolucao or 1.0
+
+        # Células de divisa: as cobertas pelo retângulo envolvente de alguma aresta (conservador)
+        linha_ini, linha_fim = self._linha(np.minimum(y1, y2)), self._linha(np.maximum(y1, y2))
+        coluna_ini, coluna_fim = self._coluna(np.minimum(x1, x2)), self._coluna(np.maximum(x1, x2))
+        largura = coluna_fim - coluna_ini + 1
+        celulas = (linha_fim - linha_ini + 1) * largura
+        aresta = np.repeat(np.arange(len(x1)), celulas)
+        k = np.arange(len(aresta)) - np.repeat(np.cumsum(celulas) - celulas, celulas)
+        self.borda = np.zeros(resolucao * resolucao, dtype=bool)
+        self.borda[(linha_ini[aresta] + k // largura[aresta]) * resolucao + coluna_ini[aresta] + k % largura[aresta]] = True
+
+        # Arestas por faixa (linha da grade) para o teste de paridade; horizontais nunca cruzam o raio
+        inclinadas = np.flatnonzero(y1 != y2)
+        self.ax1, self.ay1, self.ax2, self.ay2 = x1[inclinadas], y1[inclinadas], x2[inclinadas], y2[inclinadas]
+        self.afeicao = feicao[inclinadas].astype(np.int64)
+        vaos = linha_fim[inclinadas] - linha_ini[inclinadas] + 1
+        aresta = np.repeat(np.arange(len(inclinadas)), vaos)
+        faixa = linha_ini[inclinadas][aresta] + np.arange(len(aresta)) - np.repeat(np.cumsum(vaos) - vaos, vaos)
+        ordem = np.argsort(faixa, kind="stable")
+        self.arestas_faixa = aresta[ordem]
+        self.limites_faixa = np.searchsorted(faixa[ordem], np.arange(resolucao + 1))
+
+        # Classificação das células livres pelo centro
+        self.celula = np.full(resolucao * resolucao, -1, dtype=np.int32)
+        livres = np.flatnonzero(~self.borda)
+        cx = self.x0 + (livres % resolucao + 0.5) * self.lx
+        cy = self.y0 + (livres // resolucao + 0.5) * self.ly
+        self.celula[livres] = self._testar(cx, cy)
+
+    def _linha(self, y):
+        return np.clip(np.floor((y - self.y0) / self.ly), 0, self.n - 1).astype(np.int64)
+
+    def _coluna(self, x):
+        return np.clip(np.floor((x - self.x0) / self.lx), 0, self.n - 1).astype(np.int64)
+
+    def _testar(self, px, py) -> np.ndarray:
+        """Polígono de cada ponto pelo teste de paridade contra as arestas da sua faixa; -1 se nenhum."""
+        resultado = np.full(len(px), -1, dtype=np.int32)
+        faixa = self._linha(py)
+        ordem = np.argsort(faixa, kind="stable")
+        limites = np.searchsorted(faixa[ordem], np.arange(self.n + 1))
+        for f in np.flatnonzero(np.diff(limites)):
+            arestas = self.arestas_faixa[self.limites_faixa[f]:self.limites_faixa[f + 1]]
+            if len(arestas) == 0:
+                continue
+            ax1, ay1, ax2, ay2 = self.ax1[arestas], self.ay1[arestas], self.ax2[arestas], self.ay2[arestas]
+            pontos = ordem[limites[f]:limites[f + 1]]
+            lote = max(1, PARES_POR_LOTE // len(arestas))
+            for i in range(0, len(pontos), lote):
+                p = pontos[i:i + lote]
+                x, y = px[p][:, None], py[p][:, None]
+                cruza = ((ay1 > y) != (ay2 > y)) & (x < ax1 + (y - ay1) * (ax2 - ax1) / (ay2 - ay1))
+                ip, ia = np.nonzero(cruza)
+                # Nº ímpar de cruzamentos com as arestas de um polígono = ponto dentro dele
+                chaves, vezes = np.unique(ip * self.n_feicoes + self.afeicao[arestas][ia], return_counts=True)
+                dentro = chaves[vezes % 2 == 1]
+                # Polígonos sobrepostos: fica o de menor índice (primeira ocorrência de cada ponto)
+                pontos_dentro, primeiro = np.unique(dentro // self.n_feicoes, return_index=True)
+                resultado[p[pontos_dentro]] = dentro[primeiro] % self.n_feicoes
+        return resultado
+
+    def localizar(self, lat, lon) -> np.ndarray:
+        """Índice do polígono que contém cada ponto; -1 fora de todos (ou coordenada inválida)."""
+        x = np.asarray(lon, dtype="float64")
+        y = np.asarray(lat, dtype="float64")
+        resultado = np.full(len(x), -1, dtype=np.int32)
+        candidatos = np.flatnonzero((x >= self.x0) & (x <= self.x1) & (y >= self.y0) & (y <= self.y1))
+        celulas = self._linha(y[candidatos]) * self.n + self._coluna(x[candidatos])
+        resultado[candidatos] = self.celula[celulas]
+        na_borda = candidatos[self.borda[celulas]]
+        resultado[na_borda] = self._testar(x[na_borda], y[na_borda])
+        return resultado
+
+
+def malha_municipios(caminho=CAMINHO_MUNICIPIOS) -> MalhaMunicipios:
+    """Malha dos municípios, lida do disco uma vez por processo (e de novo se o arquivo mudar)."""
+    mtime = os.path.getmtime(caminho)
+    with _lock:
+        em_cache = _malhas.get(caminho)
+        if em_cache is not None and em_cache[0] == mtime:
+            return em_cache[1]
+        with open(caminho, "r", encoding="utf-8") as f:
+            malha = MalhaMunicipios(json.load(f))
+        _malhas[caminho] = (mtime, malha)
+        return malha
+
+
+def versao_malha(caminho=CAMINHO_MUNICIPIOS):
+    """Identifica a malha em uso (muda quando o arquivo é regravado); serve de chave de cache."""
+    return os.path.getmtime(caminho)
+
+
+def geojson_municipios(zoom=8, caminho=CAMINHO_MUNICIPIOS) -> str:
+    """GeoJSON (texto) dos municípios simplificado para o `zoom`."""
+    return malha_municipios(caminho).serializado(zoom)
@@ -1,25 +1,42 @@
 import streamlit as st
-import plotly.express as px
+
+from src.cache import em_cache
+from src.cores import cores_municipios
+from src.figuras import PALETA_CATEGORIAS, barras, grafico, pizza
+
+
+def _agregados_principais(df):
+    prod = df.groupby('Item de Produção Principal', observed=True)["Volume Produção Anual (Kg)"].sum().sort_values(ascending=False).reset_index()
+    generos = df.groupby("Gênero Responsável", observed=True).size().reset_index(name="count")
+    mun = df.groupby('Município', observed=True)["Volume Produção Anual (Kg)"].sum().sort_values(ascending=False).reset_index()
+    return prod, generos, mun
+
 
 def graficos_principais(df):
+    # Agrupamentos reaproveitados entre reruns/sessões com os mesmos filtros
+    prod, generos, mun = em_cache("graficos_principais", df, lambda: _agregados_principais(df))
     st.markdown("")
     col1, col2 = st.columns(2)
     with col1:
         st.markdown("**Top 10 Produtos por Volume Anual**")
-        prod = df.groupby('Item de Produção Principal')["Volume Produção Anual (Kg)"].sum().sort_values(ascending=False).reset_index()
-        fig1 = px.bar(prod.head(10), y="Item de Produção Principal", x="Volume Produção Anual (Kg)",
-                      color="Item de Produção Principal", orientation="h", text="Volume Produção Anual (Kg)")
-        fig1.update_layout(showlegend=False, height=400)
-        st.plotly_chart(fig1, use_container_width=True)
+        top_prod = prod.head(10)
+        cores_prod = [PALETA_CATEGORIAS[i % len(PALETA_CATEGORIAS)] for i in range(len(top_prod))]
+        grafico("principais_produtos", showlegend=False, height=400).exibir_em_cache(
+            df, lambda: [barras(top_prod["Item de Produção Principal"], top_prod["Volume Produção Anual (Kg)"],
+                                cores=cores_prod, horizontal=True, formato_texto="")],
+        )
     with col2:
         st.markdown("**Distribuição dos Gêneros Responsáveis**")
-        fig2 = px.pie(df, names="Gênero Responsável", title=None, hole=0.5)
-        fig2.update_traces(textinfo='percent+label')
-        st.plotly_chart(fig2, use_container_width=True)
+        grafico("principais_generos").exibir_em_cache(
+            df, lambda: [pizza(generos["Gênero Responsável"], generos["count"], buraco=0.5)],
+        )
 
     st.markdown("---")
     st.markdown("**Top 10 Municípios por Volume Anual**")
-    mun = df.groupby('Município')["Volume Produção Anual (Kg)"].sum().sort_values(ascending=False).reset_index()
-    fig3 = px.bar(mun.head(10), x="Município", y="Volume Produção Anual (Kg)", color="Município", text="Volume Produção Anual (Kg)")
-    fig3.update_layout(showlegend=False, height=400)
-    st.plotly_chart(fig3, use_container_width=True)
+    top_mun = mun.head(10)
+    # Mesmas cores por município dos mapas
+    cores = cores_municipios(df)
+    grafico("principais_municipios", showlegend=False, height=400).exibir_em_cache(
+        df, lambda: [barras(top_mun["Município"], top_mun["Volume Produção Anual (Kg)"],
+                            cores=[cores.get(m, "#3388ff") for m in top_mun["Município"]], formato_texto="")],
+    )
@@ -1,11 +1,455 @@
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+
 import pandas as pd
 
-def carregar_dados(caminho_csv):
-    df = pd.read_csv(caminho_csv, sep=";", encoding="utf-8")
+from src.agregados import AgregadosIncrementais
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional: sem ele não há Parquet auxiliar e o streaming usa o leitor do pandas
+    pa = pacsv = pq = None
+
+try:
+    import resource
+except ImportError:  # indisponível no Windows
+    resource = None
+
+# Dimensões de texto com poucos valores distintos: viram "category" (códigos inteiros + dicionário)
+COLUNAS_CATEGORICAS = [
+    "Nome da Família", "Município", "Comunidade", "Gênero Responsável",
+    "Item de Produção Principal", "Item de Produção Secundário", "Tipo de Certificação",
+    "Método de Venda Principal", "Associação/Cooperativa",
+]
+# Tipos numéricos compactos. Colunas inteiras com valores vazios ou fracionários caem para float64.
+# Latitude/Longitude ficam em float64 para não perder precisão nas coordenadas.
+TIPOS_NUMERICOS = {
+    "Área Cultivada (ha)": "float32",
+    "Volume Produção Anual (Kg)": "int32",
+    "Volume Produção Anual (Kg)_real_para_trend": "int32",
+    "Ano": "int16",
+    "Membros Família": "int8",
+}
+
+PASTA_CACHE = ".cache"
+TAMANHO_BLOCO = 100_000  # linhas por bloco na ingestão em streaming
+BYTES_MAX_LOTE = 4 << 20  # teto do lote lido pelo pyarrow (os lotes são reagrupados em blocos de TAMANHO_BLOCO linhas)
+_CHAVE_HASH = b"fonte_sha1"
+_CHAVE_BYTES = b"fonte_bytes"
+MAX_PARTES_AUXILIAR = 16  # acréscimos gravados em partes separadas antes de regravar o Parquet inteiro
+
+# Cache por processo: caminho -> _Carga (arquivo de origem, bytes consumidos e DataFrame)
+_cache = {}
+_lock = threading.Lock()
+# Só serializa as gravações do Parquet auxiliar, que acontecem fora de `_lock`
+_lock_auxiliar = threading.Lock()
+
+
+class _Carga:
+    """Estado de um CSV carregado: até onde ele foi lido e o hash desse trecho."""
+
+    def __init__(self, assinatura, n_bytes, hash_sha1, df):
+        self.assinatura = assinatura
+        self.n_bytes = n_bytes
+        self.hash_sha1 = hash_sha1  # objeto hashlib: permite continuar o hash com a cauda
+        self.df = df
+
+
+def _assinatura(caminho_csv):
+    """Assinatura barata do arquivo (mtime + tamanho) para detectar alterações."""
+    info = os.stat(caminho_csv)
+    return info.st_mtime_ns, info.st_size
+
+
+def _sha1_prefixo(caminho_csv, n_bytes=None):
+    """SHA-1 dos primeiros `n_bytes` do arquivo (do arquivo inteiro se None)."""
+    h = hashlib.sha1()
+    restante = float("inf") if n_bytes is None else n_bytes
+    with open(caminho_csv, "rb") as f:
+        while restante > 0:
+            bloco = f.read(int(min(1 << 20, restante)))
+            if not bloco:
+                break
+            h.update(bloco)
+            restante -= len(bloco)
+    return h
+
+
+def _caminho_auxiliar(caminho_csv):
+    pasta, nome = os.path.split(os.path.abspath(caminho_csv))
+    return os.path.join(pasta, PASTA_CACHE, os.path.splitext(nome)[0] + ".parquet")
+
+
+def _compactar_tipos(df):
+    """Converte dimensões de texto em categorias e reduz os tipos numéricos."""
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col, tipo in TIPOS_NUMERICOS.items():
+        if col in df.columns:
+            serie = pd.to_numeric(df[col], errors="coerce")
+            if tipo.startswith("int") and not (serie.notna().all() and (serie % 1 == 0).all()):
+                tipo = "float64"
+            df[col] = serie.astype(tipo)
+    return df
+
+
+def _limpar_colunas(df):
     df.columns = [col.strip().replace('\ufeff', '').replace('\r', '').replace('\n', '') for col in df.columns]
-    print("COLUNAS ENCONTRADAS:", df.columns.tolist())
     if "Latitude" not in df.columns or "Longitude" not in df.columns:
         raise Exception(f"Colunas Latitude ou Longitude não encontradas! Veja os nomes: {df.columns.tolist()}")
+
+
+def _ler_csv(origem):
+    df = pd.read_csv(origem, sep=";", encoding="utf-8")
+    _limpar_colunas(df)
     df["Latitude"] = df["Latitude"].astype(float)
     df["Longitude"] = df["Longitude"].astype(float)
+    return _compactar_tipos(df)
+
+
+def _ler_cauda(caminho_csv, inicio):
+    """
+    Lê só as linhas completas acrescentadas depois do byte `inicio`.
+
+    Devolve `(bytes consumidos, DataFrame ou None)`. Uma última linha ainda sem quebra de
+    linha (gravação em andamento) fica para a próxima leitura.
+    """
+    with open(caminho_csv, "rb") as f:
+        cabecalho = f.readline()
+        f.seek(inicio)
+        cauda = f.read()
+    cauda = cauda[:cauda.rfind(b"\n") + 1]
+    if not cauda.strip():
+        return cauda, None
+    return cauda, _ler_csv(io.BytesIO(cabecalho + cauda))
+
+
+def _anexar(df, novo):
+    """Concatena as linhas novas preservando os códigos das categorias já existentes."""
+    df = df.copy(deep=False)
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns and col in novo.columns:
+            novas = novo[col].cat.categories.difference(df[col].cat.categories)
+            if len(novas):
+                df[col] = df[col].cat.add_categories(novas)
+            novo[col] = novo[col].astype(df[col].dtype)
+    return pd.concat([df, novo], ignore_index=True)
+
+
+def _caminho_parte(caminho_aux, inicio):
+    return f"{os.path.splitext(caminho_aux)[0]}.parte-{inicio:015d}.parquet"
+
+
+def _partes(caminho_aux):
+    """Partes (acréscimos) do auxiliar: [(byte inicial, caminho)] em ordem."""
+    pasta, nome = os.path.split(caminho_aux)
+    prefixo = os.path.splitext(nome)[0] + ".parte-"
+    try:
+        nomes = os.listdir(pasta)
+    except OSError:
+        return []
+    partes = []
+    for arquivo in nomes:
+        if arquivo.startswith(prefixo) and arquivo.endswith(".parquet"):
+            try:
+                partes.append((int(arquivo[len(prefixo):-len(".parquet")]), os.path.join(pasta, arquivo)))
+            except ValueError:
+                continue
+    return sorted(partes)
+
+
+def _bytes_cobertos(caminho):
+    metadados = pq.read_schema(caminho).metadata or {}
+    return int(metadados.get(_CHAVE_BYTES, b"-1")), metadados.get(_CHAVE_HASH, b"").decode()
+
+
+def _cadeia_auxiliar(caminho_aux):
+    """
+    Arquivos do auxiliar que se encadeiam (Parquet base e partes em que cada uma começa onde a
+    anterior termina), com os bytes cobertos e o hash gravado no último.
+    """
+    n_bytes, hash_hex = _bytes_cobertos(caminho_aux)
+    arquivos = [caminho_aux]
+    for inicio, caminho in _partes(caminho_aux):
+        if inicio != n_bytes:
+            continue
+        n_bytes, hash_hex = _bytes_cobertos(caminho)
+        arquivos.append(caminho)
+    return arquivos, n_bytes, hash_hex
+
+
+def _ler_auxiliar(caminho_aux, caminho_csv, tamanho):
+    """
+    Lê o Parquet auxiliar (base e partes acrescentadas) se ele foi gerado a partir do início
+    atual do CSV.
+
+    Devolve `(bytes cobertos, hash, DataFrame)` ou None; linhas acrescentadas ao CSV depois
+    da gravação do auxiliar são lidas à parte pelo chamador.
+    """
+    if pq is None or not os.path.exists(caminho_aux):
+        return None
+    try:
+        arquivos, n_bytes, hash_hex = _cadeia_auxiliar(caminho_aux)
+        if not 0 < n_bytes <= tamanho:
+            return None
+        h = _sha1_prefixo(caminho_csv, n_bytes)
+        if hash_hex != h.hexdigest():
+            return None
+        df = pq.read_table(arquivos[0]).to_pandas()
+        for caminho in arquivos[1:]:
+            df = _anexar(df, pq.read_table(caminho).to_pandas())
+        return n_bytes, h, df
+    except Exception:
+        # Arquivo auxiliar corrompido ou de versão incompatível: basta reler o CSV
+        return None
+
+
+def _gravar_parquet(df, caminho, n_bytes, hash_hex):
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[_CHAVE_HASH] = hash_hex.encode()
+    metadados[_CHAVE_BYTES] = str(n_bytes).encode()
+    tmp = caminho + ".tmp"
+    pq.write_table(tabela.replace_schema_metadata(metadados), tmp)
+    os.replace(tmp, caminho)
+
+
+def _gravar_auxiliar(caminho_aux, df, n_bytes, hash_hex, novo=None, inicio=0):
+    """
+    Registra a carga no Parquet auxiliar. Um acréscimo (`novo`, linhas a partir do byte
+    `inicio`) vira uma parte separada, com custo proporcional só às linhas novas; o Parquet
+    inteiro é regravado na carga completa, quando a cadeia de partes não termina em `inicio`
+    ou quando já há MAX_PARTES_AUXILIAR partes. Chamada fora de `_lock`: as páginas não
+    esperam pela gravação. A leitura confere o hash, então uma gravação fora de ordem só
+    faz o auxiliar cobrir menos bytes.
+    """
+    if pq is None:
+        return
+    with _lock_auxiliar:
+        try:
+            os.makedirs(os.path.dirname(caminho_aux), exist_ok=True)
+            if novo is not None and os.path.exists(caminho_aux):
+                arquivos, coberto, _ = _cadeia_auxiliar(caminho_aux)
+                if coberto >= n_bytes:
+                    return  # uma gravação mais recente já cobre este acréscimo
+                if coberto == inicio and len(arquivos) <= MAX_PARTES_AUXILIAR:
+                    _gravar_parquet(novo, _caminho_parte(caminho_aux, inicio), n_bytes, hash_hex)
+                    return
+            _gravar_parquet(df, caminho_aux, n_bytes, hash_hex)
+            for _, caminho in _partes(caminho_aux):
+                os.remove(caminho)
+        except OSError:
+            # Pasta somente leitura (ex.: deploy): seguimos apenas com o cache em memória
+            pass
+
+
+def _carga_completa(caminho_csv, assinatura):
+    """Carga do zero (auxiliar + cauda do CSV, ou o CSV inteiro) e a gravação pendente do auxiliar."""
+    caminho_aux = _caminho_auxiliar(caminho_csv)
+    auxiliar = _ler_auxiliar(caminho_aux, caminho_csv, assinatura[1])
+    if auxiliar is None:
+        df = _ler_csv(caminho_csv)
+        carga = _Carga(assinatura, assinatura[1], _sha1_prefixo(caminho_csv), df)
+        return carga, {}  # sem acréscimo: grava o Parquet inteiro
+    carga = _Carga(assinatura, *auxiliar)
+    carga.df.attrs = {}
+    if carga.n_bytes < assinatura[1]:
+        inicio = carga.n_bytes
+        novo = _anexar_cauda(caminho_csv, carga)
+        if novo is not None:
+            return carga, {"novo": novo, "inicio": inicio}
+    return carga, None
+
+
+def _anexar_cauda(caminho_csv, carga):
+    """
+    Atualiza `carga` com as linhas acrescentadas ao fim do CSV desde a última leitura.
+    Devolve as linhas novas (já com as categorias da carga) ou None se não havia nenhuma.
+    """
+    cauda, novo = _ler_cauda(caminho_csv, carga.n_bytes)
+    if novo is None:
+        return None
+    anterior = carga.df
+    carga.df = _anexar(anterior, novo)
+    carga.df.attrs = {
+        "versao_anterior": anterior.attrs.get("versao"),
+        "linhas_anteriores": len(anterior),
+    }
+    carga.n_bytes += len(cauda)
+    carga.hash_sha1.update(cauda)
+    return novo
+
+
+def carregar_dados(caminho_csv):
+    """
+    Carrega o CSV de famílias uma única vez por processo.
+
+    O resultado fica em memória e só é recarregado quando o arquivo muda (mtime/tamanho).
+    Se o arquivo apenas cresceu e o trecho já lido continua idêntico (mesmo hash), só as
+    linhas novas são lidas e anexadas; qualquer outra alteração refaz a carga completa.
+    A carga fica registrada num Parquet auxiliar em `data/.cache/`, usado nas próximas
+    inicializações para evitar o parse do CSV.
+    O DataFrame devolvido é compartilhado entre as páginas: não o altere no lugar.
+    """
+    chave = os.path.abspath(caminho_csv)
+    assinatura = _assinatura(caminho_csv)
+    with _lock:
+        carga = _cache.get(chave)
+        if carga and carga.assinatura == assinatura:
+            return carga.df
+
+        mudou = True
+        gravacao = None  # o que falta registrar no auxiliar (ver `_gravar_auxiliar`)
+        if carga and assinatura[1] >= carga.n_bytes:
+            h = _sha1_prefixo(caminho_csv, carga.n_bytes)
+            if h.hexdigest() == carga.hash_sha1.hexdigest():
+                # Mesmo conteúdo já lido: ou só o mtime mudou, ou houve acréscimo no fim
+                inicio = carga.n_bytes
+                novo = _anexar_cauda(caminho_csv, carga)
+                mudou = novo is not None
+                carga.assinatura = assinatura
+                if mudou:
+                    gravacao = {"novo": novo, "inicio": inicio}
+            else:
+                carga = None
+        if carga is None or carga.assinatura != assinatura:
+            carga, gravacao = _carga_completa(caminho_csv, assinatura)
+
+        if mudou:
+            # A versão identifica o conteúdo carregado; caches derivados usam essa chave
+            carga.df.attrs["versao"] = carga.hash_sha1.hexdigest()[:12]
+        _cache[chave] = carga
+        df, n_bytes, hash_hex = carga.df, carga.n_bytes, carga.hash_sha1.hexdigest()
+
+    if gravacao is not None:
+        _gravar_auxiliar(_caminho_auxiliar(caminho_csv), df, n_bytes, hash_hex, **gravacao)
     return df
+
+
+# ----- INGESTÃO EM STREAMING (arquivos maiores que a memória) -----
+
+def _colunas_cabecalho(caminho_csv):
+    with open(caminho_csv, encoding="utf-8-sig") as f:
+        return f.readline().rstrip("\r\n").split(";"), f.read(1 << 16)
+
+
+def _blocos_pyarrow(caminho_csv, tamanho_bloco, colunas):
+    """
+    Lê o CSV com o leitor em streaming do pyarrow (dimensões já como dicionário) e devolve
+    blocos de exatamente `tamanho_bloco` linhas (o último pode ter menos).
+    """
+    _, amostra = _colunas_cabecalho(caminho_csv)
+    bytes_por_linha = len(amostra.encode("utf-8")) / max(amostra.count("\n"), 1)
+    leitor = pacsv.open_csv(
+        caminho_csv,
+        # O leitor do pyarrow antecipa vários lotes em paralelo; limitar o tamanho em bytes
+        # do lote é o que mantém o pico de memória baixo em arquivos muito grandes.
+        read_options=pacsv.ReadOptions(
+            block_size=min(max(int(bytes_por_linha * tamanho_bloco), 1 << 16), BYTES_MAX_LOTE),
+        ),
+        parse_options=pacsv.ParseOptions(delimiter=";"),
+        convert_options=pacsv.ConvertOptions(
+            column_types={
+                col: pa.dictionary(pa.int32(), pa.string()) if col.strip() in COLUNAS_CATEGORICAS else pa.string()
+                for col in colunas
+            },
+            include_columns=colunas,
+        ),
+    )
+    # Os lotes do leitor têm tamanho em bytes; juntam-se até dar um bloco de `tamanho_bloco` linhas
+    pendentes, n_pendentes = [], 0
+    for lote in leitor:
+        pendentes.append(lote)
+        n_pendentes += lote.num_rows
+        while n_pendentes >= tamanho_bloco:
+            tabela = pa.Table.from_batches(pendentes, schema=leitor.schema)
+            yield tabela.slice(0, tamanho_bloco).to_pandas()
+            resto = tabela.slice(tamanho_bloco)
+            pendentes, n_pendentes = resto.to_batches(), resto.num_rows
+    if n_pendentes:
+        yield pa.Table.from_batches(pendentes, schema=leitor.schema).to_pandas()
+
+
+def _validar_bloco(bloco):
+    """Tipa as colunas numéricas de um bloco e conta os valores que não puderam ser convertidos."""
+    _limpar_colunas(bloco)
+    invalidos = 0
+    for col in ["Latitude", "Longitude", *TIPOS_NUMERICOS]:
+        if col in bloco.columns:
+            try:
+                # Caminho rápido: bloco inteiro válido
+                serie = bloco[col].astype("float64")
+            except ValueError:
+                serie = pd.to_numeric(bloco[col], errors="coerce")
+                invalidos += int((serie.isna() & bloco[col].notna()).sum())
+            bloco[col] = serie
+    # Ano é chave dos agregados: fica inteiro (com vazios) como no carregamento em memória,
+    # para os blocos e o DataFrame completo agruparem pelos mesmos valores (2022, não 2022.0)
+    if "Ano" in bloco.columns and (bloco["Ano"].dropna() % 1 == 0).all():
+        bloco["Ano"] = bloco["Ano"].astype(TIPOS_NUMERICOS["Ano"].capitalize())
+    return bloco, invalidos
+
+
+def _pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB; macOS em bytes
+    return round(pico / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def ingerir_em_blocos(caminho_csv, tamanho_bloco=TAMANHO_BLOCO, agregados=None):
+    """
+    Percorre o CSV em blocos de `tamanho_bloco` linhas, validando cada bloco e
+    atualizando os agregados por dimensão sem manter as linhas em memória.
+
+    Devolve `(agregados, relatorio)`, onde o relatório traz linhas lidas, valores inválidos,
+    linhas/s e o pico de memória (RSS) do processo, útil para dimensionar máquinas.
+    """
+    agregados = agregados if agregados is not None else AgregadosIncrementais()
+    # Só as colunas usadas na validação e nos agregados são lidas
+    cabecalho, _ = _colunas_cabecalho(caminho_csv)
+    usadas = {"Latitude", "Longitude", *TIPOS_NUMERICOS, *agregados.colunas}
+    colunas = [col for col in cabecalho if col.strip() in usadas]
+    if pacsv is not None:
+        blocos = _blocos_pyarrow(caminho_csv, tamanho_bloco, colunas)
+    else:
+        blocos = pd.read_csv(
+            caminho_csv, sep=";", encoding="utf-8-sig", dtype=str, usecols=colunas, chunksize=tamanho_bloco,
+        )
+
+    inicio = time.perf_counter()
+    linhas = n_blocos = invalidos = 0
+    for bloco in blocos:
+        bloco, n_invalidos = _validar_bloco(bloco)
+        agregados.atualizar(bloco)
+        linhas += len(bloco)
+        n_blocos += 1
+        invalidos += n_invalidos
+    segundos = time.perf_counter() - inicio
+
+    relatorio = {
+        "linhas": linhas,
+        "blocos": n_blocos,
+        "valores_invalidos": invalidos,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(linhas / segundos) if segundos > 0 else None,
+        "pico_rss_mb": _pico_rss_mb(),
+    }
+    return agregados, relatorio
+
+
+if __name__ == "__main__":
+    # Uso: python -m src.loader [caminho.csv] [linhas_por_bloco]
+    caminho = sys.argv[1] if len(sys.argv) > 1 else "data/familias_agricultoras.csv"
+    tamanho = int(sys.argv[2]) if len(sys.argv) > 2 else TAMANHO_BLOCO
+    _, relatorio = ingerir_em_blocos(caminho, tamanho)
+    for chave, valor in relatorio.items():
+        print(f"{chave}: {valor}")
@@ -0,0 +1,147 @@
+# Mapas em WebGL (pydeck): alternativa aos mapas folium para seleções com muitos pontos
+
+import json
+
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+import streamlit as st
+from pydeck.bindings.json_tools import default_serialize
+
+from src.cache import em_cache
+from src.cores import cor_rgb, cores_municipios, itens_legenda
+from src.geometria import geojson_municipios
+
+MODOS = ["Pontos", "Hexágonos"]
+RAIO_HEXAGONO_M = 2000
+ZOOM_INICIAL = 7.5  # zoom da vista inicial; também escolhe o nível de detalhe dos contornos
+COR_PADRAO = "#3388ff"
+
+
+class DeckCompacto(pdk.Deck):
+    """
+    `pdk.Deck` que gera JSON sem indentação e só uma vez.
+
+    O `st.pydeck_chart` chama `to_json()` a cada exibição; o JSON padrão do pydeck é
+    indentado (várias vezes maior) e recalculado sempre. Aqui o texto fica guardado no
+    próprio objeto, então um deck tirado do cache é enviado sem nova serialização.
+    """
+
+    _json = None
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.dumps(self, default=default_serialize, separators=(",", ":"))
+        return self._json
+
+
+# Posições em cada registro (ver `registros_deck`), lidas pelas camadas com expressões do deck.gl
+POSICAO = "[this[0], this[1]]"
+COR = "[this[2], this[3], this[4]]"
+DICA = "{5}"
+
+
+def registros_deck(df: pd.DataFrame, cores=None, dica="Nome da Família") -> list:
+    """
+    Dados das camadas montados coluna a coluna a partir das colunas NumPy do recorte (que já
+    vem sem coordenadas vazias). Cada registro é uma lista sem nomes de campo, o que deixa o
+    JSON menor: longitude e latitude arredondadas (~1 m), cor RGB do município e texto da dica.
+    """
+    cores = cores if cores is not None else cores_municipios(df)
+    municipio = df["Município"]
+    categorias = municipio.array if isinstance(municipio.dtype, pd.CategoricalDtype) else pd.Categorical(municipio)
+    # Cor por código de categoria; a última linha (código -1) é a dos municípios vazios
+    tabela = np.array(
+        [cor_rgb(cores.get(m, COR_PADRAO)) for m in categorias.categories] + [cor_rgb(COR_PADRAO)], dtype=np.int64,
+    )
+    rgb = tabela[np.asarray(categorias.codes)]
+    return list(zip(
+        np.round(df["Longitude"].to_numpy(dtype="float64"), 5).tolist(),
+        np.round(df["Latitude"].to_numpy(dtype="float64"), 5).tolist(),
+        rgb[:, 0].tolist(), rgb[:, 1].tolist(), rgb[:, 2].tolist(),
+        df[dica].astype("string").fillna("N/I").tolist(),
+    ))
+
+
+def _camada_contornos(zoom):
+    return pdk.Layer(
+        "GeoJsonLayer",
+        data=json.loads(geojson_municipios(zoom)),  # texto seria tratado como URL
+        stroked=True,
+        filled=False,
+        get_line_color=[120, 120, 120, 160],
+        line_width_min_pixels=1,
+    )
+
+
+def construir_deck(registros: list, centro, modo="Pontos", contornos=True, zoom=ZOOM_INICIAL) -> DeckCompacto:
+    """
+    Deck com os produtores como pontos coloridos por município ou agregados em hexágonos.
+    Os contornos usam o nível de detalhe do `zoom` da vista (o pydeck não devolve a vista
+    ao Python, então vale o zoom com que o mapa abre).
+    """
+    camadas = []
+    if contornos:
+        try:
+            camadas.append(_camada_contornos(zoom))
+        except FileNotFoundError:
+            pass
+
+    if modo == "Hexágonos":
+        camadas.append(pdk.Layer(
+            "HexagonLayer",
+            data=registros,
+            get_position=POSICAO,
+            radius=RAIO_HEXAGONO_M,
+            elevation_scale=40,
+            extruded=True,
+            pickable=True,
+            coverage=0.9,
+        ))
+        dica = {"html": "<b>Famílias:</b> {elevationValue}"}
+        vista = pdk.ViewState(latitude=centro[0], longitude=centro[1], zoom=zoom, pitch=40)
+    else:
+        camadas.append(pdk.Layer(
+            "ScatterplotLayer",
+            data=registros,
+            get_position=POSICAO,
+            get_fill_color=COR,
+            get_radius=300,
+            radius_min_pixels=2,
+            radius_max_pixels=8,
+            opacity=0.8,
+            pickable=True,
+        ))
+        dica = {"text": DICA}
+        vista = pdk.ViewState(latitude=centro[0], longitude=centro[1], zoom=zoom)
+
+    return DeckCompacto(layers=camadas, initial_view_state=vista, tooltip=dica, map_style="light")
+
+
+def mostrar_mapa_deck(df: pd.DataFrame, modo="Pontos", height=540, centro=None):
+    """
+    Equivalente de `mostrar_mapa_folium` em WebGL: as mesmas cores por município, a mesma dica
+    e a mesma legenda, mas os pontos são desenhados pela GPU, o que aguenta centenas de
+    milhares de famílias. O deck (já serializado) fica no cache por versão, filtros e modo.
+    `df` deve vir sem coordenadas vazias (como o `df_mapa` das páginas).
+    """
+    if df.empty:
+        st.warning("Nenhuma família encontrada para esse filtro.")
+        return None
+
+    cores = cores_municipios(df)
+    if centro is None:
+        centro = [float(df["Latitude"].mean()), float(df["Longitude"].mean())]
+    deck = em_cache(
+        "deck", df, lambda: construir_deck(registros_deck(df, cores), centro, modo),
+        modo, tuple(centro), tamanho=lambda d: len(d.to_json()),
+    )
+    st.pydeck_chart(deck, height=height)
+
+    if modo == "Pontos":
+        municipios = sorted(df["Município"].dropna().unique())
+        st.markdown(
+            "<div style='font-size:15px; line-height:1.6; column-width:210px;'><b>Legenda: Município</b><br>"
+            + itens_legenda(cores, municipios) + "</div>",
+            unsafe_allow_html=True,
+        )
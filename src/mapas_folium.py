@@ -1,38 +1,301 @@
+import contextlib
+import html
+import json
+import threading
+
+import numpy as np
+import pandas as pd
 import streamlit as st
 import folium
+from folium.plugins import MarkerCluster
+from folium.template import Template
+from branca.element import MacroElement
 from streamlit_folium import st_folium
-import random
 
-def mostrar_mapa_folium(df, height=540):
-    df = df.dropna(subset=["Latitude", "Longitude"])
-    if df.empty:
-        st.warning("Nenhuma família encontrada para esse filtro.")
-        return None
+from src.cache import em_cache, estimar_tamanho
+from src.cores import cores_municipios, itens_legenda
+
+ZOOM_CLIQUE = 2  # níveis de zoom aproximados ao clicar num grupo de marcadores
+
+# (rótulo no popup, coluna)
+CAMPOS_POPUP = [
+    ("Família", "Nome da Família"),
+    ("Município", "Município"),
+    ("Produção", "Item de Produção Principal"),
+]
+
+
+def _codificar(serie: pd.Series):
+    """(códigos, valores) da coluna, só com os valores presentes; código -1 = ausente."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorias = serie.array.remove_unused_categories()
+        return np.asarray(categorias.codes), list(categorias.categories)
+    codigos, valores = pd.factorize(serie)
+    return codigos, list(valores)
+
+
+def dados_marcadores(df: pd.DataFrame, campos_popup=CAMPOS_POPUP, campo_dica=None, cores=None) -> dict:
+    """
+    Dados dos marcadores em colunas, montados sem laço por linha.
+
+    Os textos vão codificados como dicionário (lista de valores distintos + código por linha),
+    então o tamanho cresce com o número de valores distintos e não com o de famílias.
+    """
+    cores = cores if cores is not None else cores_municipios(df)
+    codigos_mun, municipios = _codificar(df["Município"])
+    campos = []
+    for rotulo, coluna in campos_popup:
+        codigos, valores = _codificar(df[coluna])
+        campos.append([html.escape(rotulo), codigos.tolist(), [html.escape(str(v)) for v in valores]])
+    return {
+        "lat": np.round(df["Latitude"].to_numpy(dtype="float64"), 5).tolist(),
+        "lon": np.round(df["Longitude"].to_numpy(dtype="float64"), 5).tolist(),
+        "cor": codigos_mun.tolist(),
+        "cores": [cores.get(m, "#3388ff") for m in municipios],
+        "campos": campos,
+        "dica": [c for c, _ in campos_popup].index(campo_dica) if campo_dica else -1,
+    }
+
+
+class CamadaMarcadores(MarkerCluster):
+    """
+    Camada de marcadores renderizada no navegador a partir de um vetor de dados.
+
+    Substitui um `folium.Marker` por família: o HTML leva só as colunas (ver `dados_marcadores`)
+    e o JavaScript cria os círculos (em canvas) e monta popups/dicas sob demanda, ao clicar.
+    Com `agrupar=True` os pontos são agrupados pelo Leaflet.markercluster.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var d = {{ this.dados }};
+                var renderer = L.canvas({padding: 0.5});
+                {%- if this.agrupar %}
+                var camada = L.markerClusterGroup({{ this.options|tojavascript }});
+                {%- else %}
+                var camada = L.featureGroup();
+                {%- endif %}
+
+                function valor(campo, i) {
+                    var codigo = campo[1][i];
+                    return codigo < 0 ? "N/I" : campo[2][codigo];
+                }
+                function popup(camadaPonto) {
+                    var html = "";
+                    for (var k = 0; k < d.campos.length; k++) {
+                        html += "<b>" + d.campos[k][0] + ":</b> " + valor(d.campos[k], camadaPonto.options.i) + "<br>";
+                    }
+                    return html;
+                }
+
+                var marcadores = new Array(d.lat.length);
+                for (var i = 0; i < d.lat.length; i++) {
+                    var cor = d.cor[i] < 0 ? "#3388ff" : d.cores[d.cor[i]];
+                    var m = L.circleMarker([d.lat[i], d.lon[i]], {
+                        renderer: renderer, radius: {{ this.raio }}, i: i,
+                        color: cor, fillColor: cor, fillOpacity: 0.8, weight: 1
+                    });
+                    m.bindPopup(popup, {maxWidth: 300});
+                    if (d.dica >= 0) {
+                        m.bindTooltip(function(l) { return valor(d.campos[d.dica], l.options.i); });
+                    }
+                    marcadores[i] = m;
+                }
+                {%- if this.agrupar %}
+                camada.addLayers(marcadores);
+                {%- else %}
+                for (var j = 0; j < marcadores.length; j++) { camada.addLayer(marcadores[j]); }
+                {%- endif %}
+
+                camada.addTo({{ this._parent.get_name() }});
+                return camada;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, df, campos_popup=CAMPOS_POPUP, campo_dica=None, agrupar=True, raio=6, cores=None, name=None, **kwargs):
+        kwargs.setdefault("chunkedLoading", True)
+        super().__init__(name=name, **kwargs)
+        self._name = "CamadaMarcadores"
+        self.agrupar = agrupar
+        self.raio = raio
+        self.dados = json.dumps(dados_marcadores(df, campos_popup, campo_dica, cores), separators=(",", ":"))
+
+
+class CamadaGrupos(MacroElement):
+    """
+    Marcadores numerados dos grupos de `IndiceClusters.consultar`, criados no navegador a partir
+    das colunas lat/lon/contagem. Como no Leaflet.markercluster, clicar num grupo aproxima o
+    mapa sobre ele (ZOOM_CLIQUE níveis), até os pontos se separarem.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function(){
+                var d = {{ this.dados }};
+                var camada = {{ this._parent.get_name() }};
+                for (var i = 0; i < d.lat.length; i++) {
+                    var n = d.contagem[i];
+                    var t = Math.floor(Math.min(60, 26 + 8 * Math.log10(n)));
+                    var rotulo = n.toString().replace(/\\B(?=(\\d{3})+(?!\\d))/g, ".");
+                    var icone = L.divIcon({
+                        className: "", iconSize: [t, t], iconAnchor: [Math.floor(t / 2), Math.floor(t / 2)],
+                        html: '<div style="width:' + t + 'px;height:' + t + 'px;line-height:' + t + 'px;' +
+                              'border-radius:50%;background:rgba(44,160,44,0.75);border:2px solid #fff;' +
+                              'color:#fff;text-align:center;font-weight:bold;font-size:12px;cursor:pointer;">' +
+                              rotulo + '</div>'
+                    });
+                    var m = L.marker([d.lat[i], d.lon[i]], {icon: icone});
+                    m.bindTooltip(rotulo + " famílias · clique para aproximar");
+                    m.on("click", function(e) {
+                        var mapa = e.target._map;
+                        mapa.setView(e.latlng, Math.min(mapa.getZoom() + {{ this.zoom_clique }}, mapa.getMaxZoom()));
+                    });
+                    camada.addLayer(m);
+                }
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, grupos: pd.DataFrame, zoom_clique=ZOOM_CLIQUE):
+        super().__init__()
+        self._name = "CamadaGrupos"
+        self.zoom_clique = int(zoom_clique)
+        self.dados = json.dumps({
+            "lat": np.round(grupos["lat"].to_numpy(dtype="float64"), 5).tolist(),
+            "lon": np.round(grupos["lon"].to_numpy(dtype="float64"), 5).tolist(),
+            "contagem": grupos["contagem"].to_numpy(dtype="int64").tolist(),
+        }, separators=(",", ":"))
 
-    municipios = sorted(df["Município"].unique())
-    cores_base = ["red", "blue", "green", "purple", "orange", "darkred", "lightgray", "beige", "darkblue", "cadetblue", "darkgreen"]
-    while len(cores_base) < len(municipios):
-        cores_base.append('#%06X' % random.randint(0, 0xFFFFFF))
-    cor_por_municipio = {mun: cor for mun, cor in zip(municipios, cores_base)}
+
+class MemoriaVista(MacroElement):
+    """
+    Guarda o centro e o zoom do mapa no sessionStorage do navegador e os restaura quando o mapa
+    é montado de novo (por exemplo, trocado por outro nível de detalhe). Assim a vista do
+    usuário se mantém sem que o centro precise voltar ao servidor a cada arrasto.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function(){
+                var mapa = {{ this._parent.get_name() }};
+                var chave = {{ this.chave|tojson }};
+                try {
+                    var vista = JSON.parse(window.sessionStorage.getItem(chave));
+                    if (vista) { mapa.setView(vista.centro, vista.zoom, {animate: false}); }
+                } catch (e) {}
+                mapa.on("moveend", function() {
+                    try {
+                        window.sessionStorage.setItem(chave, JSON.stringify({centro: mapa.getCenter(), zoom: mapa.getZoom()}));
+                    } catch (e) {}
+                });
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, chave):
+        super().__init__()
+        self._name = "MemoriaVista"
+        self.chave = f"vista:{chave}"
+
+
+def camada_agrupada(df: pd.DataFrame, visiveis: pd.DataFrame, campos_popup=CAMPOS_POPUP, name=None) -> folium.FeatureGroup:
+    """
+    Camada com o resultado de `IndiceClusters.consultar`: um marcador numerado por grupo (ver
+    `CamadaGrupos`) e, para os pontos isolados, a `CamadaMarcadores` com os dados das
+    respectivas linhas de `df`.
+    """
+    camada = folium.FeatureGroup(name=name)
+    grupos = visiveis[visiveis["contagem"] > 1]
+    if not grupos.empty:
+        CamadaGrupos(grupos).add_to(camada)
+    avulsos = df.take(visiveis.loc[visiveis["contagem"] == 1, "linha"].to_numpy())
+    if not avulsos.empty:
+        CamadaMarcadores(avulsos, campos_popup=campos_popup, agrupar=False).add_to(camada)
+    return camada
+
+
+# ----- CACHE DE MAPAS -----
+# O st_folium altera o mapa ao renderizar (ids dos elementos, camada extra), então um mapa ou
+# camada compartilhado pelo cache é exibido por uma sessão de cada vez. O lock é de cada objeto:
+# sessões com mapas diferentes não esperam umas pelas outras.
+
+def _lock_de(elemento) -> threading.Lock:
+    # dict.setdefault é atômico: duas sessões nunca criam locks diferentes para o mesmo objeto
+    return elemento.__dict__.setdefault("_lock_exibicao", threading.Lock())
+
+
+def _tamanho_mapa(mapa) -> int:
+    """Estimativa do tamanho de um mapa folium: dados embutidos nas camadas + um valor fixo."""
+    total, pendentes = 16 << 10, [mapa]
+    while pendentes:
+        elemento = pendentes.pop()
+        for atributo in ("dados", "data"):
+            valor = getattr(elemento, atributo, None)
+            if isinstance(valor, (str, dict, list)):
+                total += estimar_tamanho(valor)
+        pendentes.extend(getattr(elemento, "_children", {}).values())
+    return total
+
+
+def mapa_em_cache(tipo, df: pd.DataFrame, construtor, *parametros):
+    """
+    Mapa (ou camada) folium de `construtor()` para o recorte `df`, reaproveitado entre reruns e
+    sessões enquanto a versão do dataset e os filtros forem os mesmos (ver `src.cache.em_cache`).
+    Cliques e outras interações que não mudam os dados não reconstroem o mapa.
+    """
+    return em_cache(f"mapa_{tipo}", df, construtor, *parametros, tamanho=_tamanho_mapa)
+
+
+def exibir_mapa(mapa, camada=None, **kwargs):
+    """`st_folium` para mapas que podem estar no cache; `camada` vai em `feature_group_to_add`."""
+    # Sempre a camada antes do mapa, para duas exibições nunca esperarem uma pela outra em ciclo
+    with _lock_de(camada) if camada is not None else contextlib.nullcontext(), _lock_de(mapa):
+        try:
+            return st_folium(mapa, feature_group_to_add=camada, **kwargs)
+        finally:
+            if camada is not None:
+                # O st_folium anexa a camada ao mapa; ela não pode ficar no mapa guardado
+                mapa._children.pop(camada.get_name(), None)
+
+
+def _construir_mapa_municipios(df):
+    municipios = sorted(df["Município"].dropna().unique())
+    cor_por_municipio = cores_municipios(df)
 
     m = folium.Map(location=[df["Latitude"].mean(), df["Longitude"].mean()], zoom_start=7, control_scale=True)
-    for _, row in df.iterrows():
-        mun = row["Município"]
-        folium.Marker(
-            location=[row["Latitude"], row["Longitude"]],
-            tooltip=row['Nome da Família'],
-            popup=row['Nome da Família'],
-            icon=folium.Icon(color=cor_por_municipio[mun], icon="info-sign")
-        ).add_to(m)
+    CamadaMarcadores(
+        df,
+        campos_popup=[("Família", "Nome da Família")],
+        campo_dica="Família",
+        agrupar=False,
+        cores=cor_por_municipio,
+    ).add_to(m)
 
     # Legenda customizada
     legenda_html = """
-    <div style="position: fixed; bottom: 30px; left: 20px; width: 210px; z-index:9999; font-size:15px; 
+    <div style="position: fixed; bottom: 30px; left: 20px; width: 210px; z-index:9999; font-size:15px;
                 background-color: white; border: 1px solid #aaa; border-radius: 7px; padding: 8px 10px;">
       <b>Legenda: Município</b><br>
-      """ + "".join([f'<span style="color:{cor_por_municipio[m]}; font-size:1.2em;">&#9679;</span> {m}<br>' for m in municipios]) + """
+      """ + itens_legenda(cor_por_municipio, municipios) + """
     </div>
     """
     m.get_root().html.add_child(folium.Element(legenda_html))
-    output = st_folium(m, width=850, height=height, returned_objects=["last_object_clicked"])
+    return m
+
+
+def mostrar_mapa_folium(df, height=540):
+    com_coordenadas = df.dropna(subset=["Latitude", "Longitude"])
+    if com_coordenadas.empty:
+        st.warning("Nenhuma família encontrada para esse filtro.")
+        return None
+
+    m = mapa_em_cache("municipios", df, lambda: _construir_mapa_municipios(com_coordenadas))
+    output = exibir_mapa(
+        m, width=850, height=height, returned_objects=["last_object_clicked"], key="mapa_municipios"
+    )
     return output
@@ -0,0 +1,132 @@
+# Projeção da próxima safra para todas as séries (uma por município, produto ou comunidade) de uma vez
+
+import numpy as np
+import pandas as pd
+
+from src.cubo import matriz_anual
+from src.dataset import estrutura_derivada
+
+# Quantil 97,5% da t de Student para 1..30 graus de liberdade (acima disso, a normal)
+_T975 = np.array([
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+])
+Z975 = 1.96
+# Grade de parâmetros do Holt testada para cada série (alfa = nível, beta = tendência)
+ALFAS = np.array([0.2, 0.4, 0.6, 0.8, 1.0])
+BETAS = np.array([0.0, 0.1, 0.3, 0.5])
+
+
+def _t975(graus):
+    graus = np.asarray(graus)
+    return np.where(graus > len(_T975), Z975, _T975[np.clip(graus, 1, len(_T975)) - 1])
+
+
+def tendencia_linear(anos, matriz, presente, alvo):
+    """
+    Reta de mínimos quadrados em cada coluna de `matriz` (anos × séries), só nos anos presentes,
+    avaliada no ano `alvo`. Todas as séries são ajustadas juntas, com somas por coluna.
+    Devolve (previsão, limite inferior, limite superior) do intervalo de predição de 95%.
+    """
+    x = np.asarray(anos, dtype="float64")[:, None]
+    peso = presente.astype("float64")
+    y = np.where(presente, matriz, 0.0)
+    n = peso.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media_x = (peso * x).sum(axis=0) / n
+        media_y = y.sum(axis=0) / n
+        dx = np.where(presente, x - media_x, 0.0)
+        sxx = (dx ** 2).sum(axis=0)
+        inclinacao = (dx * (y - media_y)).sum(axis=0) / sxx
+        previsao = media_y + inclinacao * (alvo - media_x)
+
+        residuos = np.where(presente, y - (media_y + inclinacao * (x - media_x)), 0.0)
+        graus = n - 2
+        s = np.sqrt((residuos ** 2).sum(axis=0) / graus)
+        erro = s * np.sqrt(1 + 1 / n + (alvo - media_x) ** 2 / sxx)
+    margem = np.where(graus >= 1, _t975(graus.astype(int)) * erro, np.nan)
+    previsao = np.where(n >= 2, previsao, np.nan)
+    return previsao, previsao - margem, previsao + margem
+
+
+def holt(matriz, presente, alfas=ALFAS, betas=BETAS):
+    """
+    Suavização exponencial de Holt (nível + tendência) em todas as colunas de uma vez.
+
+    O laço é só sobre os anos; cada passo atualiza, de forma vetorizada, todas as séries e
+    todas as combinações (alfa, beta) da grade. Em anos sem registro o nível avança pela
+    tendência. Para cada série fica a combinação com menor erro quadrático das previsões
+    um passo à frente; o intervalo (~95%) usa o desvio desses erros.
+    """
+    n_anos, n_series = matriz.shape
+    alfa = np.repeat(alfas, len(betas))[:, None]
+    beta = np.tile(betas, len(alfas))[:, None]
+    forma = (len(alfa), n_series)
+    nivel, tendencia = np.zeros(forma), np.zeros(forma)
+    vistos = np.zeros(n_series, dtype=np.int64)
+    ultimo, ultimo_valor = np.zeros(n_series, dtype=np.int64), np.zeros(n_series)
+    sse, n_erros = np.zeros(forma), np.zeros(n_series)
+
+    for t in range(n_anos):
+        y, tem = matriz[t], presente[t]
+        esperado = nivel + tendencia
+        primeiro = tem & (vistos == 0)
+        segundo = tem & (vistos == 1)
+        seguinte = tem & (vistos >= 2)
+
+        erro = y - esperado
+        sse += np.where(seguinte, erro ** 2, 0.0)
+        n_erros += seguinte
+        novo_nivel = alfa * y + (1 - alfa) * esperado
+        nova_tendencia = beta * (novo_nivel - nivel) + (1 - beta) * tendencia
+        # Segunda observação: tendência inicial = variação média por ano desde a primeira
+        tendencia_inicial = (y - ultimo_valor) / np.maximum(t - ultimo, 1)
+
+        nivel = np.where(primeiro | segundo, y, np.where(seguinte, novo_nivel, esperado))
+        tendencia = np.where(segundo, tendencia_inicial, np.where(seguinte, nova_tendencia, tendencia))
+        vistos += tem
+        ultimo = np.where(tem, t, ultimo)
+        ultimo_valor = np.where(tem, y, ultimo_valor)
+
+    melhor = np.argmin(sse, axis=0)
+    colunas = np.arange(n_series)
+    previsao = (nivel + tendencia)[melhor, colunas]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        desvio = np.sqrt(sse[melhor, colunas] / n_erros)
+    margem = np.where(n_erros >= 1, Z975 * desvio, np.nan)
+    previsao = np.where(vistos >= 2, previsao, np.nan)
+    return previsao, previsao - margem, previsao + margem
+
+
+MODELOS = {
+    "Tendência linear": "linear",
+    "Holt (suavização exponencial)": "holt",
+}
+
+
+def _projetar(df, dimensao, modelo, medida):
+    matriz = matriz_anual(df, dimensao, medida)
+    alvo = int(matriz.anos[-1]) + 1
+    if modelo == "holt":
+        previsao, inferior, superior = holt(matriz.matriz, matriz.presente)
+    else:
+        previsao, inferior, superior = tendencia_linear(matriz.anos, matriz.matriz, matriz.presente, alvo)
+    # Produção não fica negativa: a reta ou a tendência podem cruzar o zero
+    return pd.DataFrame({
+        "ano": alvo,
+        "previsao": np.clip(previsao, 0, None),
+        "inferior": np.clip(inferior, 0, None),
+        "superior": np.clip(superior, 0, None),
+        "anos_com_dados": matriz.presente.sum(axis=0),
+    }, index=matriz.valores.rename(dimensao))
+
+
+def projecoes(df: pd.DataFrame, dimensao, modelo="linear", medida="volume") -> pd.DataFrame:
+    """
+    Projeção de `medida` para o ano seguinte ao último do dataset, para todos os valores da
+    dimensão, com intervalo de 95%. Calculada uma vez por versão, dimensão, modelo e medida.
+    """
+    return estrutura_derivada(
+        df, f"projecoes:{dimensao}:{modelo}:{medida}", lambda d: _projetar(d, dimensao, modelo, medida)
+    )
@@ -0,0 +1,87 @@
+# Rankings pré-calculados (posição de cada valor e top-k) por dimensão e métrica
+
+import numpy as np
+import pandas as pd
+
+from src.cubo import MEDIDAS, cubo_dataset
+from src.dataset import estrutura_derivada
+
+DIMENSOES_RANKING = ["Município", "Item de Produção Principal", "Comunidade"]
+
+
+def maiores_posicoes(valores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Posições dos `k` maiores valores (NaN ignorado), do maior para o menor.
+
+    Usa `argpartition` (linear) para separar os k primeiros e só eles são ordenados; nos
+    empates vence a posição menor, inclusive no corte do k-ésimo valor.
+    """
+    candidatos = np.flatnonzero(~np.isnan(valores))
+    if k <= 0 or len(candidatos) == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(candidatos):
+        corte = -np.partition(-valores[candidatos], k - 1)[k - 1]
+        acima = candidatos[valores[candidatos] > corte]
+        empatados = candidatos[valores[candidatos] == corte][:k - len(acima)]
+        candidatos = np.concatenate([acima, empatados])
+    return candidatos[np.lexsort((candidatos, -valores[candidatos]))]
+
+
+def maiores(serie: pd.Series, k: int) -> pd.Series:
+    """Equivalente a `serie.nlargest(k)` com `maiores_posicoes` (empates pela ordem da série)."""
+    return serie.iloc[maiores_posicoes(serie.to_numpy(dtype="float64"), k)]
+
+
+class Ranking:
+    """
+    Ranking de uma dimensão numa métrica, indexado pelo código de categoria.
+
+    `posicoes[codigo]` é a posição do valor (1 = maior; 0 = fora do ranking, ex.: sem dados);
+    empates recebem a mesma posição, a menor do grupo, como `rank(method="min")`. A ordem
+    completa é calculada uma vez, então posição e top-k são consultas diretas.
+    """
+
+    def __init__(self, valores: pd.Index, metrica: np.ndarray, dimensao=None):
+        self.valores = valores
+        self.dimensao = dimensao
+        self.metrica = metrica  # por código; NaN = fora do ranking
+        presentes = np.flatnonzero(~np.isnan(metrica))
+        self.ordem = presentes[np.lexsort((presentes, -metrica[presentes]))]
+        ordenados = -metrica[self.ordem]
+        self.posicoes = np.zeros(len(valores), dtype=np.int32)
+        self.posicoes[self.ordem] = np.searchsorted(ordenados, ordenados, side="left") + 1
+        self.total = len(self.ordem)
+
+    def posicao(self, valor):
+        """Posição de `valor` no ranking, ou None se ele não estiver ranqueado."""
+        codigo = self.valores.get_indexer([valor])[0]
+        if codigo < 0 or self.posicoes[codigo] == 0:
+            return None
+        return int(self.posicoes[codigo])
+
+    def top(self, k: int) -> pd.Series:
+        """Os `k` primeiros (valor -> métrica), em ordem de posição."""
+        codigos = self.ordem[:k]
+        return pd.Series(self.metrica[codigos], index=self.valores[codigos]).rename_axis(self.dimensao)
+
+
+class ServicoRankings:
+    """Um `Ranking` para cada dimensão de `DIMENSOES_RANKING` e cada medida do cubo."""
+
+    def __init__(self, df: pd.DataFrame, dimensoes=DIMENSOES_RANKING, metricas=MEDIDAS):
+        cubo = cubo_dataset(df)
+        self.rankings = {}
+        for dim in dimensoes:
+            valores = cubo.valores[dim]
+            # Medidas por código de categoria (NaN para valores sem registros)
+            totais = cubo.fatiar([dim]).reindex(valores)
+            for metrica in metricas:
+                self.rankings[dim, metrica] = Ranking(valores, totais[metrica].to_numpy(dtype="float64"), dim)
+
+    def ranking(self, dimensao, metrica) -> Ranking:
+        return self.rankings[dimensao, metrica]
+
+
+def rankings_dataset(df: pd.DataFrame) -> ServicoRankings:
+    """Rankings do dataset, recalculados só quando a versão muda."""
+    return estrutura_derivada(df, "rankings", ServicoRankings)
@@ -0,0 +1,117 @@
+# Redução de séries longas (muitos pontos) antes de irem para o navegador, mantendo picos e vales
+
+import numpy as np
+
+PRESELECAO = 4  # no LTTB, séries maiores que PRESELECAO × limite passam antes pelo mín-máx
+
+
+def _numerico(x) -> np.ndarray:
+    """Eixo x como float (datas viram nanossegundos; categorias e textos, a posição)."""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or np.issubdtype(x.dtype, np.timedelta64):
+        return x.astype("int64").astype("float64")
+    if np.issubdtype(x.dtype, np.number) or x.dtype == bool:
+        return x.astype("float64")
+    return np.arange(len(x), dtype="float64")
+
+
+def _primeiro_por_balde(balde, inicios, acertos) -> np.ndarray:
+    """Para cada balde, o primeiro índice em que `acertos` é verdadeiro (ou o início do balde)."""
+    escolhidos = inicios.copy()
+    posicoes = np.flatnonzero(acertos)
+    baldes, primeiros = np.unique(balde[posicoes], return_index=True)
+    escolhidos[baldes] = posicoes[primeiros]
+    return escolhidos
+
+
+def min_max(y, n) -> np.ndarray:
+    """
+    Índices do mínimo e do máximo de cada um de `n // 2` baldes de tamanho igual (mais o primeiro
+    e o último ponto), em ordem. Nenhum pico ou vale local se perde; NaN é ignorado.
+    """
+    y = np.asarray(y, dtype="float64")
+    m = len(y)
+    n_baldes = max(n // 2 - 1, 1)
+    if n >= m or m <= 2:
+        return np.arange(m)
+
+    inicios = (np.arange(n_baldes) * m // n_baldes).astype(np.int64)
+    balde = np.repeat(np.arange(n_baldes), np.diff(np.append(inicios, m)))
+    with np.errstate(invalid="ignore"):
+        minimos = np.fmin.reduceat(y, inicios)
+        maximos = np.fmax.reduceat(y, inicios)
+    indice_min = _primeiro_por_balde(balde, inicios, y == minimos[balde])
+    indice_max = _primeiro_por_balde(balde, inicios, y == maximos[balde])
+    return np.unique(np.concatenate([[0, m - 1], indice_min, indice_max]))
+
+
+def lttb(x, y, n) -> np.ndarray:
+    """
+    Índices de `n` pontos pelo Largest-Triangle-Three-Buckets: o primeiro e o último ponto e,
+    em cada balde do meio, o que forma o maior triângulo com o ponto escolhido no balde anterior
+    e a média do seguinte, o que preserva a forma da linha (picos e vales inclusive).
+
+    O algoritmo original é sequencial (cada escolha depende da anterior). Aqui cada passada
+    escolhe todos os baldes de uma vez, com os escolhidos da passada anterior; repete-se até
+    nada mudar. Um ponto fixo é exatamente o resultado sequencial, e na prática bastam poucas
+    passadas, cada uma vetorizada sobre todos os pontos.
+    """
+    x, y = _numerico(x), np.asarray(y, dtype="float64")
+    m = len(y)
+    if n >= m or n < 3:
+        return np.arange(m)
+
+    xi, yi = x[1:-1], y[1:-1]
+    finito = np.isfinite(yi)
+    limites = 1 + ((m - 2) * np.arange(n - 1) // (n - 2)).astype(np.int64)
+    inicios = limites[:-1] - 1  # posição de cada balde no miolo (sem o primeiro e o último ponto)
+    balde = np.repeat(np.arange(n - 2), np.diff(limites))
+
+    # Média (dos valores finitos) de cada balde: o ponto "c" do balde anterior
+    contagem = np.add.reduceat(finito, inicios)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media_x = np.add.reduceat(np.where(finito, xi, 0), inicios) / contagem
+        media_y = np.add.reduceat(np.where(finito, yi, 0), inicios) / contagem
+    c_x, c_y = np.append(media_x[1:], x[-1]), np.append(media_y[1:], y[-1])
+    # Baldes vazios de valores finitos não servem de referência: usa-se o último ponto
+    c_x, c_y = np.where(np.isfinite(c_y), c_x, x[-1]), np.where(np.isfinite(c_y), c_y, y[-1])
+
+    # Ponto "a" de partida: a média do balde anterior (o primeiro ponto, no primeiro balde)
+    a_x, a_y = np.append(x[0], media_x[:-1]), np.append(y[0], media_y[:-1])
+    escolhidos = None
+    for _ in range(n - 2):
+        a_x = np.where(np.isfinite(a_y), a_x, x[0])
+        a_y = np.where(np.isfinite(a_y), a_y, y[0] if np.isfinite(y[0]) else 0.0)
+        ax, ay, cx, cy = a_x[balde], a_y[balde], c_x[balde], c_y[balde]
+        area = np.abs((ax - cx) * (yi - ay) - (ax - xi) * (cy - ay))
+        area = np.where(finito, area, -1.0)
+        maximos = np.maximum.reduceat(area, inicios)
+        novos = _primeiro_por_balde(balde, inicios, area == maximos[balde])
+        if escolhidos is not None and np.array_equal(novos, escolhidos):
+            break
+        escolhidos = novos
+        a_x = np.append(x[0], xi[escolhidos[:-1]])
+        a_y = np.append(y[0], yi[escolhidos[:-1]])
+    return np.concatenate([[0], escolhidos + 1, [m - 1]])
+
+
+METODOS = {"lttb": "Largest-Triangle-Three-Buckets", "min_max": "Mínimo e máximo por balde"}
+
+
+def reduzir(x, y, limite, metodo="lttb") -> np.ndarray:
+    """
+    Índices (em ordem) dos pontos a desenhar para no máximo `limite` pontos; a série inteira se
+    ela já couber. No LTTB, séries muito longas passam antes pelo mín-máx (PRESELECAO × limite
+    pontos), que é linear e mantém os extremos dos quais o LTTB escolheria.
+    """
+    m = len(y)
+    if limite is None or m <= limite:
+        return np.arange(m)
+    if metodo == "min_max":
+        return min_max(y, limite)
+    if metodo != "lttb":
+        raise ValueError(f"Método de redução desconhecido: {metodo!r} (use um de {list(METODOS)})")
+    if m > PRESELECAO * limite:
+        candidatos = min_max(y, PRESELECAO * limite)
+        return candidatos[lttb(_numerico(x)[candidatos], np.asarray(y, dtype="float64")[candidatos], limite)]
+    return lttb(x, y, limite)
@@ -0,0 +1,30 @@
+# Normalização de textos para comparações tolerantes (busca, nomes de municípios)
+
+import unicodedata
+
+
+class _Tabela(dict):
+    """Tabela de `str.translate` preenchida sob demanda: cada caractere é avaliado uma vez só."""
+
+    def __init__(self, regra):
+        super().__init__()
+        self.regra = regra
+
+    def __missing__(self, codigo):
+        self[codigo] = valor = self.regra(chr(codigo))
+        return valor
+
+
+_SEM_ACENTOS = _Tabela(lambda c: "" if unicodedata.combining(c) else c)
+_SO_ALFANUMERICOS = _Tabela(lambda c: c if c.isalnum() else " ")
+
+
+def normalizar(texto) -> str:
+    """Minúsculas, sem acentos e só com letras/números separados por espaço."""
+    texto = unicodedata.normalize("NFKD", str(texto)).translate(_SEM_ACENTOS).lower()
+    return texto.translate(_SO_ALFANUMERICOS)
+
+
+def normalizar_nome(texto) -> str:
+    """Nome normalizado para junções: como `normalizar`, com espaços simples e sem bordas."""
+    return " ".join(normalizar(texto).split())
@@ -0,0 +1,210 @@
+# Busca espacial dos produtores mais próximos (k vizinhos e raio, em km)
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from src.dataset import estrutura_derivada
+
+RAIO_TERRA_KM = 6371.0088
+TAMANHO_FOLHA = 32
+# Com filtros muito seletivos sobram poucos candidatos: compará-los todos de uma vez é mais
+# rápido do que percorrer a árvore pulando folhas sem nenhum ponto que passe no filtro
+LIMITE_FORCA_BRUTA = 20_000
+
+
+def vetores_unitarios(lat, lon) -> np.ndarray:
+    """Pontos na esfera unitária: a distância em linha reta (corda) cresce com a distância na superfície."""
+    lat = np.radians(np.asarray(lat, dtype="float64"))
+    lon = np.radians(np.asarray(lon, dtype="float64"))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def corda_para_km(corda2) -> np.ndarray:
+    """Quadrado da corda na esfera unitária -> distância de grande círculo em km (haversine)."""
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.clip(np.sqrt(corda2) / 2, 0, 1))
+
+
+def km_para_corda(km) -> float:
+    """Distância em km -> quadrado da corda equivalente na esfera unitária."""
+    return (2 * np.sin(min(km / RAIO_TERRA_KM, np.pi) / 2)) ** 2
+
+
+class ArvoreKD:
+    """
+    KD-tree estática em arrays NumPy.
+
+    Os pontos são reordenados para que cada nó ocupe uma fatia contígua; as folhas têm até
+    `tamanho_folha` pontos e são avaliadas de forma vetorizada. Cada nó guarda a caixa
+    envolvente, usada como limite inferior de distância para podar a busca.
+    """
+
+    def __init__(self, pontos: np.ndarray, tamanho_folha=TAMANHO_FOLHA):
+        ordem = np.arange(len(pontos))
+        inicio, fim, esquerda, direita, minimos, maximos = [], [], [], [], [], []
+        pilha = [(0, len(pontos), -1, False)]
+        while pilha:
+            ini, fi, pai, lado_direito = pilha.pop()
+            no = len(inicio)
+            if pai >= 0:
+                (direita if lado_direito else esquerda)[pai] = no
+            trecho = pontos[ordem[ini:fi]]
+            minimo, maximo = trecho.min(axis=0), trecho.max(axis=0)
+            inicio.append(ini)
+            fim.append(fi)
+            esquerda.append(-1)
+            direita.append(-1)
+            minimos.append(minimo)
+            maximos.append(maximo)
+            if fi - ini <= tamanho_folha:
+                continue
+            eixo = int(np.argmax(maximo - minimo))
+            meio = (ini + fi) // 2
+            segmento = ordem[ini:fi]
+            ordem[ini:fi] = segmento[np.argpartition(trecho[:, eixo], meio - ini)]
+            pilha.append((meio, fi, no, True))
+            pilha.append((ini, meio, no, False))
+
+        self.ordem = ordem  # posição (na entrada) do i-ésimo ponto da árvore
+        self.pontos = pontos[ordem]
+        self.inicio, self.fim = np.array(inicio), np.array(fim)
+        self.esquerda, self.direita = np.array(esquerda), np.array(direita)
+        self.minimos, self.maximos = np.array(minimos), np.array(maximos)
+
+    def _distancia_caixa(self, q, no) -> float:
+        excesso = np.maximum(self.minimos[no] - q, 0) + np.maximum(q - self.maximos[no], 0)
+        return float(excesso @ excesso)
+
+    def _folha(self, q, no, mascara):
+        """Posições (na entrada) e distâncias² dos pontos da folha que passam na máscara."""
+        fatia = slice(self.inicio[no], self.fim[no])
+        posicoes = self.ordem[fatia]
+        pontos = self.pontos[fatia]
+        if mascara is not None:
+            passam = mascara[posicoes]
+            posicoes, pontos = posicoes[passam], pontos[passam]
+        diferenca = pontos - q
+        return posicoes, np.einsum("ij,ij->i", diferenca, diferenca)
+
+    def k_vizinhos(self, q, k, limite2=np.inf, mascara=None):
+        """Até `k` pontos mais próximos de `q` (distância² ≤ `limite2`), em ordem de distância."""
+        melhores = (np.empty(0, dtype=np.int64), np.empty(0))
+        fila = [(self._distancia_caixa(q, 0), 0)]
+        while fila:
+            d_caixa, no = heapq.heappop(fila)
+            pior = melhores[1].max() if len(melhores[1]) == k else limite2
+            if d_caixa > pior:
+                break
+            if self.esquerda[no] < 0:
+                posicoes, d2 = self._folha(q, no, mascara)
+                perto = d2 <= pior
+                posicoes = np.concatenate([melhores[0], posicoes[perto]])
+                d2 = np.concatenate([melhores[1], d2[perto]])
+                if len(d2) > k:
+                    manter = np.argpartition(d2, k - 1)[:k]
+                    posicoes, d2 = posicoes[manter], d2[manter]
+                melhores = (posicoes, d2)
+                continue
+            for filho in (self.esquerda[no], self.direita[no]):
+                heapq.heappush(fila, (self._distancia_caixa(q, filho), filho))
+        ordem = np.argsort(melhores[1], kind="stable")
+        return melhores[0][ordem], melhores[1][ordem]
+
+    def no_raio(self, q, limite2, mascara=None):
+        """Todos os pontos a distância² ≤ `limite2` de `q`, em ordem de distância."""
+        achados_posicoes, achados_d2 = [], []
+        pilha = [0]
+        while pilha:
+            no = pilha.pop()
+            if self._distancia_caixa(q, no) > limite2:
+                continue
+            if self.esquerda[no] < 0:
+                posicoes, d2 = self._folha(q, no, mascara)
+                perto = d2 <= limite2
+                achados_posicoes.append(posicoes[perto])
+                achados_d2.append(d2[perto])
+            else:
+                pilha.extend((self.esquerda[no], self.direita[no]))
+        posicoes = np.concatenate(achados_posicoes) if achados_posicoes else np.empty(0, dtype=np.int64)
+        d2 = np.concatenate(achados_d2) if achados_d2 else np.empty(0)
+        ordem = np.argsort(d2, kind="stable")
+        return posicoes[ordem], d2[ordem]
+
+
+IDENTIDADE_PRODUTOR = ["Nome da Família", "Município", "Comunidade"]
+
+
+class ProdutoresProximos:
+    """
+    Índice espacial com um ponto por produtor: famílias com o mesmo nome em municípios ou
+    comunidades diferentes são produtores distintos (`IDENTIDADE_PRODUTOR`).
+
+    As consultas aceitam uma máscara sobre as linhas do DataFrame (ex.: produto e
+    certificação escolhidos): um produtor entra se qualquer registro seu passa na máscara, e é
+    representado pelo registro mais recente entre os que passam. Devolve posições de linha
+    ordenadas pela distância.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        lat = df["Latitude"].to_numpy(dtype="float64")
+        lon = df["Longitude"].to_numpy(dtype="float64")
+        identidade = df.groupby(IDENTIDADE_PRODUTOR, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+        validas = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+        # Registros de cada produtor em sequência, do ano mais antigo ao mais recente
+        self.ordem = validas[np.lexsort((df["Ano"].to_numpy()[validas], identidade[validas]))]
+        grupos = identidade[self.ordem]
+        self.inicios = np.flatnonzero(np.append(True, grupos[1:] != grupos[:-1]))
+        ultimos = np.append(self.inicios[1:], len(self.ordem)) - 1
+        self.linhas = self.ordem[ultimos]  # registro mais recente de cada produtor
+        self.pontos = vetores_unitarios(lat[self.linhas], lon[self.linhas])
+        self.arvore = ArvoreKD(self.pontos)
+
+    def _representantes(self, mascara) -> np.ndarray:
+        """Por produtor, a linha mais recente que passa na máscara (-1 se nenhuma passa)."""
+        passam = mascara[self.ordem]
+        posicoes = np.where(passam, np.arange(len(self.ordem)), -1)
+        ultima = np.maximum.reduceat(posicoes, self.inicios) if len(posicoes) else posicoes
+        return np.where(ultima >= 0, self.ordem[np.maximum(ultima, 0)], -1)
+
+    def consultar(self, lat, lon, k=10, raio_km=None, mascara=None):
+        """
+        (posições no DataFrame, distâncias em km) dos `k` produtores mais próximos de (lat, lon),
+        opcionalmente só até `raio_km` e só entre as linhas com `mascara` verdadeira.
+        Com `k=None`, devolve todos os que estão no raio.
+        """
+        q = vetores_unitarios([lat], [lon])[0]
+        limite2 = km_para_corda(raio_km) if raio_km else np.inf
+        linhas = self.linhas if mascara is None else self._representantes(mascara)
+        candidatos = None if mascara is None else linhas >= 0
+
+        if candidatos is not None and candidatos.sum() <= LIMITE_FORCA_BRUTA:
+            posicoes = np.flatnonzero(candidatos)
+            diferenca = self.pontos[posicoes] - q
+            d2 = np.einsum("ij,ij->i", diferenca, diferenca)
+            dentro = d2 <= limite2
+            posicoes, d2 = posicoes[dentro], d2[dentro]
+            if k is not None and len(d2) > k:
+                manter = np.argpartition(d2, k - 1)[:k]
+                posicoes, d2 = posicoes[manter], d2[manter]
+            ordem = np.argsort(d2, kind="stable")
+            posicoes, d2 = posicoes[ordem], d2[ordem]
+        elif k is None:
+            posicoes, d2 = self.arvore.no_raio(q, limite2, candidatos)
+        else:
+            posicoes, d2 = self.arvore.k_vizinhos(q, k, limite2, candidatos)
+        return linhas[posicoes], corda_para_km(d2)
+
+
+def produtores_proximos(df: pd.DataFrame) -> ProdutoresProximos:
+    """Índice de produtores mais próximos do dataset, construído uma vez por versão."""
+    return estrutura_derivada(df, "produtores_proximos", ProdutoresProximos)
+
+
+def centros_municipios(df: pd.DataFrame) -> pd.DataFrame:
+    """Latitude/longitude média de cada município (pontos de partida da busca), uma vez por versão."""
+    return estrutura_derivada(
+        df, "centros_municipios",
+        lambda d: d.groupby("Município", observed=True)[["Latitude", "Longitude"]].mean().dropna(),
+    )
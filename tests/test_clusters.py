@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from src.clusters import ZOOM_MAXIMO, IndiceClusters
+
+
+def _familias_repetidas():
+    # Cada família aparece uma vez por ano, sempre no mesmo lugar, como nos dados do projeto
+    lugares = [(-10.91, -37.07), (-10.52, -37.41), (-11.27, -37.45)]
+    linhas = [(lat, lon, ano) for lat, lon in lugares for ano in (2022, 2023, 2024)]
+    return pd.DataFrame(linhas, columns=["Latitude", "Longitude", "Ano"])
+
+
+def test_pontos_no_mesmo_lugar_ficam_agrupados_antes_do_zoom_maximo():
+    visiveis = IndiceClusters(_familias_repetidas()).consultar(ZOOM_MAXIMO - 1)
+    assert (visiveis["contagem"] == 3).all()
+
+
+def test_pontos_no_mesmo_lugar_viram_avulsos_no_zoom_maximo():
+    df = _familias_repetidas()
+    indice = IndiceClusters(df)
+    for zoom in (ZOOM_MAXIMO, ZOOM_MAXIMO + 2):
+        visiveis = indice.consultar(zoom)
+        assert (visiveis["contagem"] == 1).all()
+        assert sorted(visiveis["linha"]) == list(range(len(df)))
+        # Espalhados em volta do lugar: posições distintas, todas a poucos metros dele
+        assert len(visiveis[["lat", "lon"]].drop_duplicates()) == len(df)
+        origem = df.iloc[visiveis["linha"].to_numpy()]
+        assert np.allclose(visiveis["lat"], origem["Latitude"], atol=1e-3)
+        assert np.allclose(visiveis["lon"], origem["Longitude"], atol=1e-3)